@@ -0,0 +1,220 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+
+"""dumpsys解析吞吐量及正确性测试
+
+使用corpus目录下的样本数据，不需要连接设备。使用方法：
+
+    python -m benchmark.bench_dumpsys [轮数] [样本名...]
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+
+from manager.activitymanager import ActivityManager
+from manager.snapshot import DeviceSnapshot, EnumSnapshotSection
+from manager.windowmanager import WindowManager
+from utils.logger import Log
+
+corpus_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+
+class CorpusSample(object):
+    """样本数据
+
+    每个样本目录包含：
+    window.txt          `dumpsys window windows`的输出
+    window_focus.txt    10.0及以上版本焦点窗口相关的行（可选）
+    activity.txt        `dumpsys activity activities`的输出
+    expected.json       期望的解析结果
+    """
+
+    def __init__(self, name, path):
+        self._name = name
+        self._sections = {}
+        self._size = 0
+        for section, file_name in (
+            (EnumSnapshotSection.Window, "window.txt"),
+            (EnumSnapshotSection.WindowFocus, "window_focus.txt"),
+            (EnumSnapshotSection.Activity, "activity.txt"),
+        ):
+            file_path = os.path.join(path, file_name)
+            if not os.path.exists(file_path):
+                continue
+            with open(file_path, "rb") as fp:
+                data = fp.read()
+            self._size += len(data)
+            self._sections[section] = data.decode("utf8").splitlines()
+        with open(os.path.join(path, "expected.json")) as fp:
+            self._expected = json.load(fp)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def size(self):
+        """样本数据字节数"""
+        return self._size
+
+    @property
+    def expected(self):
+        return self._expected
+
+    def create_snapshot(self):
+        return DeviceSnapshot(None, self._sections)
+
+
+def load_corpus(names=None):
+    """加载样本数据
+
+    :param names: 只加载这些样本，为None时加载全部
+    :type  names: list
+    """
+    result = []
+    for name in sorted(os.listdir(corpus_dir)):
+        path = os.path.join(corpus_dir, name)
+        if not os.path.isdir(path):
+            continue
+        if names and name not in names:
+            continue
+        result.append(CorpusSample(name, path))
+    return result
+
+
+def parse_sample(sample):
+    """解析样本，返回与expected.json格式相同的结果"""
+    snapshot = sample.create_snapshot()
+    window_manager = WindowManager(None)
+    window_manager.update(snapshot)
+    activity_manager = ActivityManager(None)
+    activity_manager.update(None, snapshot)
+
+    windows = []
+    for window in window_manager.get_window_list():
+        windows.append(
+            [
+                window.hashcode,
+                window.title,
+                window.package_name,
+                list(window.position),
+                list(window.size),
+                window.attached_hashcode,
+            ]
+        )
+    activities = []
+    for activity in activity_manager.get_activity_list():
+        activities.append(
+            [
+                activity.hashcode,
+                activity.name,
+                activity.package_name,
+                activity.process_name,
+                activity.state,
+            ]
+        )
+    current_window = window_manager.get_current_window()
+    resumed_activity = activity_manager.get_resumed_activity()
+    return {
+        "current_window": current_window.hashcode if current_window else None,
+        "windows": windows,
+        "resumed_activity": resumed_activity.hashcode if resumed_activity else None,
+        "activities": activities,
+    }
+
+
+def check_sample(sample, result):
+    """检查解析结果，返回错误信息列表"""
+    errors = []
+    expected = sample.expected
+    for key in ("current_window", "resumed_activity"):
+        if result[key] != expected[key]:
+            errors.append("%s: %s != %s" % (key, result[key], expected[key]))
+    for key in ("windows", "activities"):
+        result_dict = dict((it[0], it) for it in result[key])
+        for item in expected[key]:
+            if item[0] not in result_dict:
+                errors.append("%s: %s not found" % (key, item[0]))
+            elif result_dict[item[0]] != item:
+                errors.append("%s: %s != %s" % (key, result_dict[item[0]], item))
+        if len(result[key]) != len(expected[key]):
+            errors.append(
+                "%s: count %d != %d" % (key, len(result[key]), len(expected[key]))
+            )
+    return errors
+
+
+def main(rounds=100, *names):
+    Log.get_logger().setLevel(logging.ERROR)  # 避免解析时的警告日志影响输出
+    samples = load_corpus(names)
+    print(
+        "%-20s %8s %10s %12s  %s"
+        % ("sample", "size(KB)", "MB/s", "windows/s", "result")
+    )
+    total_size = total_windows = total_time = 0
+    failed = 0
+    for sample in samples:
+        try:
+            result = parse_sample(sample)
+        except Exception as e:
+            failed += 1
+            print("%-20s %8.1f  ERROR: %r" % (sample.name, sample.size / 1024.0, e))
+            continue
+        errors = check_sample(sample, result)
+        time0 = time.time()
+        for _ in range(rounds):
+            parse_sample(sample)
+        cost = time.time() - time0
+        window_count = len(result["windows"]) * rounds
+        print(
+            "%-20s %8.1f %10.2f %12.0f  %s"
+            % (
+                sample.name,
+                sample.size / 1024.0,
+                sample.size * rounds / cost / 1024 / 1024,
+                window_count / cost,
+                "OK" if not errors else "FAIL",
+            )
+        )
+        for error in errors:
+            print("    %s" % error)
+        if errors:
+            failed += 1
+        total_size += sample.size * rounds
+        total_windows += window_count
+        total_time += cost
+    if total_time:
+        print(
+            "%-20s %8s %10.2f %12.0f  %d/%d passed"
+            % (
+                "total",
+                "",
+                total_size / total_time / 1024 / 1024,
+                total_windows / total_time,
+                len(samples) - failed,
+                len(samples),
+            )
+        )
+    return failed
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    rounds = int(args.pop(0)) if args else 100
+    sys.exit(1 if main(rounds, *args) else 0)
@@ -0,0 +1,195 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+
+"""窗口和Activity记录的内存分配测试
+
+对比旧的基于`_attrs`字典的实现与`__slots__`实现，输出每轮刷新的分配内存、
+常驻内存及耗时。使用方法：
+
+    python -m benchmark.bench_records [窗口数] [Activity数] [轮数]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from manager.activitymanager import Activity, ActivityManager, ActivityRecord
+from manager.windowmanager import Window, WindowManager
+
+
+class LegacyWindow(object):
+    """旧版窗口类，用于对比"""
+
+    def __init__(self, win_manager, _id, hashcode, title):
+        self._win_manager = win_manager
+        self._id = _id
+        self._hashcode = hashcode
+        self._title = title
+        self._attrs = {}
+
+    def __setitem__(self, key, val):
+        self._attrs[key] = val
+        if key in ("x", "y", "w", "h"):
+            self._attrs[key] = int(self._attrs[key])
+
+    @property
+    def title(self):
+        if "/" in self._title:
+            pkg, self._title = self._title.split("/")
+            if self._title[0] == ".":
+                self._title = pkg + self._title
+        return self._title
+
+
+class LegacyActivity(object):
+    """旧版Activity类，用于对比"""
+
+    def __init__(self, _id, activity_record):
+        self._id = _id
+        self._activity_record = activity_record
+        self._attrs = {}
+        self._name = None
+
+    def __setitem__(self, key, val):
+        self._attrs[key] = val
+        if key in ("realActivity", "mActivityComponent"):
+            self._name = None
+
+
+def gen_window_fields(count):
+    """生成窗口解析结果"""
+    result = []
+    for i in range(count):
+        fields = {
+            "id": i,
+            "hashcode": "%07x" % (0xA000000 + i),
+            "title": "com.tencent.demo%d/.ui.MainActivity%d" % (i % 5, i),
+            "package": "com.tencent.demo%d" % (i % 5),
+            "x": (i * 7) % 100,
+            "y": (i * 13) % 200,
+            "w": 1080,
+            "h": 1920 - i % 300,
+        }
+        if i % 3 == 2:
+            fields["attached"] = (result[i - 1]["hashcode"], result[i - 1]["title"])
+        result.append(fields)
+    return result
+
+
+def gen_activity_fields(count):
+    """生成Activity解析结果"""
+    result = []
+    for i in range(count):
+        pkg = "com.tencent.demo%d" % (i % 5)
+        result.append(
+            (
+                i,
+                "%07x" % (0xB000000 + i),
+                {
+                    "packageName": pkg,
+                    "processName": pkg,
+                    "realActivity": "%s/.ui.MainActivity%d" % (pkg, i),
+                    "state": "STOPPED",
+                },
+            )
+        )
+    return result
+
+
+def build_legacy_windows(win_manager, window_fields):
+    windows = []
+    for fields in window_fields:
+        window = LegacyWindow(
+            win_manager, fields["id"], fields["hashcode"], fields["title"]
+        )
+        for key in ("package", "w", "h"):
+            window[key] = str(fields[key])
+        window["x"] = fields["x"]
+        window["y"] = fields["y"]
+        if "attached" in fields:
+            hashcode, title = fields["attached"]
+            window["mAttachedWindow"] = LegacyWindow(win_manager, 0, hashcode, title)
+        window.title
+        windows.append(window)
+    return windows
+
+
+def build_windows(win_manager, window_fields):
+    return win_manager._build_windows(window_fields)
+
+
+def build_legacy_activities(activity_fields):
+    activities = []
+    for _id, hashcode, attrs in activity_fields:
+        record = ActivityRecord(hashcode, 0, attrs["realActivity"])
+        activity = LegacyActivity(_id, record)
+        for key in attrs:
+            activity[key] = attrs[key]
+        activities.append(activity)
+    return activities
+
+
+def build_activities(activity_fields):
+    activities = []
+    for _id, hashcode, attrs in activity_fields:
+        record = ActivityRecord(hashcode, 0, attrs["realActivity"])
+        activities.append(Activity(_id, record, attrs))
+    return activities
+
+
+def measure(func, rounds):
+    """返回(每轮分配字节数, 常驻字节数, 每轮耗时)"""
+    tracemalloc.start()
+    snapshot0 = tracemalloc.take_snapshot()
+    result = func()
+    snapshot1 = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(it.size_diff for it in snapshot1.compare_to(snapshot0, "filename"))
+    del result
+
+    tracemalloc.start()
+    for _ in range(rounds):
+        func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    time0 = time.time()
+    for _ in range(rounds):
+        func()
+    return peak, retained, (time.time() - time0) / rounds
+
+
+def main(window_count=200, activity_count=200, rounds=200):
+    win_manager = WindowManager(None)
+    window_fields = gen_window_fields(window_count)
+    activity_fields = gen_activity_fields(activity_count)
+    cases = [
+        ("Window (before)", lambda: build_legacy_windows(win_manager, window_fields)),
+        ("Window (after)", lambda: build_windows(win_manager, window_fields)),
+        ("Activity (before)", lambda: build_legacy_activities(activity_fields)),
+        ("Activity (after)", lambda: build_activities(activity_fields)),
+    ]
+    print("%-20s %12s %12s %12s" % ("case", "peak(KB)", "retained(KB)", "time(ms)"))
+    for name, func in cases:
+        peak, retained, cost = measure(func, rounds)
+        print(
+            "%-20s %12.1f %12.1f %12.3f"
+            % (name, peak / 1024.0, retained / 1024.0, cost * 1000)
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(it) for it in sys.argv[1:]])
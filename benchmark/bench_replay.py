@@ -0,0 +1,105 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""回放录制的会话，统计获取窗口、获取控件树及探测控件各阶段的耗时
+
+设置环境变量ANDROIDUISPY_RECORD为会话文件路径后启动AndroidUISpy，选择设备并获取控件树，
+关闭窗口时会保存会话文件。不需要连接设备，使用方法：
+
+    python -m benchmark.bench_replay 会话文件 [轮数] [耗时倍数]
+
+耗时倍数为0时只统计本地处理耗时，为1时按录制时的设备响应耗时等待
+"""
+
+import logging
+import sys
+import time
+
+from manager import BaseManager
+from manager.controlmanager import ControlManager
+from manager.driverpool import DriverPool
+from manager.windowmanager import WindowManager
+from utils.logger import Log
+from utils.replay import ReplayPlayer, ReplaySession
+
+
+def run_once(session, latency_scale):
+    """回放一次完整流程，返回[(阶段, 耗时), ...]"""
+    player = ReplayPlayer(session, latency_scale)
+    device = player.device
+    prefix = "%s:" % device._device_id
+    for key in list(BaseManager.instance_dict):
+        if key.startswith(prefix):
+            BaseManager.instance_dict.pop(key)  # 每轮使用新的Manager，不复用缓存
+    DriverPool.get_instance(device).set_driver_factory(player.create_driver)
+    control_manager = ControlManager.get_instance(device)
+    result = []
+
+    time0 = time.time()
+    control_manager.get_snapshot(True)
+    WindowManager.get_instance(device).get_current_window()
+    result.append(("window", time.time() - time0))
+
+    time0 = time.time()
+    controls_dict = control_manager.get_control_tree(True)
+    result.append(("control_tree", time.time() - time0))
+
+    time0 = time.time()
+    for items in controls_dict.values():
+        for root in items[1:]:
+            store = root.store
+            _, _, width, height = store.get_rect(root.index)
+            for x in range(0, width, 20):
+                for y in range(0, height, 20):
+                    store.hit_test(x, y, root.index)
+    result.append(("inspect", time.time() - time0))
+    return result
+
+
+def main(path, rounds=10, latency_scale=0):
+    Log.get_logger().setLevel(logging.ERROR)
+    session = ReplaySession.load(path)
+    print("device: %s, records: %d" % (session.device_id, len(session.records)))
+    costs = {}
+    names = []
+    for _ in range(rounds):
+        for name, cost in run_once(session, latency_scale):
+            if name not in costs:
+                names.append(name)
+            costs.setdefault(name, []).append(cost)
+    print("%-14s %10s %10s %10s" % ("phase", "min(ms)", "avg(ms)", "max(ms)"))
+    for name in names:
+        items = costs[name]
+        print(
+            "%-14s %10.2f %10.2f %10.2f"
+            % (
+                name,
+                min(items) * 1000,
+                sum(items) / len(items) * 1000,
+                max(items) * 1000,
+            )
+        )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+    main(
+        args[0],
+        int(args[1]) if len(args) > 1 else 10,
+        float(args[2]) if len(args) > 2 else 0,
+    )
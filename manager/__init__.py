@@ -16,6 +16,8 @@
 """管理界面需要的各种数据
 """
 
+SHELL_OUTPUT_END_MARK = "__ANDROIDUISPY_EOF__"  # 流式读取shell输出时的结束标记
+
 
 class BaseManager(object):
     """Manager基类"""
@@ -36,3 +38,41 @@ class BaseManager(object):
     def update(self):
         """刷新数据"""
         pass
+
+    def _iter_shell_output(self, cmdline):
+        """流式读取shell命令的输出，逐行返回
+
+        调用方可以随时停止迭代，剩余的输出由adb的接收线程自行读完
+
+        :param cmdline: 要执行的shell命令
+        :type  cmdline: string
+        """
+        cmdline = "%s; echo %s" % (cmdline, SHELL_OUTPUT_END_MARK)
+        proc = self._device.adb.run_shell_cmd(cmdline, sync=False)
+        if isinstance(proc, (bytes, str)):
+            # 不支持异步执行时退化为一次性读取
+            if isinstance(proc, bytes):
+                proc = proc.decode("utf8", "replace")
+            lines = proc.replace("\r", "").split("\n")
+            for line in lines:
+                if line == SHELL_OUTPUT_END_MARK:
+                    return
+                if line:
+                    yield line
+            return
+
+        # qt4a的ADBPopen没有kill、wait，readline在没有数据时会一直等待而不是返回空，
+        # 只能依靠结束标记判断输出结束
+        while True:
+            line = proc.stdout.readline()
+            if not line:
+                if proc.poll() is not None:
+                    return
+                continue
+            if isinstance(line, bytes):
+                line = line.decode("utf8", "replace")
+            line = line.rstrip("\r\n")
+            if line == SHELL_OUTPUT_END_MARK:
+                return
+            if line:
+                yield line
@@ -18,11 +18,30 @@
 
 import re
 from manager import BaseManager
+from manager.dumpsys import DumpsysQuery
+from manager.dumpsysgrammar import DumpsysGrammar, DumpsysRule
+from utils.logger import Log
+
+pattern_stack = re.compile(r"^  Stack #(\d+).*:.*$")
+pattern_task = re.compile(r"^\s+\* Task(Record){0,1}\{(\w{6,8}).+")
+pattern_hist = re.compile(r"^\s+\* Hist #(\d+): ActivityRecord{(\w{5,8})(.+)}$")
+pattern_resumed = re.compile(
+    r"^\s+m?(?:Resumed|Focused)Activity[:=]\s*ActivityRecord\{(\w{5,8}) "
+)
+
+
+class EnumParseEvent(object):
+    """activity数据解析事件"""
+
+    Activity = 0  # 解析出一个Activity
+    ResumedActivity = 1  # 解析出前台Activity
 
 
 class TaskStack(object):
     """任务栈"""
 
+    __slots__ = ("_id", "_tasks")
+
     def __init__(self, _id):
         self._id = _id
         self._tasks = []
@@ -44,6 +63,8 @@ class TaskStack(object):
 class Task(object):
     """任务"""
 
+    __slots__ = ("_id", "_task_record", "_activities")
+
     def __init__(self, _id):
         self._id = _id
         self._task_record = None
@@ -75,6 +96,8 @@ class Task(object):
 class TaskRecord(object):
     """ """
 
+    __slots__ = ("_hashcode", "_task_id", "_package_name")
+
     def __init__(self, hashcode, task_id, package_name):
         self._hashcode = hashcode
         self._task_id = task_id
@@ -90,154 +113,356 @@ class TaskRecord(object):
 
 
 class Activity(object):
-    """ """
-
-    def __init__(self, _id, activity_record):
+    """Activity，字段在创建时解析完成，之后不可修改"""
+
+    __slots__ = (
+        "_id",
+        "_activity_record",
+        "_name",
+        "_package_name",
+        "_process_name",
+        "_state",
+    )
+
+    # 需要从dumpsys中解析的属性
+    attr_keys = (
+        "processName",
+        "packageName",
+        "realActivity",
+        "state",
+        "mActivityComponent",
+    )
+
+    def __init__(self, _id, activity_record, attrs):
+        """
+
+        :param attrs: 从dumpsys中解析出的属性
+        :type  attrs: dict
+        """
         self._id = _id
         self._activity_record = activity_record
-        self._attrs = {}
+        self._name = None
+        activity = attrs.get("realActivity") or attrs.get("mActivityComponent")
+        if activity and "/" in activity:
+            pkg, activity = activity.split("/", 1)
+            if activity[:1] == ".":
+                activity = pkg + activity
+            self._name = activity
+        self._package_name = attrs.get("packageName")
+        self._process_name = attrs.get("processName")
+        self._state = attrs.get("state")
+
+    def __eq__(self, activity):
+        if activity == None:
+            return False
+        return self.hashcode == activity.hashcode
+
+    def __ne__(self, activity):
+        return not self.__eq__(activity)
+
+    def __hash__(self):
+        return hash(self.hashcode)
+
+    @property
+    def hashcode(self):
+        return self._activity_record.hashcode
+
+    @property
+    def activity_record(self):
+        return self._activity_record
 
     @property
     def name(self):
-        """Activity名称"""
-        try:
-            activity = self._attrs["realActivity"]
-        except KeyError:
-            activity = self._attrs["mActivityComponent"]
-        pkg, activity = activity.split("/")
-        if activity[0] == ".":
-            activity = pkg + activity
-        return activity
+        """Activity名称，解析失败时为None"""
+        return self._name
 
     @property
     def package_name(self):
         """所在包名"""
-        return self._attrs["packageName"]
+        return self._package_name
 
     @property
     def process_name(self):
         """所在进程名"""
-        return self._attrs["processName"]
+        return self._process_name
 
-    def __setitem__(self, key, val):
-        self._attrs[key] = val
+    @property
+    def state(self):
+        """Activity状态"""
+        return self._state
 
     def __str__(self):
-        result = "<Activity at 0x%X id=%d activity_record=%s " % (
-            id(self),
-            self._id,
-            self._activity_record,
+        return (
+            "<Activity at 0x%X id=%d activity_record=%s name=%s packageName=%s processName=%s state=%s>"
+            % (
+                id(self),
+                self._id,
+                self._activity_record,
+                self._name,
+                self._package_name,
+                self._process_name,
+                self._state,
+            )
         )
-        for attr in self._attrs:
-            result += "%s=%s " % (attr, self._attrs[attr])
-        result += ">"
-        return result
 
 
 class ActivityRecord(object):
     """Activity记录"""
 
+    __slots__ = ("_hashcode", "_task_id", "_activity")
+
     def __init__(self, hashcode, task_id, activity):
         self._hashcode = hashcode
         self._task_id = task_id
         self._activity = activity
 
+    def __str__(self):
+        return "<ActivityRecord hashcode=0x%s task_id=%d activity=%s>" % (
+            self._hashcode,
+            self._task_id,
+            self._activity,
+        )
+
+    @property
+    def hashcode(self):
+        return self._hashcode
+
 
 class ActivityManager(BaseManager):
     """Activity管理"""
 
+    grammar = DumpsysGrammar(
+        [
+            DumpsysRule("Main", "_on_main_stack", r"^  Main stack:$"),
+            DumpsysRule("Stack", "_on_stack", pattern_stack),
+            # 12.0开始不再输出Stack，最外层的Task即为根任务
+            DumpsysRule(
+                "* Task", "_on_root_task", pattern_task, indent=2, min_sdk_version=31
+            ),
+            DumpsysRule("* Task", "_on_task", pattern_task),
+            DumpsysRule("* TaskRecord", "_on_task", pattern_task),
+            DumpsysRule("* Hist", "_on_hist", pattern_hist),
+            DumpsysRule("packageName", "_on_activity_attrs"),
+            DumpsysRule("realActivity", "_on_activity_attrs"),
+            DumpsysRule("mActivityComponent", "_on_activity_attrs"),
+            DumpsysRule("state", "_on_activity_attrs"),
+            DumpsysRule("waitingVisible", "_on_activity_end"),
+            DumpsysRule("mLastReportedMultiWindowMode", "_on_activity_end"),
+            DumpsysRule("mResumedActivity", "_on_resumed_activity", pattern_resumed),
+            DumpsysRule("ResumedActivity", "_on_resumed_activity", pattern_resumed),
+            DumpsysRule("mFocusedActivity", "_on_resumed_activity", pattern_resumed),
+            DumpsysRule("FocusedActivity", "_on_resumed_activity", pattern_resumed),
+        ]
+    )
+
     def __init__(self, device):
         self._device = device
         self._activities_data = None
-
-    def update(self):
-        """ """
+        self._activities_iter = None  # 未解析完成时的解析器
+        self._activity_list = []  # 已解析出的Activity
+        self._resumed_activity = None  # 前台Activity的ActivityRecord hashcode
+        self._package_name = None  # 只获取该包名的activity
+        self._snapshot_lines = None  # 来自设备快照的activity数据
+        self._sdk_version = None  # 快照对应的SDK版本
+        self._activity_dict = {}  # Activity名称到Activity的索引，名称相同时取第一个
+
+    def update(self, package_name=None, snapshot=None):
+        """
+
+        :param package_name: 只获取该包名的activity，查找其它包的activity时会重新获取全部数据
+        :type  package_name: string
+        :param snapshot: 设备快照，包含所需数据时不再单独查询
+        :type  snapshot: DeviceSnapshot
+        """
         self._activities_data = None
+        self._activities_iter = None
+        self._activity_list = []
+        self._activity_dict = {}
+        self._resumed_activity = None
+        self._package_name = package_name
+        self._snapshot_lines = None
+        self._sdk_version = None
+        if (
+            snapshot is not None
+            and snapshot.activity_lines is not None
+            and snapshot.package_name in (None, package_name)
+        ):
+            self._snapshot_lines = snapshot.activity_lines
+            self._package_name = snapshot.package_name
+            self._sdk_version = snapshot.sdk_version
+
+    def _parse_next(self):
+        """继续解析下一个Activity，返回False表示已解析完成"""
+        if self._activities_data is None:
+            self._activities_data = []
+            if self._snapshot_lines is not None:
+                lines = iter(self._snapshot_lines)
+                sdk_version = self._sdk_version
+            else:
+                dumpsys_query = DumpsysQuery.get_instance(self._device)
+                lines = dumpsys_query.iter_activities(self._package_name)
+                sdk_version = dumpsys_query.sdk_version
+            self._activities_iter = self._iter_activities_data(
+                lines, self._activities_data, sdk_version
+            )
+        if self._activities_iter is None:
+            return False
+        for event, value in self._activities_iter:
+            if event == EnumParseEvent.Activity:
+                self._activity_list.append(value)
+                if value.name is not None:
+                    self._activity_dict.setdefault(value.name, value)
+                else:
+                    Log.w("ActivityManager", "invalid activity %s" % value)
+            elif event == EnumParseEvent.ResumedActivity:
+                self._resumed_activity = value
+            return True
+        self._activities_iter = None
+        return False
+
+    def _expand_scope(self):
+        """只获取了部分包名的数据时，改为获取全部数据，返回是否需要重新查找"""
+        if self._package_name is None:
+            return False
+        self.update()
+        return True
+
+    @property
+    def package_name(self):
+        """当前数据的包名范围，为None表示包含全部包名"""
+        return self._package_name
 
     def get_activity_list(self):
-        if not self._activities_data:
-            self._activities_data = self._get_activities_data()
-        result = []
-
-        for stack in self._activities_data:
-            for task in stack.task_list:
-                for activity in task.activity_list:
-                    result.append(activity)
+        """获取当前数据范围内的全部Activity
+
+        只获取了部分包名的数据时不包含其它包名的Activity，不会隐式重新获取；
+        需要全部Activity时由调用方先调用update()扩大范围
+        """
+        while self._parse_next():
+            pass
+        return list(self._activity_list)
+
+    def find_activity(self, name):
+        """查找指定名称的Activity，找到后即停止解析
+
+        :param name: Activity名称
+        :type  name: string
+        """
+        while True:
+            activity = self._activity_dict.get(name)
+            if activity is not None:
+                return activity
+            if not self._parse_next():
+                if not self._expand_scope():
+                    return None
+
+    def get_resumed_activity(self):
+        """获取前台Activity，解析到前台Activity后即停止解析"""
+        index = 0
+        while True:
+            if self._resumed_activity is not None:
+                while index < len(self._activity_list):
+                    activity = self._activity_list[index]
+                    if activity.activity_record.hashcode == self._resumed_activity:
+                        return activity
+                    index += 1
+            if not self._parse_next():
+                if not self._expand_scope():
+                    return None
+                index = 0
+
+    def _iter_activities_data(self, lines, stacks, sdk_version=None):
+        """流式解析activity数据
+
+        解析结果会逐步加入`stacks`中，每当一个Activity的属性解析完成时返回
+        (EnumParseEvent.Activity, activity)，遇到前台Activity时返回
+        (EnumParseEvent.ResumedActivity, hashcode)
+
+        :param lines: `dumpsys activity activities`的输出行
+        :type  lines: iterable
+        :param stacks: 用于保存解析结果的TaskStack列表
+        :type  stacks: list
+        :param sdk_version: 输出对应的SDK版本，为None时使用全部解析规则
+        :type  sdk_version: int
+        """
+        lines = iter(lines)
+        next(lines, None)  # 跳过第一行
+        # hist为正在解析的Activity: (id, activity_record, attrs, task)
+        state = {"stacks": stacks, "stack": None, "task": None, "hist": None}
+        for event in self.grammar.parse(lines, self, state, sdk_version):
+            yield event
+        if state["hist"]:
+            yield self._finish_activity(state)
+
+    def _finish_activity(self, state):
+        """创建正在解析的Activity"""
+        _id, activity_record, attrs, task = state["hist"]
+        state["hist"] = None
+        activity = Activity(_id, activity_record, attrs)
+        task.add_activity(activity)
+        return EnumParseEvent.Activity, activity
+
+    def _add_stack(self, state, stack):
+        state["stacks"].append(stack)
+        state["stack"] = stack
+
+    def _on_main_stack(self, state, line, ret):
+        self._add_stack(state, TaskStack(0))
+        state["task"] = Task(0)
+        state["stack"].add_task(state["task"])
+
+    def _on_stack(self, state, line, ret):
+        self._add_stack(state, TaskStack(int(ret.group(1))))
+
+    def _on_root_task(self, state, line, ret):
+        result = self._finish_activity(state) if state["hist"] else None
+        self._add_stack(state, TaskStack(len(state["stacks"])))
+        state["task"] = Task(ret.group(2))
+        state["stack"].add_task(state["task"])
         return result
 
-    def _get_activities_data(self):
-        """获取并解析activity数据"""
-        result = self._device.adb.run_shell_cmd("dumpsys activity activities")
-        result = result.replace("\r", "")
-        # print(result)
-        p1 = re.compile(r"^  Stack #(\d+).*:.*$")
-        # p2 = re.compile(r"^    Task id #(\d+)$")
-        p2 = re.compile(r"^\s+\* Task(Record){0,1}\{(\w{6,8}).+")
-        # p3 = re.compile(r"^\s+\* TaskRecord\{(\w{6,8}) #(\d+)(.+)}$")
-        p4 = re.compile(r"^\s+\* Hist #(\d+): ActivityRecord{(\w{5,8})(.+)}$")
-        stack = None
-        task = None
-        hist = None
-        stacks = []
-
-        for line in result.split("\n")[1:]:
-            if not line:
+    def _on_task(self, state, line, ret):
+        if state["stack"] is None:
+            return None
+        result = self._finish_activity(state) if state["hist"] else None
+        state["task"] = Task(ret.group(2))
+        state["stack"].add_task(state["task"])
+        return result
+
+    def _on_hist(self, state, line, ret):
+        if state["task"] is None:
+            return None
+        result = self._finish_activity(state) if state["hist"] else None
+        activity = ""
+        task_id = 0
+        items = ret.group(3).strip().split(" ")
+        for item in items:
+            if "/" in item:
+                activity = item
+            elif item[0] == "t":
+                task_id = int(item[1:])
+        activity_record = ActivityRecord(ret.group(2), task_id, activity)
+        state["hist"] = (int(ret.group(1)), activity_record, {}, state["task"])
+        return result
+
+    def _on_activity_attrs(self, state, line, ret):
+        if not state["hist"]:
+            return
+        attrs = state["hist"][2]
+        for item in line.split(" "):
+            if not "=" in item:
                 continue
-            # print(repr(line))
-            if stack is None or line.startswith("  Stack "):
-                print(line)
-                if line == "  Main stack:":
-                    stack = TaskStack(0)
-                    stacks.append(stack)
-                    task = Task(0)
-                    stack.add_task(task)
-                else:
-                    ret = p1.match(line)
-                    if ret:
-                        stack_id = int(ret.group(1)) if not isinstance(ret, bool) else 0
-                        stack = TaskStack(stack_id)
-                        stacks.append(stack)
-            elif line.startswith("    * Task"):
-                ret = p2.match(line)
-                # print(line, ret)
-                if ret:
-                    task = Task(ret.group(1))
-                    stack.add_task(task)
-                    hist = None
-            elif line.startswith("      * Hist "):
-                ret = p4.match(line)
-                if ret:
-                    activity = ""
-                    task_id = 0
-                    items = ret.group(3).strip().split(" ")
-                    for item in items:
-                        if "/" in item:
-                            activity = item
-                        elif item[0] == "t":
-                            task_id = int(item[1:])
-                    activity_record = ActivityRecord(ret.group(2), task_id, activity)
-                    hist = Activity(int(ret.group(1)), activity_record)
-                    task.add_activity(hist)
-            elif hist and line.startswith("    "):
-                # print(line)
-                items = line.split(" ")
-                for item in items:
-                    if not "=" in item:
-                        continue
-                    pos = item.find("=")
-                    key = item[:pos]
-                    val = item[pos + 1 :]
-                    if key in [
-                        "processName",
-                        "packageName",
-                        "realActivity",
-                        "state",
-                        "mActivityComponent",
-                    ]:
-                        hist[key] = val
-                if "waitingVisible" in line or "mLastReportedMultiWindowMode" in line:
-                    hist = None
-        return stacks
+            pos = item.find("=")
+            key = item[:pos]
+            if key in Activity.attr_keys:
+                attrs[key] = item[pos + 1 :]
+
+    def _on_activity_end(self, state, line, ret):
+        if state["hist"]:
+            return self._finish_activity(state)
+
+    def _on_resumed_activity(self, state, line, ret):
+        return EnumParseEvent.ResumedActivity, ret.group(1)
 
 
 if __name__ == "__main__":
@@ -16,19 +16,31 @@
 """控件管理
 """
 
+import concurrent.futures
 import os
 import re
 import json
+import threading
 import time
 
-from qt4a.androiddriver.androiddriver import AndroidDriver
 from qt4a.androiddriver.util import ControlAmbiguousError
 
+from utils.exceptions import CaptureTimeoutError
 from utils.logger import Log
+from utils.tracing import Tracer
+from utils.workthread import DaemonThreadPool
 
 from . import BaseManager
 from .activitymanager import ActivityManager
-from .windowmanager import WindowManager
+from .controltree import ControlTreeStore
+from .driverpool import DriverPool
+from .dumpsys import DumpsysQuery
+from .snapshot import DeviceSnapshot
+from .treediff import diff_control_trees, is_node_changed
+from .windowmanager import Window, WindowManager, pattern_window_ref
+
+
+pattern_hashcode = re.compile(r"^\w{6,8}$")
 
 
 class EnumWebViewType(object):
@@ -43,99 +55,328 @@ class EnumWebViewType(object):
 class ControlManager(BaseManager):
     """控件管理"""
 
+    snapshot_ttl = 10  # 焦点未变化时可复用快照的最长时间
+    max_capture_workers = 4  # 同一设备上同时抓取控件树的最大进程数
+    capture_timeout = 30  # 抓取控件树的最长时间，超时的进程只返回已获取的部分
+    lazy_capture_depth = 8  # 按需加载时每次获取的控件层数
+    weex_batch_size = 32  # 每批获取的Weex节点名称数
+
     def __init__(self, device):
         self._device = device
         self._activity_manager = ActivityManager.get_instance(device)
         self._window_manager = WindowManager.get_instance(device)
-        self._driver_dict = {}
+        self._driver_pool = DriverPool.get_instance(device)
+        self._snapshot = None
+        self._generation = 0  # 已获取的快照数
+        self._focus_probe = None  # 获取快照时的焦点探测结果
+        self._window_process_dict = {}  # 窗口所在进程的缓存，刷新数据时清空
+        self._capture_pool = None  # 抓取控件树的线程池，限制同一设备的并发数
+        self._capture_futures = {}  # {process_name: (generation, future)}
+        self._control_trees = None  # 上一次获取的控件树，用于计算增量
+        self._tree_snapshot = None  # 上一次获取控件树时使用的快照
+        self._delta_lock = threading.Lock()
+        self._lazy_capture = False
+        # 未获取子节点的控件，{hashcode: (process_name, window_title, depth, node)}
+        self._partial_nodes = {}
+        # 按需获取的子树，{window_title: (process_name, pid, {hashcode: node})}，
+        # 窗口所在进程或已获取部分的控件树变化时丢弃该窗口的缓存
+        self._subtree_cache = {}
+        self._weex_pool = None  # 获取Weex节点名称的线程，同一测试桩上的调用串行执行
+        # Weex节点的mTest字段，{(pid, hashcode): name}，进程重启后丢弃
+        self._weex_names = {}
+        self._weex_pending = set()  # 正在获取名称的Weex节点，{(pid, hashcode)}
+        self._weex_lock = threading.Lock()
 
     def _get_driver(self, process_name):
         """获取AndroidDriver实例"""
 
-        if not process_name in self._driver_dict:
-            driver = AndroidDriver.create(process_name, self._device)
-            self._driver_dict[process_name] = driver
-        return self._driver_dict[process_name]
+        process_list = None
+        if self._snapshot is not None:
+            process_list = self._snapshot.process_list
+        return self._driver_pool.get_driver(process_name, process_list)
 
     def get_driver(self, window_title):
         """获取AndroidDriver实例"""
         process_name = self._get_window_process(window_title)
         return self._get_driver(process_name)
 
-    def update(self):
-        """ """
-        self._activity_manager.update()
-        self._window_manager.update()
+    def prewarm_driver(self):
+        """提前创建前台应用主进程的测试桩，避免首次获取控件树时等待测试桩注入
+
+        只查询焦点窗口，不修改窗口数据，可以与获取控件树同时执行
+        """
+        lines = DumpsysQuery.get_instance(self._device).query_window_focus()
+        package_name = None
+        for line in lines or []:
+            ret = pattern_window_ref.search(line)
+            if ret and line.strip().startswith("mCurrentFocus"):
+                package_name = Window(None, 0, ret.group(1), ret.group(3)).package_name
+                break
+        if package_name is None:
+            Log.w("ControlManager", "get foreground package failed")
+            return None
+        Log.i("ControlManager", "prewarm driver of %s" % package_name)
+        return self._driver_pool.get_driver(package_name)
+
+    def close_drivers(self):
+        """关闭所有测试桩"""
+        self._driver_pool.close()
+
+    def close(self):
+        """不再使用该设备时调用，停止后台任务并关闭所有测试桩"""
+        if self._capture_pool is not None:
+            self._capture_pool.shutdown()
+            self._capture_pool = None
+        self._capture_futures = {}
+        if self._weex_pool is not None:
+            self._weex_pool.shutdown()
+            self._weex_pool = None
+        with self._weex_lock:
+            self._weex_names = {}
+            self._weex_pending = set()
+        self.close_drivers()
+
+    @property
+    def lazy_capture(self):
+        """是否按需加载控件树，开启时只获取前lazy_capture_depth层，其余在展开时获取"""
+        return self._lazy_capture
+
+    @lazy_capture.setter
+    def lazy_capture(self, enabled):
+        self._lazy_capture = enabled
+
+    @property
+    def generation(self):
+        """当前快照的代数，界面数据刷新后增加"""
+        return self._generation
+
+    @property
+    def tree_snapshot(self):
+        """上一次获取控件树时使用的设备快照，未获取时为None"""
+        return self._tree_snapshot
+
+    def update(self, package_name=None, focus_probe=None):
+        """获取新的设备快照并刷新窗口和Activity数据
+
+        :param package_name: 只获取该包名的activity数据，为None时获取全部
+        :type  package_name: string
+        :param focus_probe:  已获取的焦点探测结果，为None时在获取快照的同一次shell调用中获取
+        :type  focus_probe:  list
+        """
+        self._generation += 1
+        with Tracer.span("snapshot"):
+            self._snapshot = DeviceSnapshot.capture(
+                self._device, package_name, self._generation, focus_probe is None
+            )
+        if focus_probe is None:
+            focus_probe = self._snapshot.focus_probe
+        self._focus_probe = focus_probe
+        with Tracer.span("parse_windows"):
+            self._window_manager.update(self._snapshot)
+        self._activity_manager.update(package_name, self._snapshot)
+        self._window_process_dict = {}
+        if len(self._driver_pool) > 0:
+            expired = self._driver_pool.validate(self._snapshot.process_list)
+            if expired:
+                pids = set(pid for _, pid in expired)
+                with self._weex_lock:
+                    self._weex_names = dict(
+                        (key, value)
+                        for key, value in self._weex_names.items()
+                        if key[0] not in pids
+                    )
+        return self._snapshot
+
+    def get_snapshot(self, force=False):
+        """获取设备快照
+
+        快照未超过有效时间时，先只查询焦点窗口和前台Activity，与获取快照时一致则返回缓存的快照
+
+        :param force: 是否强制重新获取
+        :type  force: bool
+        """
+        focus_probe = None
+        if (
+            not force
+            and self._snapshot is not None
+            and self._focus_probe is not None
+            and self._snapshot.age <= self.snapshot_ttl
+        ):
+            with Tracer.span("focus_probe"):
+                dumpsys_query = DumpsysQuery.get_instance(self._device)
+                focus_probe = dumpsys_query.query_focus_probe()
+            if focus_probe == self._focus_probe:
+                return self._snapshot
+        # 只有已探测到焦点时才按包名获取activity数据，否则切换应用后需要再全量获取一次
+        package_name = DumpsysQuery.get_focus_package(focus_probe)
+        self.update(package_name, focus_probe)
+        return self._snapshot
 
     def _get_window_process(self, window_hashcode_or_title):
         """获取窗口所在的进程名"""
         from .windowmanager import Window
 
-        target_window = None
-        pattern = re.compile(r"^\w{6,8}$")
+        if isinstance(window_hashcode_or_title, Window):
+            key = window_hashcode_or_title.hashcode
+        else:
+            key = window_hashcode_or_title
+        if key in self._window_process_dict:
+            return self._window_process_dict[key]
+
         if isinstance(window_hashcode_or_title, Window):
             target_window = window_hashcode_or_title
-            if target_window.attached_window != None:
-                target_window = target_window.attached_window
         else:
-            is_hashcode = pattern.match(window_hashcode_or_title) != None
             if window_hashcode_or_title == "StatusBar":
                 return "com.android.systemui"
-            for window in self._window_manager.get_window_list():
-                if (is_hashcode and window.hashcode == window_hashcode_or_title) or (
-                    not is_hashcode and window.title == window_hashcode_or_title
-                ):
-                    if window.attached_window != None:
-                        target_window = window.attached_window
-                    else:
-                        target_window = window
-                    break
+            if pattern_hashcode.match(window_hashcode_or_title):
+                target_window = self._window_manager.get_window(
+                    hashcode=window_hashcode_or_title
+                )
             else:
+                target_window = self._window_manager.get_window(
+                    title=window_hashcode_or_title
+                )
+            if target_window is None:
                 raise RuntimeError("查找窗口： %s 失败" % window_hashcode_or_title)
+        if target_window.attached_window != None:
+            target_window = target_window.attached_window
+
+        process_name = None
+        with Tracer.span("find_activity"):
+            activity = self._activity_manager.find_activity(target_window.title)
+        if activity is not None:
+            process_name = activity.process_name
+        self._window_process_dict[key] = process_name
+        return process_name
+
+    def _get_process_pid(self, process_name):
+        """根据当前快照获取进程pid，进程不存在时返回None"""
+        if self._snapshot is None:
+            return None
+        return self._snapshot.get_pid(process_name)
+
+    def _get_window_owner(self, window, snapshot):
+        """根据窗口会话的pid查找创建窗口的进程名，无需抓取控件树
 
-        for activity in self._activity_manager.get_activity_list():
-            if activity.name == target_window.title:
-                return activity.process_name
+        :param window:   窗口
+        :type  window:   Window
+        :param snapshot: 设备快照
+        :type  snapshot: DeviceSnapshot
+        :return: 进程名，无法获取时返回None
+        """
+        if window.pid is None:
+            return None
+        for it in snapshot.process_list:
+            if it["pid"] == window.pid:
+                return it["proc_name"]
+        Log.w("ControlManager", "process %d of %s not found" % (window.pid, window))
+        return None
 
     def _get_control_tree(self, process_name):
         """获取指定进程中的所有控件树
 
         :param process_name: 进程名
         :type process_name:  string
+        :return: {window_title: [process_name, root, ...]}，root为ControlTreeStore的根节点
         """
-        driver = self._get_driver(process_name)
-        Log.i("ControlManager", "get control tree in process %s" % process_name)
-        result = driver._get_control_tree("", -1)
-        Log.i("ControlManager", "get control tree complete")
-        # for key in result.keys():
-        for key in list(result):
-            if not result[key]:
-                result.pop(key)
-                continue
-            if not result[key]["Visible"]:
-                # 过滤掉不可见的窗口
-                print("ignor window %s" % key)
-                result.pop(key)
-        pattern = re.compile(r"^(.+)#(\d+)$")
-        output_result = {}  # 窗口名相同的放到list中
-        # for key in result.keys():
-        for key in list(result):
-            window_title = key
-            ret = pattern.match(key)
-            if ret:
-                window_title = ret.group(1)
-            if window_title not in output_result:
-                output_result[window_title] = [process_name]
-            output_result[window_title].append(result.pop(key))
+        with Tracer.span(
+            "capture_process", device=self._device._device_id, process=process_name
+        ):
+            with Tracer.span("get_driver"):
+                driver = self._get_driver(process_name)
+            Log.i("ControlManager", "get control tree in process %s" % process_name)
+            max_depth = self.lazy_capture_depth if self._lazy_capture else -1
+            with Tracer.span("tree_rpc"):
+                result = driver._get_control_tree("", max_depth)
+            Log.i("ControlManager", "get control tree complete")
+            with Tracer.span("filter_visible"):
+                # for key in result.keys():
+                for key in list(result):
+                    if not result[key]:
+                        result.pop(key)
+                        continue
+                    if not result[key]["Visible"]:
+                        # 过滤掉不可见的窗口
+                        print("ignor window %s" % key)
+                        result.pop(key)
+            pattern = re.compile(r"^(.+)#(\d+)$")
+            output_result = {}  # 窗口名相同的放到list中
+            with Tracer.span("build_store"):
+                # for key in result.keys():
+                for key in list(result):
+                    window_title = key
+                    ret = pattern.match(key)
+                    if ret:
+                        window_title = ret.group(1)
+                    if window_title not in output_result:
+                        output_result[window_title] = [process_name]
+                    root = ControlTreeStore(result.pop(key)).root
+                    output_result[window_title].append(root)
 
         return output_result
 
-    def get_control_tree(self):
-        """获取当前需要获取的所有控件树列表"""
-        print("get_control_tree")
-        process_list = []  # 已经抓取过控件树的进程列表
-        self._window_manager.update()
-        self._activity_manager.update()
+    def _submit_capture(self, process_name):
+        """提交抓取指定进程控件树的任务
+
+        同一快照中同一进程的抓取未完成时复用该任务，避免同一个测试桩上有多个并发请求；
+        之前快照中未完成的任务不会复用，避免返回过期的控件树
+        """
+        item = self._capture_futures.get(process_name)
+        if item is not None and item[0] == self._generation and not item[1].done():
+            return item[1]
+        if self._capture_pool is None:
+            self._capture_pool = DaemonThreadPool(self.max_capture_workers, "capture")
+        future = self._capture_pool.submit(
+            Tracer.bind(self._get_control_tree), process_name
+        )
+        self._capture_futures[process_name] = (self._generation, future)
+        return future
+
+    def _capture_control_trees(self, process_list, deadline, future_dict=None):
+        """并发抓取多个进程中的控件树
+
+        :param process_list: 进程名列表
+        :type  process_list: list
+        :param deadline:     截止时间，超时未完成的进程将被忽略
+        :type  deadline:     float
+        :param future_dict:  已提交的抓取任务，{process_name: future}
+        :type  future_dict:  dict
+        :return: {process_name: control_tree}，抓取失败或超时的进程不在结果中
+        """
+        future_dict = dict(future_dict or {})
+        with Tracer.span("capture", processes=len(process_list)):
+            for process_name in process_list:
+                if process_name not in future_dict:
+                    future_dict[process_name] = self._submit_capture(process_name)
+            concurrent.futures.wait(
+                list(future_dict.values()), timeout=max(deadline - time.time(), 0)
+            )
+        result = {}
+        for process_name in process_list:
+            future = future_dict[process_name]
+            if not future.done():
+                Log.w(
+                    "ControlManager",
+                    "get control tree in %s timeout" % process_name,
+                )
+                continue
+            try:
+                result[process_name] = future.result()
+            except Exception:
+                Log.ex("ControlManager", "get control tree in %s failed" % process_name)
+        return result
+
+    @Tracer.trace()
+    def get_control_tree(self, force=False):
+        """获取当前需要获取的所有控件树列表
+
+        各进程的控件树并发抓取，超过capture_timeout仍未完成的进程会被忽略，只返回已获取的部分
+
+        :param force: 是否强制刷新窗口和Activity数据
+        :type  force: bool
+        """
+        deadline = time.time() + self.capture_timeout
+        snapshot = self.get_snapshot(force)
         current_window = self._window_manager.get_current_window()
         if current_window is None:
             # 获取当前Activity
@@ -150,91 +391,334 @@ class ControlManager(BaseManager):
         package_name = current_window.package_name  # 只获取该包名对应的窗口
         if package_name is None:
             raise RuntimeError("get %s package name failed" % current_window)
-
-        result = {}
-
-        def update_control_tree(process_name):
-            """更新控件树"""
-            try:
-                control_tree = self._get_control_tree(process_name)
-            except Exception:
-                Log.ex("ControlManager", "get control tree in %s failed" % process_name)
-                return
-            result.update(
-                control_tree
-            )  # 相同窗口名的窗口必然在同一进程中，所以不会冲突
-            process_list.append(process_name)
+        self._activity_manager.update(package_name, snapshot)
+        self._window_process_dict = {}
 
         current_process = self._get_window_process(current_window)
-
         if current_process is None:
             Log.w("ControlManager", "get process of %s failed" % current_window)
             current_process = package_name
-        result = self._get_control_tree(
-            current_process
-        )  # 先获取当前窗口所在进程中的所有控件树
-        process_list.append(current_process)
-
-        ################################################
-        #         if not package_name in process_list:
-        #             control_tree = self._get_control_tree(package_name)
-        #             result.update(control_tree)  # 相同窗口名的窗口必然在同一进程中，所以不会冲突
-        #             process_list.append(package_name)
-        ################################################
 
+        # 先确定需要抓取的进程，再统一并发抓取
+        process_list = [current_process]  # 需要抓取控件树的进程列表
+        toast_window = None
         for window in self._window_manager.get_window_list():
-            # print window.title, window.package_name, window._attrs
             if window.package_name != package_name and not window.is_popup_window():
                 continue  # 过滤掉非预期的窗口
-            if (
-                window.package_name == "com.android.systemui"
-                and not self._device.adb.is_rooted()
-            ):
+            if window.package_name == "com.android.systemui" and not snapshot.is_rooted:
                 continue  # 过滤掉非root手机中的部分应用
             if window.title == "Toast":
-                if window.title in result:
-                    continue
-                # 不在当前进程中，尝试在主进程中查找
-                if package_name not in process_list:
-                    update_control_tree(package_name)
-                    if window.title in result:
-                        continue
-                # 遍历所有进程抓取Toast控件
-                target_process_list = []
-                all_process_list = self._device.adb.list_process()
-                for process in all_process_list:
-                    if (
-                        process["proc_name"].startswith(package_name + ":")
-                        and process["proc_name"] not in process_list
-                    ):
-                        target_process_list.append(process["proc_name"])
-                for process_name in target_process_list:
-                    update_control_tree(process_name)
-                    if window.title in result:
-                        break
+                # 优先根据窗口会话确定所在进程，只需抓取该进程
+                process_name = self._get_window_owner(window, snapshot)
+                if process_name is None:
+                    toast_window = window
+                    # 不在当前进程中时，先在主进程中查找
+                    process_name = package_name
+                if process_name not in process_list:
+                    process_list.append(process_name)
             elif window.is_popup_window():
                 # 一般弹出窗口都是需要探测的
-                print("popup", window)
                 process_name = self._get_window_process(window)
-                # print process_name
+                if process_name is None:
+                    process_name = self._get_window_owner(window, snapshot)
                 if process_name is None:
                     Log.w(
                         "ControlManager",
                         "find process of window %s failed" % window.title,
                     )
-                    for it in self._device.adb.list_process():
+                    for it in snapshot.process_list:
                         if it["proc_name"] == window.package_name or it[
                             "proc_name"
                         ].startswith(window.package_name + ":"):
                             if it["proc_name"] not in process_list:
-                                update_control_tree(it["proc_name"])
-                    continue
-                if process_name in process_list:
+                                process_list.append(it["proc_name"])
                     continue
-                update_control_tree(process_name)
+                if process_name not in process_list:
+                    process_list.append(process_name)
+
+        # 当前窗口所在进程必须获取成功
+        future = self._submit_capture(current_process)
+        tree_dict = self._capture_control_trees(
+            process_list, deadline, {current_process: future}
+        )
+        if not future.done():
+            raise CaptureTimeoutError(
+                "get control tree in %s timeout" % current_process
+            )
+        if future.exception() is not None:
+            raise future.exception()
+
+        if toast_window is not None and not any(
+            toast_window.title in it for it in tree_dict.values()
+        ):
+            # 遍历其它子进程抓取Toast控件
+            target_process_list = []
+            for process in snapshot.process_list:
+                if (
+                    process["proc_name"].startswith(package_name + ":")
+                    and process["proc_name"] not in process_list
+                ):
+                    target_process_list.append(process["proc_name"])
+            tree_dict.update(self._capture_control_trees(target_process_list, deadline))
+            process_list.extend(target_process_list)
 
+        result = {}
+        for process_name in process_list:
+            if process_name in tree_dict:
+                # 相同窗口名的窗口必然在同一进程中，所以不会冲突
+                result.update(tree_dict[process_name])
+        self._update_partial_nodes(result)
+        self._control_trees = result
+        self._tree_snapshot = snapshot
         return result
 
+    def _mark_partial_nodes(self, process_name, window_title, node, depth, max_depth):
+        """记录达到获取层数限制的叶子节点，已缓存子树的节点直接复用缓存"""
+        item = self._subtree_cache.get(window_title)
+        cached_nodes = item[2] if item is not None else {}
+        stack = [(node, depth)]
+        while stack:
+            node, depth = stack.pop()
+            if not node["Children"]:
+                cached_node = cached_nodes.get(node["Hashcode"])
+                if cached_node is not None:
+                    node["Children"] = cached_node["Children"]
+                elif depth >= max_depth - 1:
+                    # 无法区分是否还有子节点，都视为未获取
+                    self._partial_nodes[node["Hashcode"]] = (
+                        process_name,
+                        window_title,
+                        depth,
+                        node,
+                    )
+                    continue
+            for child in node["Children"]:
+                stack.append((child, depth + 1))
+
+    @staticmethod
+    def _is_captured_tree_changed(old_list, new_list, cached_nodes):
+        """比较窗口控件树已获取的部分是否变化，已缓存子树的节点不比较子节点
+
+        :param old_list:     上次的结果，[process_name, tree, ...]
+        :type  old_list:     list
+        :param new_list:     本次获取的结果，尚未合并缓存的子树
+        :type  new_list:     list
+        :param cached_nodes: 该窗口已缓存子树的节点，{hashcode: node}
+        :type  cached_nodes: dict
+        """
+        if len(old_list) != len(new_list) or old_list[0] != new_list[0]:
+            return True
+        stack = list(zip(old_list[1:], new_list[1:]))
+        while stack:
+            old_node, node = stack.pop()
+            if old_node["Hashcode"] != node["Hashcode"] or is_node_changed(
+                old_node, node
+            ):
+                return True
+            if not node["Children"] and node["Hashcode"] in cached_nodes:
+                continue
+            if len(old_node["Children"]) != len(node["Children"]):
+                return True
+            stack.extend(zip(old_node["Children"], node["Children"]))
+        return False
+
+    def _update_partial_nodes(self, controls_dict):
+        """按需加载时记录未获取子节点的控件
+
+        窗口所在进程及已获取部分的控件树都未变化时复用按需获取的子树，只丢弃变化窗口的缓存
+        """
+        old_trees = self._control_trees or {}
+        for window_title, item in list(self._subtree_cache.items()):
+            process_name, pid, cached_nodes = item
+            tree_list = controls_dict.get(window_title)
+            if (
+                tree_list is None
+                or window_title not in old_trees
+                or self._get_process_pid(process_name) != pid
+                or self._is_captured_tree_changed(
+                    old_trees[window_title], tree_list, cached_nodes
+                )
+            ):
+                del self._subtree_cache[window_title]
+        self._partial_nodes = {}
+        if not self._lazy_capture:
+            return
+        for window_title, tree_list in controls_dict.items():
+            for root in tree_list[1:]:
+                self._mark_partial_nodes(
+                    tree_list[0], window_title, root, 0, self.lazy_capture_depth
+                )
+
+    def is_partial_control(self, hashcode):
+        """控件的子节点是否尚未获取"""
+        return hashcode in self._partial_nodes
+
+    def get_cached_weex_node_name(self, process_name, hashcode):
+        """获取已缓存的Weex节点名称，未获取时返回None"""
+        return self._weex_names.get((self._get_process_pid(process_name), hashcode))
+
+    def resolve_weex_node_names(self, process_name, hashcodes, callback):
+        """在后台分批获取Weex节点的名称，即节点的mTest字段
+
+        已缓存或正在获取的节点不会重复获取
+
+        :param process_name: 节点所在进程
+        :type  process_name: string
+        :param hashcodes:    节点hashcode列表
+        :type  hashcodes:    list
+        :param callback:     每批获取完成后在工作线程中调用，参数为(process_name, {hashcode: name})，
+                             获取失败的节点名称为None
+        :type  callback:     function
+        """
+        pid = self._get_process_pid(process_name)
+        with self._weex_lock:
+            hashcodes = [
+                it
+                for it in hashcodes
+                if (pid, it) not in self._weex_names
+                and (pid, it) not in self._weex_pending
+            ]
+            self._weex_pending.update((pid, it) for it in hashcodes)
+        if not hashcodes:
+            return
+        if self._weex_pool is None:
+            self._weex_pool = DaemonThreadPool(1, "weex")
+        for i in range(0, len(hashcodes), self.weex_batch_size):
+            self._weex_pool.submit(
+                Tracer.bind(self._resolve_weex_node_names),
+                process_name,
+                hashcodes[i : i + self.weex_batch_size],
+                callback,
+                pid,
+            )
+
+    def _resolve_weex_node_names(self, process_name, hashcodes, callback, pid):
+        """获取一批Weex节点的名称，进程已重启时结果不再缓存"""
+        result = {}
+        try:
+            with Tracer.span("weex_names", process=process_name, count=len(hashcodes)):
+                driver = self._get_driver(process_name)
+                for hashcode in hashcodes:
+                    try:
+                        name = driver.get_object_field_value(hashcode, "mTest")
+                    except Exception:
+                        Log.ex(
+                            "ControlManager", "get field mTest of %X failed" % hashcode
+                        )
+                        result[hashcode] = None
+                    else:
+                        result[hashcode] = name or "None"
+        except Exception:
+            Log.ex("ControlManager", "get weex node names in %s failed" % process_name)
+        finally:
+            with self._weex_lock:
+                for hashcode in hashcodes:
+                    self._weex_pending.discard((pid, hashcode))
+                    if (
+                        pid == self._get_process_pid(process_name)
+                        and result.get(hashcode) is not None
+                    ):
+                        self._weex_names[(pid, hashcode)] = result[hashcode]
+        for hashcode in hashcodes:
+            result.setdefault(hashcode, None)
+        callback(process_name, result)
+
+    def get_control_subtree(self, hashcode):
+        """获取按需加载时尚未获取的子树，获取到的子节点会加入原节点中
+
+        :param hashcode: 控件hashcode
+        :type  hashcode: int
+        :return: 原节点，不是未获取子节点的控件或获取失败时返回None
+        """
+        return self.apply_control_subtree(
+            hashcode, self.fetch_control_subtree(hashcode)
+        )
+
+    def fetch_control_subtree(self, hashcode):
+        """获取按需加载时尚未获取的子节点，不修改已有的控件树，可以在工作线程中调用
+
+        :param hashcode: 控件hashcode
+        :type  hashcode: int
+        :return: 子节点列表，不是未获取子节点的控件或获取失败时返回None
+        """
+        item = self._partial_nodes.get(hashcode)
+        if item is None:
+            return None
+        process_name, window_title, depth, _ = item
+        max_depth = depth + 1 + self.lazy_capture_depth
+        driver = self._get_driver(process_name)
+        Log.i(
+            "ControlManager",
+            "get subtree of %X in %s (%s)" % (hashcode, window_title, process_name),
+        )
+        result = driver._get_control_tree(window_title, max_depth)
+        stack = [it for it in result.values() if it]
+        while stack:
+            it = stack.pop()
+            if it["Hashcode"] == hashcode:
+                break
+            stack.extend(it["Children"])
+        else:
+            Log.w("ControlManager", "control %X not found in subtree" % hashcode)
+            return None
+        return it["Children"]
+
+    def apply_control_subtree(self, hashcode, children):
+        """将fetch_control_subtree获取的子节点加入原节点中，需要与使用控件树的线程串行调用
+
+        :param hashcode: 控件hashcode
+        :type  hashcode: int
+        :param children: 获取到的子节点列表
+        :type  children: list
+        :return: 原节点，已不是未获取子节点的控件或children为None时返回None
+        """
+        if children is None or hashcode not in self._partial_nodes:
+            return None
+        process_name, window_title, depth, node = self._partial_nodes.pop(hashcode)
+        max_depth = depth + 1 + self.lazy_capture_depth
+        node["Children"] = children
+        item = self._subtree_cache.get(window_title)
+        if item is None:
+            item = (process_name, self._get_process_pid(process_name), {})
+            self._subtree_cache[window_title] = item
+        item[2][hashcode] = node
+        for child in node["Children"]:
+            self._mark_partial_nodes(
+                process_name, window_title, child, depth + 1, max_depth
+            )
+        return node
+
+    def get_control_tree_delta(self, force=False):
+        """获取控件树及其相对上一次获取结果的增量
+
+        :param force: 是否强制刷新窗口和Activity数据
+        :type  force: bool
+        :return: (controls_dict, deltas)，deltas为{window_title: [ControlTreeDelta, ...]}，
+                 与控件树一一对应；窗口或控件树根节点变化时为None，需要全量重建
+        """
+        with self._delta_lock:  # 保证增量按获取的顺序连续
+            old_trees = self._control_trees
+            result = self.get_control_tree(force)
+            with Tracer.span("diff_trees"):
+                deltas = diff_control_trees(old_trees, result)
+        if deltas is not None:
+            for key in deltas:
+                for delta in deltas[key]:
+                    Log.i("ControlManager", "%s: %s" % (key, delta))
+        return result, deltas
+
+    def _find_cached_control(self, window_title, hashcode):
+        """在上一次获取的控件树中查找控件"""
+        if not self._control_trees or window_title not in self._control_trees:
+            return None
+        stack = list(self._control_trees[window_title][1:])
+        while stack:
+            node = stack.pop()
+            if node["Hashcode"] == hashcode:
+                return node
+            stack.extend(node["Children"])
+        return None
+
     def get_control(self, window_title, parent, qpath, get_err_pos=False):
         """查找控件"""
         from utils.qpath import QPath
@@ -265,6 +749,10 @@ class ControlManager(BaseManager):
         process_name = self._get_window_process(window_title)
         driver = self._get_driver(process_name)
         driver.set_control_text(hashcode, text)
+        node = self._find_cached_control(window_title, hashcode)
+        if node is not None and "Text" in node:
+            node["Text"] = text  # 下次计算增量时不再把该节点作为变化的节点
+        return node
 
     def get_control_type(self, window_title, hashcode):
         """获取控件类型，包含基类类型"""
@@ -0,0 +1,547 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""按列存储的控件树
+"""
+
+import array
+
+
+class ControlTreeStore(object):
+    """按列存储的控件树
+
+    每个节点对应各数组中的一个下标，节点间关系使用父节点、第一个子节点、下一个兄弟节点数组表示，
+    字符串属性存储为字符串表中的下标。通过ControlNode以字典的方式访问单个节点
+    """
+
+    rect_keys = ("Left", "Top", "Width", "Height")
+    flag_keys = ("Visible", "Enabled", "Clickable", "Checkable", "Checked")
+    string_keys = ("Type", "Id", "Text", "Desc")
+    flag_shift = 8  # 高8位记录属性是否存在
+    # 按列保存时的数组名及类型，字符串属性的数组按string_keys的顺序排在之后
+    column_types = (
+        ("_hashcodes", "q"),
+        ("_parents", "i"),
+        ("_first_children", "i"),
+        ("_next_siblings", "i"),
+        ("_last_children", "i"),
+        ("_rects", "i"),
+        ("_flags", "H"),
+    )
+
+    def __init__(self, root=None):
+        """
+
+        :param root: 测试桩返回的控件树，或另一棵控件树中的ControlNode
+        :type  root: dict
+        """
+        self._hashcodes = array.array("q")
+        self._parents = array.array("i")
+        self._first_children = array.array("i")
+        self._next_siblings = array.array("i")
+        self._last_children = array.array("i")  # 用于追加子节点
+        self._rects = array.array("i")  # 每个节点4项
+        self._flags = array.array("H")
+        self._strings = dict((key, array.array("i")) for key in self.string_keys)
+        self._string_table = []
+        self._string_index = {}
+        self._extra = {}  # 其它不常用的属性，{index: {key: value}}
+        self._hashcode_index = None  # {hashcode: index}，首次查找时创建
+        self._detached_count = 0  # 已分离的节点数
+        if root is not None:
+            self.append_subtree(root)
+
+    def __len__(self):
+        return len(self._hashcodes)
+
+    @staticmethod
+    def from_columns(columns, string_table, extra=None):
+        """使用get_columns返回的数据创建控件树
+
+        :param columns:      数组列表，顺序与get_columns一致
+        :type  columns:      list
+        :param string_table: 字符串表
+        :type  string_table: list
+        :param extra:        其它属性，{index: {key: value}}
+        :type  extra:        dict
+        """
+        store = ControlTreeStore()
+        for (name, _), column in zip(store.column_types, columns):
+            setattr(store, name, column)
+        string_columns = columns[len(store.column_types) :]
+        store._strings = dict(zip(store.string_keys, string_columns))
+        store._string_table = string_table
+        store._string_index = dict(zip(string_table, range(len(string_table))))
+        store._extra = extra or {}
+        store._detached_count = store._parents.count(_detached)
+        return store
+
+    def get_columns(self):
+        """返回全部数组，用于按列保存"""
+        result = [getattr(self, name) for name, _ in self.column_types]
+        result.extend(self._strings[key] for key in self.string_keys)
+        return result
+
+    @property
+    def string_table(self):
+        return self._string_table
+
+    @property
+    def extra(self):
+        """不常用的属性，{index: {key: value}}"""
+        return self._extra
+
+    @property
+    def root(self):
+        return ControlNode(self, 0)
+
+    def get_node(self, index):
+        return ControlNode(self, index)
+
+    def _intern(self, value):
+        """获取字符串在字符串表中的下标"""
+        index = self._string_index.get(value)
+        if index is None:
+            index = len(self._string_table)
+            self._string_table.append(value)
+            self._string_index[value] = index
+        return index
+
+    def _append_node(self, node, parent):
+        index = len(self._hashcodes)
+        self._hashcodes.append(node["Hashcode"])
+        if self._hashcode_index is not None:
+            self._hashcode_index[node["Hashcode"]] = index
+        self._parents.append(parent)
+        self._first_children.append(-1)
+        self._next_siblings.append(-1)
+        self._last_children.append(-1)
+        rect = node.get("Rect") or {}
+        for key in self.rect_keys:
+            self._rects.append(int(rect.get(key, 0)))
+        flags = 0
+        for i, key in enumerate(self.flag_keys):
+            if key in node:
+                flags |= 1 << (i + self.flag_shift)
+                if node[key]:
+                    flags |= 1 << i
+        self._flags.append(flags)
+        for key in self.string_keys:
+            value = node.get(key)
+            self._strings[key].append(-1 if value is None else self._intern(value))
+        extra = None
+        for key in node.keys():
+            if key not in _known_keys:
+                if extra is None:
+                    extra = self._extra[index] = {}
+                extra[key] = node[key]
+        if parent >= 0:
+            last_child = self._last_children[parent]
+            if last_child < 0:
+                self._first_children[parent] = index
+            else:
+                self._next_siblings[last_child] = index
+            self._last_children[parent] = index
+        return index
+
+    def append_subtree(self, node, parent=-1):
+        """追加子树，已有节点的下标不变
+
+        :param node:   子树根节点，可以是dict或ControlNode
+        :type  node:   dict
+        :param parent: 父节点下标，为-1时作为根节点
+        :type  parent: int
+        :return: 子树根节点的下标
+        """
+        result = self._append_node(node, parent)
+        stack = [(it, result) for it in reversed(node["Children"])]
+        while stack:
+            node, parent = stack.pop()
+            index = self._append_node(node, parent)
+            stack.extend((it, index) for it in reversed(node["Children"]))
+        return result
+
+    def set_children(self, index, children):
+        """替换节点的子节点，原子节点及其子孙节点标记为已分离，不再能被find找到"""
+        self._detach_children(index)
+        self._first_children[index] = -1
+        self._last_children[index] = -1
+        for child in children:
+            self.append_subtree(child, index)
+
+    def _detach_children(self, index):
+        """将节点的全部子孙节点标记为已分离，数组中的数据保留，已有的ControlNode仍可读取"""
+        hashcode_index = self._hashcode_index
+        stack = list(self.iter_children(index))
+        while stack:
+            child = stack.pop()
+            stack.extend(self.iter_children(child))
+            self._parents[child] = _detached
+            self._detached_count += 1
+            if hashcode_index is not None:
+                hashcode = self._hashcodes[child]
+                if hashcode_index.get(hashcode) == child:
+                    del hashcode_index[hashcode]
+
+    def iter_children(self, index):
+        """返回子节点下标"""
+        child = self._first_children[index]
+        while child >= 0:
+            yield child
+            child = self._next_siblings[child]
+
+    def find(self, hashcode):
+        """查找控件的下标，不存在时返回-1
+
+        不包含已分离的节点，Hashcode相同时返回最后追加的节点
+        """
+        return self._get_hashcode_index().get(hashcode, -1)
+
+    def _get_hashcode_index(self):
+        if self._hashcode_index is None:
+            if self._detached_count:
+                parents = self._parents
+                self._hashcode_index = dict(
+                    (hashcode, i)
+                    for i, hashcode in enumerate(self._hashcodes)
+                    if parents[i] != _detached
+                )
+            else:
+                self._hashcode_index = dict(
+                    zip(self._hashcodes, range(len(self._hashcodes)))
+                )
+        return self._hashcode_index
+
+    def get_hashcodes(self, index=0):
+        """子树中全部节点的Hashcode，不包含已分离的节点
+
+        :param index: 子树根节点下标
+        :type  index: int
+        """
+        if index == 0 and self._parents.count(-1) == 1:
+            return list(self._get_hashcode_index())  # 只有一棵树时即为全部节点
+        result = []
+        stack = [index]
+        while stack:
+            index = stack.pop()
+            result.append(self._hashcodes[index])
+            stack.extend(self.iter_children(index))
+        return result
+
+    def get_parent(self, index):
+        """父节点下标，根节点返回-1，已分离的节点返回-2"""
+        return self._parents[index]
+
+    def get_hashcode(self, index):
+        return self._hashcodes[index]
+
+    def get_rect(self, index):
+        """返回(left, top, width, height)"""
+        pos = index * 4
+        return tuple(self._rects[pos : pos + 4])
+
+    def has_flag(self, index, key):
+        """是否包含该布尔属性"""
+        return bool(self._flags[index] >> self.flag_shift & _flag_bits[key])
+
+    def get_flag(self, index, key):
+        return bool(self._flags[index] & _flag_bits[key])
+
+    def get_string(self, index, key):
+        """获取字符串属性，不存在时返回None"""
+        value = self._strings[key][index]
+        if value < 0:
+            return None
+        return self._string_table[value]
+
+    def set_flag(self, index, key, value):
+        bit = _flag_bits[key]
+        flags = self._flags[index] | bit << self.flag_shift
+        self._flags[index] = flags | bit if value else flags & ~bit
+
+    def set_rect(self, index, rect):
+        pos = index * 4
+        for i, key in enumerate(self.rect_keys):
+            self._rects[pos + i] = int(rect.get(key, 0))
+
+    def set_string(self, index, key, value):
+        self._strings[key][index] = -1 if value is None else self._intern(value)
+
+    def is_visible(self, index):
+        return bool(self._flags[index] & _flag_bits["Visible"])
+
+    def contains(self, index, x, y):
+        """坐标是否在可见控件的区域内"""
+        if not self._flags[index] & _flag_bits["Visible"]:
+            return False
+        pos = index * 4
+        rects = self._rects
+        return (
+            rects[pos] <= x < rects[pos] + rects[pos + 2]
+            and rects[pos + 1] <= y < rects[pos + 1] + rects[pos + 3]
+        )
+
+    def hit_test(self, x, y, index=0):
+        """获取坐标所在的最底层的可见控件
+
+        从index开始向下查找，有子控件包含该坐标时继续在子控件中查找，否则返回该控件
+
+        :return: 控件下标列表，按先序排列
+        """
+        if not self.contains(index, x, y):
+            return []
+        result = []
+        stack = [index]
+        while stack:
+            index = stack.pop()
+            children = [
+                it for it in self.iter_children(index) if self.contains(it, x, y)
+            ]
+            if children:
+                stack.extend(reversed(children))
+            else:
+                result.append(index)
+        return result
+
+
+_detached = -2  # 已分离节点的父节点下标
+_known_keys = set(
+    ("Hashcode", "Rect", "Children")
+    + ControlTreeStore.flag_keys
+    + ControlTreeStore.string_keys
+)
+_flag_bits = dict((key, 1 << i) for i, key in enumerate(ControlTreeStore.flag_keys))
+
+
+class ControlNode(object):
+    """控件树中的一个节点，按字典方式访问节点属性，数据保存在ControlTreeStore中
+
+    与测试桩返回的字典一致，Id、Text等字符串属性不存在时为None，但in和keys视为不存在
+    """
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    def __repr__(self):
+        return "<ControlNode %X %s>" % (self["Hashcode"], self.get("Type"))
+
+    def __eq__(self, other):
+        if not isinstance(other, ControlNode):
+            return False
+        return self._store is other._store and self._index == other._index
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((id(self._store), self._index))
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def index(self):
+        return self._index
+
+    def __getitem__(self, key):
+        store = self._store
+        index = self._index
+        if key == "Hashcode":
+            return store.get_hashcode(index)
+        elif key == "Rect":
+            return dict(zip(store.rect_keys, store.get_rect(index)))
+        elif key == "Children":
+            return [ControlNode(store, it) for it in store.iter_children(index)]
+        elif key in _flag_bits:
+            if not store.has_flag(index, key):
+                raise KeyError(key)
+            return store.get_flag(index, key)
+        elif key in store.string_keys:
+            return store.get_string(index, key)
+        extra = store._extra.get(index)
+        if extra is None or key not in extra:
+            raise KeyError(key)
+        return extra[key]
+
+    def __setitem__(self, key, value):
+        store = self._store
+        if key == "Children":
+            store.set_children(self._index, value)
+        elif key == "Rect":
+            store.set_rect(self._index, value)
+        elif key == "Hashcode":
+            store._hashcodes[self._index] = value
+        elif key in _flag_bits:
+            store.set_flag(self._index, key, value)
+        elif key in store.string_keys:
+            store.set_string(self._index, key, value)
+        else:
+            store._extra.setdefault(self._index, {})[key] = value
+
+    def __contains__(self, key):
+        if key in self._store.string_keys:
+            return self._store.get_string(self._index, key) is not None
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        if key in self._store.string_keys:
+            value = self._store.get_string(self._index, key)
+            return default if value is None else value
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        store = self._store
+        index = self._index
+        result = ["Hashcode", "Rect", "Children"]
+        result.extend(it for it in store.flag_keys if store.has_flag(index, it))
+        result.extend(
+            it for it in store.string_keys if store.get_string(index, it) is not None
+        )
+        result.extend(store._extra.get(index, ()))
+        return result
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        """转换为测试桩返回的字典格式"""
+        result = dict((key, self[key]) for key in self.keys() if key != "Children")
+        result["Children"] = [it.to_dict() for it in self["Children"]]
+        return result
+
+
+class ControlGridIndex(object):
+    """按坐标查找控件的索引
+
+    与ControlTreeStore.hit_test相同，从根节点开始只在包含该坐标的控件中向下查找。子控件较多的节点
+    （如列表）将子控件按区域记录到均匀网格中，查找时只需检查坐标所在网格中的子控件，
+    避免每次遍历全部子控件
+    """
+
+    cell_size = 64  # 网格边长，单位为像素
+    min_grid_children = 16  # 子控件数达到该值时建立网格
+
+    def __init__(self, screen_size=None, cell_size=None):
+        """
+
+        :param screen_size: 屏幕大小，超出屏幕的区域不建立索引
+        :type  screen_size: tuple
+        :param cell_size:   网格边长
+        :type  cell_size:   int
+        """
+        if cell_size:
+            self.cell_size = cell_size
+        self._max_cell = None
+        if screen_size:
+            self._max_cell = (
+                (screen_size[0] - 1) // self.cell_size,
+                (screen_size[1] - 1) // self.cell_size,
+            )
+        # [(store, root, z_order, {index: {(column, row): [child, ...]}}), ...]
+        self._trees = []
+
+    def _get_cell_range(self, start, size, axis):
+        first = start // self.cell_size
+        last = (start + size - 1) // self.cell_size
+        if self._max_cell is not None:
+            first = max(first, 0)
+            last = min(last, self._max_cell[axis])
+        return range(first, last + 1)
+
+    def _build_grid(self, store, children):
+        grid = {}
+        for child in children:
+            left, top, width, height = store.get_rect(child)
+            if width <= 0 or height <= 0:
+                continue  # 不会包含任何坐标
+            for column in self._get_cell_range(left, width, 0):
+                for row in self._get_cell_range(top, height, 1):
+                    key = column, row
+                    if key in grid:
+                        grid[key].append(child)
+                    else:
+                        grid[key] = [child]
+        return grid
+
+    def add_tree(self, store, root=0, z_order=0):
+        """添加一棵控件树
+
+        :param store:   控件树
+        :type  store:   ControlTreeStore
+        :param root:    根节点下标
+        :type  root:    int
+        :param z_order: 控件树所在窗口的层级，值越小越靠上
+        :type  z_order: int
+        """
+        grids = {}
+        stack = [root] if store.is_visible(root) else []
+        while stack:
+            index = stack.pop()
+            children = [it for it in store.iter_children(index) if store.is_visible(it)]
+            if len(children) >= self.min_grid_children:
+                grids[index] = self._build_grid(store, children)
+            stack.extend(children)
+        self._trees.append((store, root, z_order, grids))
+
+    def hit_test(self, x, y):
+        """获取坐标所在的面积最小的最底层控件，面积相同时取层级靠上的控件
+
+        :return: (控件树序号, 控件下标)，不存在时返回None
+        """
+        cell = x // self.cell_size, y // self.cell_size
+        result = None
+        for tree_id, (store, root, z_order, grids) in enumerate(self._trees):
+            if not store.contains(root, x, y):
+                continue
+            stack = [root]
+            while stack:
+                index = stack.pop()
+                grid = grids.get(index)
+                if grid is not None:
+                    children = grid.get(cell, ())
+                else:
+                    children = store.iter_children(index)
+                children = [it for it in children if store.contains(it, x, y)]
+                if children:
+                    stack.extend(children)
+                    continue
+                _, _, width, height = store.get_rect(index)
+                key = (width * height, z_order, tree_id, index)
+                if result is None or key < result:
+                    result = key
+        if result is None:
+            return None
+        return result[2], result[3]
+
+
+if __name__ == "__main__":
+    pass
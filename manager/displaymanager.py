@@ -0,0 +1,214 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+
+"""屏幕参数管理
+"""
+
+import re
+import threading
+import time
+
+from manager import BaseManager
+from manager.dumpsys import DumpsysQuery
+from utils.logger import Log
+
+pattern_size = re.compile(r"^(Physical|Override) size: (\d+)x(\d+)$")
+pattern_density = re.compile(r"^(Physical|Override) density: (\d+)$")
+pattern_orientation = re.compile(r"SurfaceOrientation: (\d)")
+
+
+class DisplayGeometry(object):
+    """屏幕参数，创建后不可修改"""
+
+    __slots__ = ("_width", "_height", "_density", "_rotation")
+
+    def __init__(self, width, height, density=None, rotation=0):
+        """
+
+        :param width:    自然方向（旋转角度为0时）的宽度
+        :type  width:    int
+        :param height:   自然方向的高度
+        :type  height:   int
+        :param density:  屏幕密度，未知时为None
+        :type  density:  int
+        :param rotation: 旋转方向，取值0-3，对应0、90、180、270度
+        :type  rotation: int
+        """
+        self._width = width
+        self._height = height
+        self._density = density
+        self._rotation = rotation
+
+    def __str__(self):
+        return "<DisplayGeometry size=%dx%d density=%s rotation=%d>" % (
+            self._width,
+            self._height,
+            self._density,
+            self._rotation,
+        )
+
+    @property
+    def natural_size(self):
+        """自然方向的屏幕大小"""
+        return self._width, self._height
+
+    @property
+    def size(self):
+        """当前方向的屏幕大小，即控件坐标所在的范围"""
+        if self._rotation % 2:
+            return self._height, self._width
+        return self._width, self._height
+
+    @property
+    def density(self):
+        return self._density
+
+    @property
+    def rotation(self):
+        return self._rotation
+
+    def is_landscape(self):
+        """当前是否横屏"""
+        width, height = self.size
+        return width > height
+
+
+class DisplayManager(BaseManager):
+    """屏幕参数管理
+
+    屏幕大小、密度和旋转方向只在首次使用时获取，之后一直使用缓存，
+    发现屏幕方向或宽高比变化时才重新获取；获取失败后failure_backoff秒内不再重试
+    """
+
+    aspect_ratio_tolerance = 0.02  # 宽高比变化超过该比例时认为屏幕配置发生变化
+    failure_backoff = 5  # 获取失败后不再重试的时间
+
+    def __init__(self, device):
+        self._device = device
+        self._geometry = None
+        self._failed_time = None  # 上一次获取失败的时间
+        self._lock = threading.RLock()  # 截图线程与界面线程都会更新屏幕参数
+
+    @property
+    def geometry(self):
+        """缓存的屏幕参数，尚未获取时为None"""
+        return self._geometry
+
+    def update(self):
+        """重新获取屏幕参数"""
+        with self._lock:
+            self._geometry = self._get_geometry()
+            if self._geometry is None:
+                self._failed_time = time.time()
+            else:
+                self._failed_time = None
+            Log.i("DisplayManager", "display geometry: %s" % self._geometry)
+            return self._geometry
+
+    def invalidate(self):
+        """清空缓存，下次使用时重新获取"""
+        with self._lock:
+            self._geometry = None
+            self._failed_time = None
+
+    def get_geometry(self):
+        """获取屏幕参数，获取失败时返回None"""
+        with self._lock:
+            if self._geometry is None and (
+                self._failed_time is None
+                or time.time() - self._failed_time >= self.failure_backoff
+            ):
+                self.update()
+            return self._geometry
+
+    def get_screen_size(self):
+        """获取竖屏时的屏幕大小，获取失败时返回None"""
+        geometry = self.get_geometry()
+        if geometry is None:
+            return None
+        width, height = geometry.natural_size
+        return min(width, height), max(width, height)
+
+    def check_screen_size(self, width, height):
+        """根据截图等途径得到的当前屏幕大小检查屏幕参数是否变化
+
+        :param width:  当前方向的屏幕宽度，可以是缩放后的大小
+        :type  width:  int
+        :param height: 当前方向的屏幕高度
+        :type  height: int
+        :return: 最新的屏幕参数
+        """
+        with self._lock:
+            return self._check_screen_size(width, height)
+
+    def _check_screen_size(self, width, height):
+        geometry = self._geometry
+        if geometry is None or not width or not height:
+            return self.get_geometry()
+        screen_width, screen_height = geometry.size
+        if (width > height) != (screen_width > screen_height):
+            Log.i("DisplayManager", "screen rotation changed")
+            geometry = self.update()
+            if geometry is not None and geometry.is_landscape() != (width > height):
+                # 无法获取旋转方向时以截图为准
+                natural_width, natural_height = geometry.natural_size
+                self._geometry = DisplayGeometry(
+                    natural_width,
+                    natural_height,
+                    geometry.density,
+                    (geometry.rotation + 1) % 4,
+                )
+            return self._geometry
+        ratio = float(width) / height
+        screen_ratio = float(screen_width) / screen_height
+        if abs(ratio - screen_ratio) > screen_ratio * self.aspect_ratio_tolerance:
+            Log.i("DisplayManager", "screen size changed")
+            return self.update()
+        return geometry
+
+    def _get_geometry(self):
+        cmdlines = ["wm size", "wm density"]
+        if DumpsysQuery.get_instance(self._device).sdk_version >= 23:
+            cmdlines.append("dumpsys input | grep -m 1 SurfaceOrientation")
+        else:
+            cmdlines.append("dumpsys input")
+        result = self._device.adb.run_shell_cmd("; ".join(cmdlines))
+        size = density = None
+        rotation = 0
+        for line in result.replace("\r", "").split("\n"):
+            line = line.strip()
+            ret = pattern_size.match(line)
+            if ret:
+                if size is None or ret.group(1) == "Override":
+                    size = int(ret.group(2)), int(ret.group(3))
+                continue
+            ret = pattern_density.match(line)
+            if ret:
+                if density is None or ret.group(1) == "Override":
+                    density = int(ret.group(2))
+                continue
+            ret = pattern_orientation.search(line)
+            if ret:
+                rotation = int(ret.group(1))
+                break
+        if size is None:
+            Log.w("DisplayManager", "get screen size failed: %s" % result[:200])
+            return None
+        return DisplayGeometry(size[0], size[1], density, rotation)
+
+
+if __name__ == "__main__":
+    pass
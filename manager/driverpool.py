@@ -0,0 +1,149 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""测试桩连接池
+"""
+
+import collections
+import threading
+
+from qt4a.androiddriver.androiddriver import AndroidDriver
+
+from manager import BaseManager
+from utils.logger import Log
+from utils.tracing import Tracer
+
+
+class DriverPool(BaseManager):
+    """按进程缓存AndroidDriver实例
+
+    记录创建测试桩时的进程pid，进程重启后丢弃旧实例；超过max_size时淘汰最久未使用的实例
+    """
+
+    max_size = 8  # 同一设备上缓存的最大测试桩数
+
+    def __init__(self, device):
+        self._device = device
+        self._driver_factory = AndroidDriver.create
+        self._drivers = collections.OrderedDict()  # {process_name: (driver, pid)}
+        self._lock = threading.Lock()
+        self._process_locks = {}  # {process_name: lock}，同一进程只创建一次
+
+    def __len__(self):
+        return len(self._drivers)
+
+    def set_driver_factory(self, factory):
+        """设置创建测试桩的方法，用于替换AndroidDriver
+
+        :param factory: 参数为(process_name, device)，返回测试桩实例
+        :type  factory: callable
+        """
+        self._driver_factory = factory
+
+    def _get_process_lock(self, process_name):
+        with self._lock:
+            return self._process_locks.setdefault(process_name, threading.Lock())
+
+    def _close_driver(self, process_name, driver):
+        """关闭被淘汰的测试桩"""
+        Log.i("DriverPool", "close driver of %s" % process_name)
+        if hasattr(driver, "close"):
+            try:
+                driver.close()
+            except Exception:
+                Log.ex("DriverPool", "close driver of %s failed" % process_name)
+
+    def _get_pid(self, process_name, process_list=None):
+        """获取进程pid，进程不存在时返回0"""
+        if process_list is None:
+            return self._device.adb.get_pid(process_name)
+        for it in process_list:
+            if it["proc_name"] == process_name:
+                return it["pid"]
+        return 0
+
+    def get_driver(self, process_name, process_list=None):
+        """获取测试桩实例，不存在时创建
+
+        :param process_name: 进程名
+        :type  process_name: string
+        :param process_list: 已获取的进程列表，用于查询新建测试桩时的进程pid
+        :type  process_list: list
+        """
+        with self._lock:
+            if process_name in self._drivers:
+                self._drivers.move_to_end(process_name)
+                return self._drivers[process_name][0]
+        with self._get_process_lock(process_name):
+            with self._lock:
+                if process_name in self._drivers:
+                    return self._drivers[process_name][0]  # 已被其它线程创建
+            with Tracer.span("inject_driver", process=process_name):
+                driver = self._driver_factory(process_name, self._device)
+            pid = self._get_pid(process_name, process_list)
+            evicted = []
+            with self._lock:
+                self._drivers[process_name] = (driver, pid)
+                while len(self._drivers) > self.max_size:
+                    evicted.append(self._drivers.popitem(last=False))
+        for name, (it, _) in evicted:
+            self._close_driver(name, it)
+        return driver
+
+    def validate(self, process_list):
+        """根据最新的进程列表丢弃pid已变化的测试桩，不额外执行adb命令
+
+        :param process_list: 进程列表，[{"pid": pid, "proc_name": proc_name}, ...]
+        :type  process_list: list
+        :return: pid已变化的进程，[(process_name, old_pid), ...]
+        """
+        pid_dict = dict((it["proc_name"], it["pid"]) for it in process_list)
+        expired = []
+        result = []
+        with self._lock:
+            for process_name, (driver, pid) in list(self._drivers.items()):
+                if not pid and process_name in pid_dict:
+                    # 创建时未获取到pid
+                    self._drivers[process_name] = (driver, pid_dict[process_name])
+                elif pid_dict.get(process_name) != pid:
+                    Log.i(
+                        "DriverPool",
+                        "pid of %s changed from %s to %s"
+                        % (process_name, pid, pid_dict.get(process_name)),
+                    )
+                    expired.append((process_name, self._drivers.pop(process_name)[0]))
+                    result.append((process_name, pid))
+        for process_name, driver in expired:
+            self._close_driver(process_name, driver)
+        return result
+
+    def remove(self, process_name):
+        """丢弃指定进程的测试桩"""
+        with self._lock:
+            item = self._drivers.pop(process_name, None)
+        if item is not None:
+            self._close_driver(process_name, item[0])
+
+    def close(self):
+        """关闭所有测试桩"""
+        with self._lock:
+            drivers = list(self._drivers.items())
+            self._drivers.clear()
+        for process_name, (driver, _) in drivers:
+            self._close_driver(process_name, driver)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,241 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""dumpsys查询
+"""
+
+import re
+
+from manager import BaseManager
+from utils.logger import Log
+
+pattern_focus_package = re.compile(r"mCurrentFocus=Window\{\w+ (?:u\d+ )?([^\s/}]+)/")
+
+
+class EnumDumpsysQuery(object):
+    """dumpsys查询方式"""
+
+    FullWindow = "dumpsys window"
+    WindowWindows = "dumpsys window windows"
+    WindowFocus = "dumpsys window | grep -E '%s'"
+    FullActivity = "dumpsys activity activities"
+    PackageActivity = "dumpsys activity activities %s"  # 4.4开始支持按包名过滤
+    PackageActivityOption = "dumpsys activity -p %s activities"
+    ActivityFocus = "dumpsys activity activities | grep -E '%s'"
+
+
+class DumpsysQuery(BaseManager):
+    """按SDK版本选择只输出需要部分的dumpsys命令，不支持时回退到完整输出"""
+
+    # 各查询方式支持的最低SDK版本
+    min_sdk_versions = {
+        EnumDumpsysQuery.FullWindow: 0,
+        EnumDumpsysQuery.WindowWindows: 0,
+        EnumDumpsysQuery.WindowFocus: 23,  # 6.0开始内置toybox grep
+        EnumDumpsysQuery.FullActivity: 0,
+        EnumDumpsysQuery.PackageActivity: 19,
+        EnumDumpsysQuery.PackageActivityOption: 26,
+        EnumDumpsysQuery.ActivityFocus: 23,
+    }
+
+    # 输出的第一行，用于判断查询方式是否被支持
+    window_header = "WINDOW MANAGER WINDOWS"
+    activity_header = "ACTIVITY MANAGER ACTIVITIES"
+
+    window_focus_keys = [
+        "mCurrentFocus",
+        "mInputMethodTarget",
+        "imeInputTarget",
+        "mObscuringWindow",
+        "mHoldScreenWindow",
+    ]
+    activity_focus_keys = ["ResumedActivity", "FocusedActivity"]
+
+    # 10.0开始焦点窗口信息移到了display部分，需要单独查询
+    window_focus_split_sdk_version = 29
+
+    def __init__(self, device):
+        self._device = device
+        self._unsupported_queries = set()
+        self._sdk_version = None
+
+    @property
+    def sdk_version(self):
+        """设备SDK版本，决定了要执行的命令，需要先于其它查询获取，连接期间只获取一次"""
+        if self._sdk_version is None:
+            self._sdk_version = self._device.adb.get_sdk_version()
+        return self._sdk_version
+
+    def is_supported(self, query):
+        """当前设备是否支持该查询方式"""
+        if query in self._unsupported_queries:
+            return False
+        return self.sdk_version >= self.min_sdk_versions[query]
+
+    def _set_unsupported(self, query):
+        Log.w(self.__class__.__name__, "%s is not supported" % query)
+        self._unsupported_queries.add(query)
+
+    def _run_shell_cmd(self, cmdline):
+        result = self._device.adb.run_shell_cmd(cmdline)
+        return result.replace("\r", "").split("\n")
+
+    def get_cmdline(self, query, package_name=None):
+        """获取查询方式对应的命令行"""
+        if query == EnumDumpsysQuery.WindowFocus:
+            return query % "|".join(self.window_focus_keys)
+        elif query == EnumDumpsysQuery.ActivityFocus:
+            return query % "|".join(self.activity_focus_keys)
+        elif query in (
+            EnumDumpsysQuery.PackageActivity,
+            EnumDumpsysQuery.PackageActivityOption,
+        ):
+            return query % package_name
+        return query
+
+    def check_output(self, query, lines):
+        """检查查询结果是否符合预期，不符合时将该查询方式标记为不支持"""
+        if query == EnumDumpsysQuery.WindowWindows:
+            result = bool(lines) and lines[0].startswith(self.window_header)
+        elif query in (
+            EnumDumpsysQuery.PackageActivity,
+            EnumDumpsysQuery.PackageActivityOption,
+        ):
+            result = bool(lines) and lines[0].startswith(self.activity_header)
+        elif query in (EnumDumpsysQuery.WindowFocus, EnumDumpsysQuery.ActivityFocus):
+            # 输出为空表示暂时没有焦点，没有grep命令时会输出不含关键字的错误信息
+            if query == EnumDumpsysQuery.WindowFocus:
+                keys = self.window_focus_keys
+            else:
+                keys = self.activity_focus_keys
+            result = all(any(key in line for key in keys) for line in lines if line)
+        else:
+            result = True
+        if not result:
+            self._set_unsupported(query)
+        return result
+
+    def get_window_queries(self):
+        """获取窗口数据需要执行的查询列表"""
+        if not self.is_supported(EnumDumpsysQuery.WindowWindows):
+            return [EnumDumpsysQuery.FullWindow]
+        if self.sdk_version < self.window_focus_split_sdk_version:
+            return [EnumDumpsysQuery.WindowWindows]
+        if not self.is_supported(EnumDumpsysQuery.WindowFocus):
+            return [EnumDumpsysQuery.FullWindow]
+        return [EnumDumpsysQuery.WindowWindows, EnumDumpsysQuery.WindowFocus]
+
+    def get_activity_query(self, package_name=None):
+        """获取activity数据的查询方式"""
+        if package_name:
+            for query in (
+                EnumDumpsysQuery.PackageActivityOption,
+                EnumDumpsysQuery.PackageActivity,
+            ):
+                if self.is_supported(query):
+                    return query
+        return EnumDumpsysQuery.FullActivity
+
+    def query_windows(self):
+        """获取窗口列表及焦点窗口数据"""
+        lines = []
+        for query in self.get_window_queries():
+            output = self._run_shell_cmd(self.get_cmdline(query))
+            if not self.check_output(query, output):
+                return self.query_windows()
+            lines.extend(output)
+        return lines
+
+    def query_window_focus(self):
+        """只获取焦点窗口相关的行，不支持时返回None"""
+        query = EnumDumpsysQuery.WindowFocus
+        if not self.is_supported(query):
+            return None
+        lines = self._run_shell_cmd(self.get_cmdline(query))
+        if not self.check_output(query, lines):
+            return None
+        return [it for it in lines if it]
+
+    def query_activity_focus(self):
+        """只获取前台Activity相关的行，不支持时返回None"""
+        query = EnumDumpsysQuery.ActivityFocus
+        if not self.is_supported(query):
+            return None
+        lines = self._run_shell_cmd(self.get_cmdline(query))
+        if not self.check_output(query, lines):
+            return None
+        return [it for it in lines if it]
+
+    def get_focus_probe_cmdline(self):
+        """获取焦点窗口和前台Activity相关行的命令行，不支持时返回None"""
+        query_list = [EnumDumpsysQuery.WindowFocus, EnumDumpsysQuery.ActivityFocus]
+        for query in query_list:
+            if not self.is_supported(query):
+                return None
+        return "; ".join([self.get_cmdline(query) for query in query_list])
+
+    def query_focus_probe(self):
+        """一次shell调用获取焦点窗口和前台Activity相关的行，用于判断界面是否变化
+
+        不支持时返回None
+        """
+        cmdline = self.get_focus_probe_cmdline()
+        if cmdline is None:
+            return None
+        return self.normalize_focus_probe(self._run_shell_cmd(cmdline))
+
+    @staticmethod
+    def normalize_focus_probe(lines):
+        """去掉空行及首尾空白，单独获取和在快照中获取的结果可以直接比较，没有数据时返回None"""
+        lines = [it.strip() for it in lines if it.strip()]
+        return lines or None
+
+    @staticmethod
+    def get_focus_package(focus_probe):
+        """焦点窗口所属的包名，焦点窗口不是Activity窗口时返回None
+
+        :param focus_probe: query_focus_probe返回的行
+        :type  focus_probe: list
+        """
+        for line in focus_probe or []:
+            ret = pattern_focus_package.search(line)
+            if ret:
+                return ret.group(1)
+        return None
+
+    def iter_activities(self, package_name=None):
+        """流式获取activity数据
+
+        :param package_name: 只获取该包名的activity，为None表示获取全部
+        :type  package_name: string
+        """
+        while True:
+            query = self.get_activity_query(package_name)
+            lines = self._iter_shell_output(self.get_cmdline(query, package_name))
+            first_line = next(lines, None)
+            if first_line is None:
+                return
+            if not self.check_output(query, [first_line]):
+                # 不支持的参数会输出错误信息，换用下一种查询方式
+                lines.close()
+                continue
+            yield first_line
+            for line in lines:
+                yield line
+            return
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,156 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+
+"""dumpsys输出的解析引擎
+
+每一行先按缩进和行首关键字在规则表中查找，只对找到的规则执行正则匹配
+"""
+
+import re
+
+
+class DumpsysRule(object):
+    """解析规则
+
+    :param key:             行首关键字，以`* `开头的行关键字包含`* `，如`* Hist`
+    :type  key:             string
+    :param handler:         匹配后调用的处理方法名
+    :type  handler:         string
+    :param pattern:         需要匹配的正则，为None表示只按关键字匹配
+    :type  pattern:         string or re.Pattern
+    :param indent:          要求的缩进空格数，为None表示不限制
+    :type  indent:          int
+    :param min_sdk_version: 规则适用的最低SDK版本
+    :type  min_sdk_version: int
+    :param max_sdk_version: 规则适用的最高SDK版本，为None表示不限制
+    :type  max_sdk_version: int
+    """
+
+    __slots__ = (
+        "key",
+        "handler",
+        "pattern",
+        "indent",
+        "min_sdk_version",
+        "max_sdk_version",
+    )
+
+    def __init__(
+        self,
+        key,
+        handler,
+        pattern=None,
+        indent=None,
+        min_sdk_version=0,
+        max_sdk_version=None,
+    ):
+        self.key = key
+        self.handler = handler
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+        self.pattern = pattern
+        self.indent = indent
+        self.min_sdk_version = min_sdk_version
+        self.max_sdk_version = max_sdk_version
+
+    def __str__(self):
+        return "<DumpsysRule key=%s handler=%s>" % (self.key, self.handler)
+
+    def is_supported(self, sdk_version):
+        """该SDK版本是否适用，版本未知时适用全部规则"""
+        if sdk_version is None:
+            return True
+        if sdk_version < self.min_sdk_version:
+            return False
+        if self.max_sdk_version is not None and sdk_version > self.max_sdk_version:
+            return False
+        return True
+
+
+class DumpsysGrammar(object):
+    """由解析规则组成的语法表，按SDK版本生成关键字到规则列表的索引"""
+
+    # 缩进、`* `前缀及行首关键字。每行都执行这一次匹配，比用split和partition切分关键字更快，
+    # 只有关键字在规则表中的行（样本中约三分之一）才会再执行规则的正则
+    pattern_line = re.compile(r"( *)(\* )?([^\s=:{#\[]+)")
+
+    def __init__(self, rules):
+        self._rules = list(rules)
+        self._tables = {}  # SDK版本到规则表的缓存
+
+    def get_table(self, sdk_version=None):
+        """获取适用于该SDK版本的规则表
+
+        :return: {关键字: [规则, ...]}，同一关键字的规则按定义顺序排列
+        """
+        table = self._tables.get(sdk_version)
+        if table is None:
+            table = {}
+            for rule in self._rules:
+                if rule.is_supported(sdk_version):
+                    table.setdefault(rule.key, []).append(rule)
+            self._tables[sdk_version] = table
+        return table
+
+    def iter_matches(self, lines, sdk_version=None):
+        """逐行匹配规则，每行最多使用一条规则
+
+        :param lines:       dumpsys的输出行
+        :type  lines:       iterable
+        :param sdk_version: 设备SDK版本，为None时使用全部规则
+        :type  sdk_version: int
+        :return: 迭代返回(规则, 行, 正则匹配结果)，规则没有正则时匹配结果为None
+        """
+        table = self.get_table(sdk_version)
+        match_line = self.pattern_line.match
+        for line in lines:
+            ret = match_line(line)
+            if ret is None:
+                continue
+            indent, star, key = ret.groups()
+            rules = table.get(star + key if star else key)
+            if rules is None:
+                continue
+            indent = len(indent)
+            for rule in rules:
+                if rule.indent is not None and rule.indent != indent:
+                    continue
+                if rule.pattern is None:
+                    yield rule, line, None
+                    break
+                ret = rule.pattern.search(line)
+                if ret:
+                    yield rule, line, ret
+                    break
+
+    def parse(self, lines, handler, state, sdk_version=None):
+        """解析并调用handler上规则对应的处理方法
+
+        处理方法的参数为(state, line, ret)，返回值不为None时会被迭代返回
+
+        :param handler: 实现了处理方法的对象
+        :type  handler: object
+        :param state:   解析过程中的状态，原样传给处理方法
+        :type  state:   object
+        """
+        for rule, line, ret in self.iter_matches(lines, sdk_version):
+            result = getattr(handler, rule.handler)(state, line, ret)
+            if result is not None:
+                yield result
+
+
+if __name__ == "__main__":
+    pass
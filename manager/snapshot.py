@@ -0,0 +1,259 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""设备界面状态快照
+"""
+
+import time
+
+from manager.dumpsys import DumpsysQuery, EnumDumpsysQuery
+from utils.logger import Log
+from utils.tracing import Tracer
+
+
+class EnumSnapshotSection(object):
+    """快照中的数据段"""
+
+    FocusProbe = "focus_probe"
+    Window = "window"
+    WindowFocus = "window_focus"
+    Activity = "activity"
+    Process = "process"
+    Identity = "id"
+
+
+def parse_process_list(lines):
+    """解析ps命令的输出
+
+    :param lines: ps命令的输出行
+    :type  lines: list
+    :return: [{"pid": pid, "ppid": ppid, "proc_name": proc_name}, ...]
+    """
+    lines = [it.strip() for it in lines if it.strip()]
+    if not lines:
+        return []
+    busybox = lines[0].startswith("PID")
+    result = []
+    for line in lines[1:]:
+        items = line.split()
+        if not busybox:
+            if len(items) < 8:
+                Log.w("DeviceSnapshot", "invalid ps output: %s" % line)
+                continue
+            proc_name = items[8] if len(items) > 8 else items[7]
+            if len(proc_name) <= 1 and len(items) > 9:
+                proc_name = items[9]
+            result.append(
+                {"pid": int(items[1]), "ppid": int(items[2]), "proc_name": proc_name}
+            )
+        else:
+            idx = 4
+            if len(items[idx]) == 1:
+                idx += 1
+            cmd = items[idx]
+            if cmd[0] == "{" and cmd[-1] == "}" and len(items) > idx + 1:
+                cmd = items[idx + 1]
+            ppid = int(items[1]) if items[1].isdigit() else 0
+            result.append({"pid": int(items[0]), "ppid": ppid, "proc_name": cmd})
+    return result
+
+
+class DeviceSnapshot(object):
+    """设备界面状态快照
+
+    使用一次shell调用获取焦点探测结果、窗口、Activity、进程列表及shell用户，各数据段之间使用分隔行区分
+    """
+
+    section_mark = "==ANDROIDUISPY_SECTION:%s=="
+
+    def __init__(
+        self,
+        device,
+        sections,
+        package_name=None,
+        timestamp=None,
+        generation=0,
+        sdk_version=None,
+    ):
+        self._device = device
+        self._sections = sections
+        self._package_name = package_name
+        self._timestamp = timestamp or time.time()
+        self._generation = generation
+        self._sdk_version = sdk_version
+        self._process_list = None
+        self._pid_dict = None
+        self._is_rooted = None
+
+    @staticmethod
+    def capture(device, package_name=None, generation=0, focus_probe=True):
+        """获取快照
+
+        :param device: 设备实例
+        :type  device: DeviceDriver
+        :param package_name: 只获取该包名的activity数据，为None时获取全部
+        :type  package_name: string
+        :param generation: 快照的代数，每获取一次新快照加一
+        :type  generation: int
+        :param focus_probe: 是否同时获取焦点探测结果
+        :type  focus_probe: bool
+        """
+        dumpsys_query = DumpsysQuery.get_instance(device)
+        cmdlines = []
+        focus_probe_cmdline = dumpsys_query.get_focus_probe_cmdline()
+        if focus_probe and focus_probe_cmdline is not None:
+            # 最先获取，快照期间界面发生变化时下次探测的结果会不一致
+            cmdlines.append(
+                "echo %s"
+                % (DeviceSnapshot.section_mark % EnumSnapshotSection.FocusProbe)
+            )
+            cmdlines.append(focus_probe_cmdline)
+        query_list = []  # [(section, query), ...]
+        for query in dumpsys_query.get_window_queries():
+            if query == EnumDumpsysQuery.WindowFocus:
+                query_list.append((EnumSnapshotSection.WindowFocus, query))
+            else:
+                query_list.append((EnumSnapshotSection.Window, query))
+        activity_query = dumpsys_query.get_activity_query(package_name)
+        query_list.append((EnumSnapshotSection.Activity, activity_query))
+
+        for section, query in query_list:
+            cmdlines.append("echo %s" % (DeviceSnapshot.section_mark % section))
+            cmdlines.append(dumpsys_query.get_cmdline(query, package_name))
+        cmdlines.append(
+            "echo %s" % (DeviceSnapshot.section_mark % EnumSnapshotSection.Process)
+        )
+        sdk_version = dumpsys_query.sdk_version
+        cmdlines.append("ps -A" if sdk_version >= 26 else "ps")
+        cmdlines.append(
+            "echo %s" % (DeviceSnapshot.section_mark % EnumSnapshotSection.Identity)
+        )
+        cmdlines.append("id")
+
+        time0 = time.time()
+        with Tracer.span("dumpsys_shell"):
+            result = device.adb.run_shell_cmd("; ".join(cmdlines))
+        sections = DeviceSnapshot.split_sections(result.replace("\r", "").split("\n"))
+        Log.i("DeviceSnapshot", "capture snapshot cost %s S" % (time.time() - time0))
+
+        window_ok = True
+        for section, query in query_list:
+            lines = sections.get(section)
+            if not dumpsys_query.check_output(query, lines or []):
+                if section == EnumSnapshotSection.Activity:
+                    sections.pop(section, None)  # 由ActivityManager单独查询
+                else:
+                    window_ok = False
+        if not window_ok:
+            sections[EnumSnapshotSection.Window] = dumpsys_query.query_windows()
+            sections.pop(EnumSnapshotSection.WindowFocus, None)
+        return DeviceSnapshot(
+            device, sections, package_name, time0, generation, sdk_version
+        )
+
+    @staticmethod
+    def split_sections(lines):
+        """按分隔行拆分数据段"""
+        prefix, suffix = DeviceSnapshot.section_mark.split("%s")
+        sections = {}
+        current = None
+        for line in lines:
+            if line.startswith(prefix) and line.endswith(suffix):
+                current = line[len(prefix) : -len(suffix)]
+                sections[current] = []
+            elif current is not None:
+                sections[current].append(line)
+        return sections
+
+    @property
+    def timestamp(self):
+        """快照获取时间"""
+        return self._timestamp
+
+    @property
+    def generation(self):
+        """快照的代数"""
+        return self._generation
+
+    @property
+    def sdk_version(self):
+        """设备SDK版本，未知时为None"""
+        return self._sdk_version
+
+    @property
+    def age(self):
+        """快照已存在的时间"""
+        return time.time() - self._timestamp
+
+    @property
+    def package_name(self):
+        """activity数据所属的包名，为None表示包含全部包"""
+        return self._package_name
+
+    @property
+    def window_lines(self):
+        """窗口数据，包含焦点窗口数据"""
+        result = list(self._sections.get(EnumSnapshotSection.Window, []))
+        result.extend(self._sections.get(EnumSnapshotSection.WindowFocus, []))
+        return result
+
+    @property
+    def focus_probe(self):
+        """与DumpsysQuery.query_focus_probe格式相同的焦点探测结果，未获取时为None"""
+        return DumpsysQuery.normalize_focus_probe(
+            self._sections.get(EnumSnapshotSection.FocusProbe, [])
+        )
+
+    @property
+    def activity_lines(self):
+        """activity数据，获取失败时为None"""
+        return self._sections.get(EnumSnapshotSection.Activity)
+
+    @property
+    def process_list(self):
+        """进程列表"""
+        if self._process_list is None:
+            lines = self._sections.get(EnumSnapshotSection.Process)
+            if lines:
+                self._process_list = parse_process_list(lines)
+            else:
+                self._process_list = self._device.adb.list_process()
+        return self._process_list
+
+    def get_pid(self, process_name):
+        """获取进程pid，进程不存在时返回None"""
+        if self._pid_dict is None:
+            self._pid_dict = dict(
+                (it["proc_name"], it["pid"]) for it in self.process_list
+            )
+        return self._pid_dict.get(process_name)
+
+    @property
+    def is_rooted(self):
+        """设备是否root
+
+        adbd以root运行时直接根据快照中id命令的输出判断，否则仍需单独检查su
+        """
+        if self._is_rooted is None:
+            lines = self._sections.get(EnumSnapshotSection.Identity)
+            if lines and lines[0].startswith("uid=0("):
+                self._is_rooted = True
+            else:
+                self._is_rooted = self._device.adb.is_rooted()
+        return self._is_rooted
+
+
+if __name__ == "__main__":
+    pass
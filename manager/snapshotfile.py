@@ -0,0 +1,389 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""快照文件
+
+文件格式（小端字节序）：
+    文件头：magic(8s) version(H) reserved(H) section_count(I)
+    段表：  section_count个(tag(4s) offset(Q) size(Q))
+    META段：窗口列表、Activity列表及控件树索引，使用JSON编码
+    TREE段：一棵控件树，节点数据按列存储，每列为定长的数组，可直接从文件映射中复制
+    SCRN段：PNG格式的屏幕截图
+"""
+
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+from manager.activitymanager import ActivityManager
+from manager.controltree import ControlTreeStore
+from manager.displaymanager import DisplayManager
+from manager.windowmanager import WindowManager
+from utils.logger import Log
+
+
+class EnumSnapshotFileSection(object):
+    """快照文件中的数据段"""
+
+    Meta = b"META"
+    Tree = b"TREE"
+    Screenshot = b"SCRN"
+
+
+class SnapshotFileError(Exception):
+    """快照文件格式错误"""
+
+
+class SnapshotFile(object):
+    """可离线查看的界面快照，包含窗口列表、Activity列表、控件树及屏幕截图"""
+
+    magic = b"AUISNAP\0"
+    version = 1
+    header_format = "<8sHHI"
+    section_format = "<4sQQ"
+    tree_header_format = "<IIII"  # 节点数、字符串数、字符串数据长度、保留
+    alignment = 8
+
+    def __init__(
+        self,
+        controls_dict,
+        windows=None,
+        current_window=None,
+        activities=None,
+        screenshot=None,
+        screen_size=None,
+        device_name=None,
+        timestamp=None,
+    ):
+        """
+
+        :param controls_dict:  控件树，格式与ControlManager.get_control_tree的返回值相同
+        :type  controls_dict:  dict
+        :param windows:        窗口列表，[{"title": title, "hashcode": hashcode, ...}, ...]
+        :type  windows:        list
+        :param current_window: 焦点窗口的hashcode
+        :type  current_window: string
+        :param activities:     Activity列表，[{"name": name, "state": state, ...}, ...]
+        :type  activities:     list
+        :param screenshot:     PNG格式的屏幕截图
+        :type  screenshot:     bytes
+        :param screen_size:    控件坐标所在的屏幕大小
+        :type  screen_size:    tuple
+        """
+        self._controls_dict = controls_dict
+        self._windows = windows or []
+        self._current_window = current_window
+        self._activities = activities or []
+        self._screenshot = screenshot
+        self._screen_size = tuple(screen_size) if screen_size else None
+        self._device_name = device_name
+        self._timestamp = timestamp or time.time()
+
+    @property
+    def controls_dict(self):
+        return self._controls_dict
+
+    @property
+    def windows(self):
+        return self._windows
+
+    @property
+    def current_window(self):
+        return self._current_window
+
+    @property
+    def activities(self):
+        return self._activities
+
+    @property
+    def screenshot(self):
+        return self._screenshot
+
+    @property
+    def screen_size(self):
+        return self._screen_size
+
+    @property
+    def device_name(self):
+        return self._device_name
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @staticmethod
+    def create(
+        device,
+        controls_dict,
+        screenshot_path=None,
+        device_name=None,
+        device_snapshot=None,
+    ):
+        """使用设备当前缓存的数据创建快照
+
+        :param device:          设备实例
+        :type  device:          DeviceDriver
+        :param controls_dict:   已获取的控件树
+        :type  controls_dict:   dict
+        :param screenshot_path: 与控件树对应的屏幕截图
+        :type  screenshot_path: string
+        :param device_snapshot: 获取控件树时使用的设备快照，窗口及Activity列表从中解析，
+                                与控件树保持一致；为None时使用Manager中缓存的数据
+        :type  device_snapshot: DeviceSnapshot
+        """
+        if device_snapshot is not None:
+            window_manager = WindowManager(device)
+            window_manager.update(device_snapshot)
+            activity_manager = ActivityManager(device)
+            activity_manager.update(device_snapshot.package_name, device_snapshot)
+        else:
+            window_manager = WindowManager.get_instance(device)
+            activity_manager = ActivityManager.get_instance(device)
+        windows = []
+        for window in window_manager.get_window_list():
+            windows.append(
+                {
+                    "title": window.title,
+                    "hashcode": window.hashcode,
+                    "package_name": window.package_name,
+                    "position": window.position,
+                    "size": window.size,
+                    "pid": window.pid,
+                    "attached_hashcode": window.attached_hashcode,
+                }
+            )
+        current_window = window_manager.get_current_window()
+        resumed_activity = activity_manager.get_resumed_activity()
+        activities = []
+        for activity in activity_manager.get_activity_list():
+            activities.append(
+                {
+                    "name": activity.name,
+                    "hashcode": activity.hashcode,
+                    "package_name": activity.package_name,
+                    "process_name": activity.process_name,
+                    "state": activity.state,
+                    "resumed": activity == resumed_activity,
+                }
+            )
+        screenshot = None
+        if screenshot_path and os.path.exists(screenshot_path):
+            with open(screenshot_path, "rb") as fp:
+                screenshot = fp.read()
+        geometry = DisplayManager.get_instance(device).geometry
+        return SnapshotFile(
+            controls_dict,
+            windows,
+            current_window.hashcode if current_window is not None else None,
+            activities,
+            screenshot,
+            geometry.size if geometry is not None else None,
+            device_name,
+        )
+
+    @staticmethod
+    def _to_little_endian(column):
+        if sys.byteorder == "little":
+            return column
+        column = array.array(column.typecode, column)
+        column.byteswap()
+        return column
+
+    def _pack_tree(self, store):
+        """将控件树编码为TREE段"""
+        string_table = store.string_table
+        offsets = array.array("I", [0])
+        for it in string_table:
+            offsets.append(offsets[-1] + len(it))
+        blob = "".join(string_table).encode("utf8")
+        chunks = [
+            struct.pack(
+                self.tree_header_format, len(store), len(string_table), len(blob), 0
+            )
+        ]
+        for column in store.get_columns() + [offsets]:
+            data = self._to_little_endian(column).tobytes()
+            chunks.append(data)
+            chunks.append(b"\0" * (-len(data) % self.alignment))
+        chunks.append(blob)
+        return b"".join(chunks)
+
+    def save(self, path):
+        """保存到文件"""
+        time0 = time.time()
+        sections = []  # [(tag, data), ...]
+        trees = []
+        for window_title, items in self._controls_dict.items():
+            trees.append(
+                {
+                    "window_title": window_title,
+                    "process_name": items[0],
+                    "count": len(items) - 1,
+                }
+            )
+            for root in items[1:]:
+                store = ControlTreeStore(root) if root.index else root.store
+                sections.append((EnumSnapshotFileSection.Tree, self._pack_tree(store)))
+                trees[-1].setdefault("extra", []).append(store.extra)
+        meta = {
+            "device_name": self._device_name,
+            "timestamp": self._timestamp,
+            "screen_size": self._screen_size,
+            "current_window": self._current_window,
+            "windows": self._windows,
+            "activities": self._activities,
+            "trees": trees,
+        }
+        sections.insert(
+            0, (EnumSnapshotFileSection.Meta, json.dumps(meta).encode("utf8"))
+        )
+        if self._screenshot:
+            sections.append((EnumSnapshotFileSection.Screenshot, self._screenshot))
+
+        header = struct.pack(
+            self.header_format, self.magic, self.version, 0, len(sections)
+        )
+        offset = len(header) + len(sections) * struct.calcsize(self.section_format)
+        section_table = []
+        for tag, data in sections:
+            offset += -offset % self.alignment
+            section_table.append(
+                struct.pack(self.section_format, tag, offset, len(data))
+            )
+            offset += len(data)
+        with open(path, "wb") as fp:
+            fp.write(header)
+            fp.write(b"".join(section_table))
+            for tag, data in sections:
+                fp.write(b"\0" * (-fp.tell() % self.alignment))
+                fp.write(data)
+        Log.i("SnapshotFile", "save %s cost %s S" % (path, time.time() - time0))
+
+    @staticmethod
+    def _read_column(buffer, offset, typecode, count):
+        """从文件映射中复制一列数据，返回数组及下一列的偏移"""
+        column = array.array(typecode)
+        size = column.itemsize * count
+        column.frombytes(buffer[offset : offset + size])
+        if sys.byteorder != "little":
+            column.byteswap()
+        return column, offset + size + (-size % SnapshotFile.alignment)
+
+    @staticmethod
+    def _unpack_tree(buffer, offset, extra=None):
+        """解析TREE段"""
+        node_count, string_count, blob_size, _ = struct.unpack_from(
+            SnapshotFile.tree_header_format, buffer, offset
+        )
+        offset += struct.calcsize(SnapshotFile.tree_header_format)
+        columns = []
+        for name, typecode in ControlTreeStore.column_types:
+            count = node_count * 4 if name == "_rects" else node_count
+            column, offset = SnapshotFile._read_column(buffer, offset, typecode, count)
+            columns.append(column)
+        for _ in ControlTreeStore.string_keys:
+            column, offset = SnapshotFile._read_column(buffer, offset, "i", node_count)
+            columns.append(column)
+        offsets, offset = SnapshotFile._read_column(
+            buffer, offset, "I", string_count + 1
+        )
+        text = bytes(buffer[offset : offset + blob_size]).decode("utf8")
+        string_table = [text[offsets[i] : offsets[i + 1]] for i in range(string_count)]
+        if extra:
+            extra = dict((int(key), value) for key, value in extra.items())
+        return ControlTreeStore.from_columns(columns, string_table, extra)
+
+    @staticmethod
+    def load(path):
+        """从文件加载快照
+
+        :param path: 快照文件路径
+        :type  path: string
+        """
+        time0 = time.time()
+        with open(path, "rb") as fp:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                buffer = memoryview(mm)
+                try:
+                    snapshot = SnapshotFile._load_from_buffer(buffer)
+                finally:
+                    buffer.release()
+        Log.i("SnapshotFile", "load %s cost %s S" % (path, time.time() - time0))
+        return snapshot
+
+    @staticmethod
+    def _load_from_buffer(buffer):
+        header_size = struct.calcsize(SnapshotFile.header_format)
+        if len(buffer) < header_size:
+            raise SnapshotFileError("文件长度不足")
+        magic, version, _, section_count = struct.unpack_from(
+            SnapshotFile.header_format, buffer
+        )
+        if magic != SnapshotFile.magic:
+            raise SnapshotFileError("不是快照文件")
+        if version > SnapshotFile.version:
+            raise SnapshotFileError("不支持的快照文件版本：%d" % version)
+        sections = []
+        offset = header_size
+        for _ in range(section_count):
+            tag, section_offset, size = struct.unpack_from(
+                SnapshotFile.section_format, buffer, offset
+            )
+            if section_offset + size > len(buffer):
+                raise SnapshotFileError("数据段超出文件范围")
+            sections.append((tag, section_offset, size))
+            offset += struct.calcsize(SnapshotFile.section_format)
+        if not sections or sections[0][0] != EnumSnapshotFileSection.Meta:
+            raise SnapshotFileError("缺少META段")
+        _, offset, size = sections[0]
+        meta = json.loads(bytes(buffer[offset : offset + size]).decode("utf8"))
+        tree_sections = []
+        screenshot = None
+        for tag, offset, size in sections[1:]:
+            if tag == EnumSnapshotFileSection.Tree:
+                tree_sections.append(offset)
+            elif tag == EnumSnapshotFileSection.Screenshot:
+                screenshot = bytes(buffer[offset : offset + size])
+
+        controls_dict = {}
+        index = 0
+        for tree in meta["trees"]:
+            items = [tree["process_name"]]
+            extra_list = tree.get("extra") or [None] * tree["count"]
+            for extra in extra_list:
+                if index >= len(tree_sections):
+                    raise SnapshotFileError("控件树数量不一致")
+                store = SnapshotFile._unpack_tree(buffer, tree_sections[index], extra)
+                items.append(store.root)
+                index += 1
+            controls_dict[tree["window_title"]] = items
+        return SnapshotFile(
+            controls_dict,
+            meta["windows"],
+            meta["current_window"],
+            meta["activities"],
+            screenshot,
+            meta["screen_size"],
+            meta["device_name"],
+            meta["timestamp"],
+        )
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,176 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""控件树差异计算
+"""
+
+
+class ControlTreeDelta(object):
+    """同一控件树两次抓取之间的差异，以控件的Hashcode标识节点
+
+    按removed、reordered、added、changed的顺序应用即可将旧的控件树更新为新的控件树
+    """
+
+    __slots__ = ("_removed", "_added", "_changed", "_reordered")
+
+    def __init__(self, removed, added, changed, reordered):
+        """
+
+        :param removed:   被删除的子树根节点的Hashcode列表，不包含其子孙节点
+        :type  removed:   list
+        :param added:     新增的子树列表，[(parent_hashcode, index, node), ...]，
+                          同一父节点下按index从小到大排列
+        :type  added:     list
+        :param changed:   自身属性变化的节点列表，不比较子节点
+        :type  changed:   list
+        :param reordered: 保留的子节点顺序发生变化的节点列表，需要重建其全部子节点
+        :type  reordered: list
+        """
+        self._removed = removed
+        self._added = added
+        self._changed = changed
+        self._reordered = reordered
+
+    def __str__(self):
+        return "<ControlTreeDelta removed=%d added=%d changed=%d reordered=%d>" % (
+            len(self._removed),
+            len(self._added),
+            len(self._changed),
+            len(self._reordered),
+        )
+
+    @property
+    def removed(self):
+        return self._removed
+
+    @property
+    def added(self):
+        return self._added
+
+    @property
+    def changed(self):
+        return self._changed
+
+    @property
+    def reordered(self):
+        return self._reordered
+
+    def is_empty(self):
+        """控件树是否没有变化"""
+        return not (self._removed or self._added or self._changed or self._reordered)
+
+
+def is_node_changed(old_node, new_node):
+    """节点自身的属性是否变化，包括位置、文本、可见性等，不比较子节点"""
+    if len(old_node) != len(new_node):
+        return True
+    for key, value in new_node.items():
+        if key == "Children":
+            continue
+        if key not in old_node or old_node[key] != value:
+            return True
+    return False
+
+
+def diff_control_tree(old_root, new_root):
+    """计算两棵控件树的差异
+
+    只有父节点未变化的节点会被复用，移动到其它父节点下的节点视为删除后新增
+
+    :param old_root: 上次抓取的控件树
+    :type  old_root: dict
+    :param new_root: 本次抓取的控件树
+    :type  new_root: dict
+    :return: ControlTreeDelta，根节点不同时返回None
+    """
+    if old_root["Hashcode"] != new_root["Hashcode"]:
+        return None
+    retained = set()  # 复用的节点
+    rebuilt = set()  # 需要重建全部子节点的节点
+    added = []
+    changed = []
+    reordered = []
+    stack = [(new_root, old_root)]
+    while stack:
+        node, old_node = stack.pop()
+        retained.add(node["Hashcode"])
+        if is_node_changed(old_node, node):
+            changed.append(node)
+        old_children = old_node["Children"]
+        children = node["Children"]
+        if [it["Hashcode"] for it in old_children] == [
+            it["Hashcode"] for it in children
+        ]:
+            for i in range(len(children) - 1, -1, -1):
+                stack.append((children[i], old_children[i]))
+            continue
+        old_child_dict = dict((it["Hashcode"], it) for it in old_children)
+        kept = [it["Hashcode"] for it in children if it["Hashcode"] in old_child_dict]
+        kept_set = set(kept)
+        old_kept = [it["Hashcode"] for it in old_children if it["Hashcode"] in kept_set]
+        if kept != old_kept:
+            reordered.append(node)
+            rebuilt.add(node["Hashcode"])
+            continue
+        pending = []
+        for index, child in enumerate(children):
+            old_child = old_child_dict.get(child["Hashcode"])
+            if old_child is None:
+                added.append((node["Hashcode"], index, child))
+            else:
+                pending.append((child, old_child))
+        stack.extend(reversed(pending))
+
+    removed = []
+    stack = [old_root]
+    while stack:
+        old_node = stack.pop()
+        if old_node["Hashcode"] in rebuilt:
+            continue  # 子节点会随重建一起删除
+        for child in old_node["Children"]:
+            if child["Hashcode"] in retained:
+                stack.append(child)
+            else:
+                removed.append(child["Hashcode"])
+    return ControlTreeDelta(removed, added, changed, reordered)
+
+
+def diff_control_trees(old_dict, new_dict):
+    """计算get_control_tree两次结果的差异
+
+    :param old_dict: 上次的结果，{window_title: [process_name, tree, ...]}
+    :type  old_dict: dict
+    :param new_dict: 本次的结果
+    :type  new_dict: dict
+    :return: {window_title: [delta, ...]}，窗口、进程或控件树根节点变化时返回None
+    """
+    if old_dict is None or list(old_dict) != list(new_dict):
+        return None
+    result = {}
+    for key, new_list in new_dict.items():
+        old_list = old_dict[key]
+        if len(old_list) != len(new_list) or old_list[0] != new_list[0]:
+            return None
+        result[key] = []
+        for i in range(1, len(new_list)):
+            delta = diff_control_tree(old_list[i], new_list[i])
+            if delta is None:
+                return None
+            result[key].append(delta)
+    return result
+
+
+if __name__ == "__main__":
+    pass
@@ -18,29 +18,88 @@
 
 import re
 from manager import BaseManager
+from manager.displaymanager import DisplayManager
+from manager.dumpsys import DumpsysQuery
+from manager.dumpsysgrammar import DumpsysGrammar, DumpsysRule
 from utils.logger import Log
 
+pattern_window = re.compile(r"^  Window #(\d+) Window{(\w{6,9}) (.*)}:$")
+pattern_window_ref = re.compile(r"Window{(\w{6,9}) (u0 ){0,1}(\S+).*}")
+pattern_shown_frame = re.compile(
+    r"mShownFrame=\[([-\d\.]+),([-\d\.]+)\]\[([-\d\.]+),([-\d\.]+)\]"
+)
+pattern_frame = re.compile(r" frame=\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]")
+pattern_package = re.compile(r" package=(\S+)")
+pattern_requested_size = re.compile(r"Requested w=(\d+) h=(\d+)")
+pattern_user_id = re.compile(r"^u\d+ ")
+pattern_session = re.compile(r"mSession=Session{\w+ (\d+):")  # 5.0开始包含进程pid
+
 
 class Window(object):
-    """窗口类"""
+    """窗口类，字段在创建时解析完成，之后不可修改"""
+
+    __slots__ = (
+        "_win_manager",
+        "_id",
+        "_hashcode",
+        "_title",
+        "_package",
+        "_x",
+        "_y",
+        "_w",
+        "_h",
+        "_attached_window",
+        "_pid",
+    )
 
-    def __init__(self, win_manager, _id, hashcode, title):
+    def __init__(
+        self,
+        win_manager,
+        _id,
+        hashcode,
+        title,
+        package=None,
+        x=None,
+        y=None,
+        w=0,
+        h=0,
+        attached_window=None,
+        pid=None,
+    ):
         self._win_manager = win_manager
         self._id = _id
         self._hashcode = hashcode
         if not isinstance(title, str):
             title = title.decode("utf8")
+        if package == "null":
+            package = None
+        if "/" in title:
+            pkg, title = title.split("/", 1)
+            if package is None:
+                package = pkg
+            if title[:1] == ".":
+                title = pkg + title
         self._title = title
-        self._attrs = {}
+        self._package = package
+        self._x = x
+        self._y = y
+        self._w = w
+        self._h = h
+        self._attached_window = attached_window
+        self._pid = pid
 
     def __str__(self):
-        result = "<Window id=%d hashcode=0x%s title=%s " % (
+        result = "<Window id=%d hashcode=0x%s title=%s package=%s" % (
             self._id,
             self._hashcode,
             self._title,
+            self._package,
         )
-        for attr in self._attrs:
-            result += "%s=%s " % (attr, self._attrs[attr])
+        if self._x is not None and self._y is not None:
+            result += " x=%d y=%d" % (self._x, self._y)
+        result += " w=%d h=%d" % (self._w, self._h)
+        if self._attached_window is not None:
+            result += " attached=0x%s" % self._attached_window.hashcode
         result += ">"
         return result
 
@@ -50,10 +109,11 @@ class Window(object):
             return False
         return self._hashcode == win.hashcode
 
-    def __setitem__(self, key, val):
-        self._attrs[key] = val
-        if key in ("x", "y", "w", "h"):
-            self._attrs[key] = int(self._attrs[key])
+    def __ne__(self, win):
+        return not self.__eq__(win)
+
+    def __hash__(self):
+        return hash(self._hashcode)
 
     @property
     def hashcode(self):
@@ -61,58 +121,56 @@ class Window(object):
 
     @property
     def position(self):
-        x = y = 0
-        if "x" in self._attrs:
-            x = self._attrs["x"]
-        if "y" in self._attrs:
-            y = self._attrs["y"]
-        return x, y
+        return self._x or 0, self._y or 0
 
     @property
     def size(self):
-        w = h = 0
-        if "w" in self._attrs:
-            w = self._attrs["w"]
-        if "h" in self._attrs:
-            h = self._attrs["h"]
-        return w, h
+        return self._w, self._h
 
     @property
     def title(self):
-        if "/" in self._title:
-            pkg, self._title = self._title.split("/")
-            if self._title[0] == ".":
-                self._title = pkg + self._title
         return self._title
 
     @property
     def package_name(self):
         """包名"""
-        result = self._attrs.get("package")
-        if result != None and result != "null":
-            return result
-        if "/" in self._title:
-            return self._title.split("/")[0]
-        attach_window = self.attached_window
-        if attach_window:
-            return attach_window.package_name
+        if self._package is not None:
+            return self._package
+        if self._attached_window is not None:
+            return self._attached_window.package_name
+        return None
+
+    @property
+    def pid(self):
+        """创建窗口的进程pid，无法获取时为None"""
+        if self._pid is not None:
+            return self._pid
+        if self._attached_window is not None:
+            return self._attached_window.pid
         return None
 
     @property
     def attached_window(self):
         """所依附的窗口"""
-        return self._attrs.get("mAttachedWindow")
+        return self._attached_window
+
+    @property
+    def attached_hashcode(self):
+        """所依附窗口的hashcode"""
+        if self._attached_window is None:
+            return None
+        return self._attached_window.hashcode
 
     def is_popup_window(self):
         """是否是弹出窗口"""
         if self._title == "SurfaceView":
             return False  # 暂不支持SurfaceView
-        w, h = self.size
+        w, h = self._w, self._h
         if w == 0 or h == 0:
             return False
         if w < 20 or h < 20:
             return False
-        if self.title in [
+        if self._title in [
             "Heads",
             "StatusBar",
             "InputMethod",
@@ -122,9 +180,9 @@ class Window(object):
             "RecentsPanel",
         ]:
             return False
-        if not "x" in self._attrs or not "y" in self._attrs:
+        if self._x is None or self._y is None:
             return False
-        if self._attrs["x"] > 0 or self._attrs["y"] > 0:
+        if self._x > 0 or self._y > 0:
             return True
         screen_width, screen_height = self._win_manager.get_screen_size()
         if (
@@ -141,34 +199,78 @@ class Window(object):
 class WindowManager(BaseManager):
     """窗口管理"""
 
+    grammar = DumpsysGrammar(
+        [
+            DumpsysRule("Window", "_on_window", pattern_window, indent=2),
+            DumpsysRule("mOwnerUid", "_on_package", pattern_package),
+            DumpsysRule("mDisplayId", "_on_session", pattern_session),
+            DumpsysRule("mSession", "_on_session", pattern_session),
+            DumpsysRule("Requested", "_on_requested_size", pattern_requested_size),
+            DumpsysRule(
+                "mShownFrame", "_on_frame", pattern_shown_frame, max_sdk_version=30
+            ),
+            DumpsysRule("Frames", "_on_frame", pattern_frame, min_sdk_version=31),
+            DumpsysRule("mAttachedWindow", "_on_attached_window", pattern_window_ref),
+            DumpsysRule("mParentWindow", "_on_attached_window", pattern_window_ref),
+            DumpsysRule("mCurrentFocus", "_on_current_focus", pattern_window_ref),
+            DumpsysRule("mCurrentFocus", "_on_current_focus"),
+            DumpsysRule("mHoldScreenWindow", "_on_focus_window", pattern_window_ref),
+            DumpsysRule("mObscuringWindow", "_on_focus_window", pattern_window_ref),
+            DumpsysRule("mInputMethodTarget", "_on_input_target", pattern_window_ref),
+            DumpsysRule("mInputMethodTarget", "_on_input_target"),
+            DumpsysRule("imeInputTarget", "_on_input_target", pattern_window_ref),
+            DumpsysRule("imeInputTarget", "_on_input_target"),
+        ]
+    )
+
     def __init__(self, device):
         self._device = device
         self._current_window = None
         self._current_input_target = None
+        self._focus_parsed = False  # 本次解析是否已经遇到mCurrentFocus
         self._window_list = []
+        self._window_dict = {}  # hashcode到窗口的索引
+        self._window_title_dict = {}  # 窗口标题到窗口的索引，标题相同时取第一个
+        self._screen_size = None  # 根据当前窗口列表推算的屏幕大小
+
+    def _resolve_window(self, window):
+        """将dumpsys中引用的窗口替换为窗口列表中的同一窗口"""
+        if window is None:
+            return None
+        return self._window_dict.get(window.hashcode, window)
+
+    def update(self, snapshot=None):
+        """刷新数据
 
-    def _update_window_info(self, window):
-        """更新窗口信息"""
-        if window is not None:
-            for win in self._window_list:
-                if window == win:
-                    for attr in win._attrs:
-                        window[attr] = win._attrs[attr]
-                    break
-
-    def update(self):
-        """刷新数据"""
-        self._window_list = self._get_windows_data()
+        :param snapshot: 设备快照，为None时单独查询窗口数据
+        :type  snapshot: DeviceSnapshot
+        """
+        if snapshot is not None:
+            self._window_list = self._get_windows_data(
+                snapshot.window_lines, snapshot.sdk_version
+            )
+        else:
+            self._window_list = self._get_windows_data()
+        self._window_dict = {}
+        self._window_title_dict = {}
+        self._screen_size = None
         for window in self._window_list:
-            # 修复attached_window的部分信息
-            self._update_window_info(window.attached_window)
-        if self._current_window is not None:
-            self._update_window_info(self._current_window)
-        if self._current_input_target is not None:
-            self._update_window_info(self._current_input_target)
+            self._window_dict[window.hashcode] = window
+            self._window_title_dict.setdefault(window.title, window)
+        self._current_window = self._resolve_window(self._current_window)
+        self._current_input_target = self._resolve_window(self._current_input_target)
 
     def get_screen_size(self):
-        """获取屏幕大小"""
+        """获取竖屏时的屏幕大小"""
+        screen_size = DisplayManager.get_instance(self._device).get_screen_size()
+        if screen_size is not None:
+            return screen_size
+        if self._screen_size is None:
+            self._screen_size = self._get_screen_size()
+        return self._screen_size
+
+    def _get_screen_size(self):
+        """根据窗口列表计算屏幕大小，无法获取屏幕参数时使用"""
         w = h = 0
         for win in self.get_window_list():
             if win.title.endswith(".Launcher"):
@@ -191,101 +293,171 @@ class WindowManager(BaseManager):
             self.update()
         return self._current_window
 
+    def get_window(self, hashcode=None, title=None):
+        """根据hashcode或窗口标题查找窗口
+
+        :param hashcode: 窗口hashcode
+        :type  hashcode: string
+        :param title:    窗口标题，存在多个相同标题的窗口时返回第一个
+        :type  title:    string
+        """
+        if not self._window_list:
+            self.update()
+        if hashcode is not None:
+            return self._window_dict.get(hashcode)
+        return self._window_title_dict.get(title)
+
     def get_window_list(self, update=False):
         """ """
         if not self._window_list or update:
             self.update()
         return self._window_list
 
-    def _get_windows_data(self):
-        """获取windows数据并解析"""
-        result = self._device.adb.run_shell_cmd("dumpsys window")
-        result = result.replace("\r", "")
-        # print result
-        windows = []
-        window = {}
-        p1 = re.compile(r"^  Window #(\d+) Window{(\w{6,9}) (.*)}:$")
-        p2 = re.compile(r"Window{(\w{6,9}) (u0 ){0,1}(\S+).*}")
-        # p2 =re.compile(r'Window{(\w+) (u0 ){0,1}(\S+).*}')
-        p3 = re.compile(
-            r"mShownFrame=\[([-\d\.]+),([-\d\.]+)\]\[([-\d\.]+),([-\d\.]+)\]"
+    def update_current_window(self):
+        """只刷新焦点窗口"""
+        lines = DumpsysQuery.get_instance(self._device).query_window_focus()
+        if lines is None:
+            self.update()
+            return self._current_window
+        self._current_window = None  # 输出中没有焦点窗口时为None
+        self._current_input_target = None
+        self._focus_parsed = False
+        dumpsys_query = DumpsysQuery.get_instance(self._device)
+        for _ in self.grammar.parse(lines, self, [], dumpsys_query.sdk_version):
+            pass
+        self._current_window = self._resolve_window(self._current_window)
+        self._current_input_target = self._resolve_window(self._current_input_target)
+        return self._current_window
+
+    def _on_window(self, window_fields, line, ret):
+        title = ret.group(3)
+        if pattern_user_id.match(title):
+            title = title.split(" ", 1)[1]
+        if " paused=" in title:
+            title = title.split(" paused=", 1)[0]  # 4.2以下版本
+        if "/" in title and " " in title:
+            title = title.split(" ", 1)[0]
+        window_fields.append(
+            {"id": int(ret.group(1)), "hashcode": ret.group(2), "title": title}
         )
-        for line in result.split("\n")[1:]:
-            # print repr(line)
-            ret = p1.match(line)
-            if ret:
-                title = ret.group(3)
-                if " " in title:
-                    items = title.split(" ")
-                    if "u0" == items[0]:
-                        title = items[1]
-                    else:
-                        title = items[0]
-                window = Window(
-                    self, int(ret.group(1)), ret.group(2), title
-                )  # 此逻辑可能有bug
-                windows.append(window)
-            elif "mHoldScreenWindow" in line:
-                ret = p2.search(line)
-                if ret:
-                    title = ret.group(3)
-                    self._current_window = Window(self, 0, ret.group(1), title)
-                else:
-                    Log.w("WindowManager", line)
-            elif "mObscuringWindow" in line:
-                ret = p2.search(line)
-                if ret:
-                    title = ret.group(3)
-                    self._current_window = Window(self, 0, ret.group(1), title)
-                else:
-                    Log.w("WindowManager", line)
-            elif "mCurrentFocus" in line:
-                ret = p2.search(line)
-                if ret:
-                    title = ret.group(3)
-                    self._current_window = Window(self, 0, ret.group(1), title)
-                else:
-                    Log.w("WindowManager", line)
-                    self._current_window = None
-            elif "mInputMethodTarget" in line or "imeInputTarget" in line:
-                ret = p2.search(line)
-                self._current_input_target = Window(
-                    self,
-                    0,
-                    ret.group(1),
-                    ret.group(2)
-                    if ret.group(2) and len(ret.group(2)) > 5
-                    else ret.group(3),
+
+    def _on_package(self, window_fields, line, ret):
+        if window_fields:
+            window_fields[-1]["package"] = ret.group(1)
+
+    def _on_session(self, window_fields, line, ret):
+        if window_fields:
+            window_fields[-1]["pid"] = int(ret.group(1))
+
+    def _on_requested_size(self, window_fields, line, ret):
+        if window_fields:
+            window_fields[-1]["w"] = int(ret.group(1))
+            window_fields[-1]["h"] = int(ret.group(2))
+
+    def _on_frame(self, window_fields, line, ret):
+        if window_fields:
+            window_fields[-1]["x"] = int(float(ret.group(1)))
+            window_fields[-1]["y"] = int(float(ret.group(2)))
+
+    def _on_attached_window(self, window_fields, line, ret):
+        if window_fields:
+            window_fields[-1]["attached"] = (
+                ret.group(1),
+                ret.group(2)
+                if ret.group(2) and len(ret.group(2)) > 5
+                else ret.group(3),
+            )
+
+    def _on_current_focus(self, window_fields, line, ret):
+        if self._focus_parsed:
+            return  # 多个显示器时每个显示器各有一行，第一行属于焦点所在的显示器
+        self._focus_parsed = True
+        if ret is None:
+            self._on_focus_lost(window_fields, line, ret)
+        else:
+            self._on_focus_window(window_fields, line, ret)
+
+    def _on_focus_window(self, window_fields, line, ret):
+        self._current_window = Window(self, 0, ret.group(1), ret.group(3))
+
+    def _on_focus_lost(self, window_fields, line, ret):
+        Log.w("WindowManager", line)
+        self._current_window = None
+
+    def _on_input_target(self, window_fields, line, ret):
+        if ret is None:
+            self._current_input_target = None
+        else:
+            self._current_input_target = Window(self, 0, ret.group(1), ret.group(3))
+
+    def _get_windows_data(self, lines=None, sdk_version=None):
+        """获取windows数据并解析
+
+        :param lines:       dumpsys的输出行，为None时从设备获取
+        :type  lines:       list
+        :param sdk_version: 输出对应的SDK版本，为None时使用全部解析规则
+        :type  sdk_version: int
+        """
+        if lines is None:
+            dumpsys_query = DumpsysQuery.get_instance(self._device)
+            lines = dumpsys_query.query_windows()
+            sdk_version = dumpsys_query.sdk_version
+        window_fields = []
+        self._focus_parsed = False
+        for _ in self.grammar.parse(lines[1:], self, window_fields, sdk_version):
+            pass
+        return self._build_windows(window_fields)
+
+    def _build_windows(self, window_fields):
+        """根据解析出的字段创建窗口，所依附的窗口会先创建"""
+        fields_dict = {}
+        for fields in window_fields:
+            fields_dict.setdefault(fields["hashcode"], fields)
+        built = {}  # id(fields) -> Window
+        return [
+            self._build_window(fields, fields_dict, built, set())
+            for fields in window_fields
+        ]
+
+    def _build_window(self, fields, fields_dict, built, building):
+        """创建单个窗口
+
+        :param fields_dict: hashcode到窗口字段的索引
+        :type  fields_dict: dict
+        :param built:       已创建的窗口
+        :type  built:       dict
+        :param building:    正在创建的窗口，用于避免循环依附
+        :type  building:    set
+        """
+        key = id(fields)
+        if key in built:
+            return built[key]
+        attached_window = None
+        if "attached" in fields:
+            hashcode, title = fields["attached"]
+            attached_fields = fields_dict.get(hashcode)
+            if attached_fields is not None and id(attached_fields) not in building:
+                building.add(key)
+                attached_window = self._build_window(
+                    attached_fields, fields_dict, built, building
                 )
-            elif line.startswith("    "):
-                if "mShownFrame" in line:
-                    ret = p3.search(line)
-                    window["x"] = int(float(ret.group(1)))
-                    window["y"] = int(float(ret.group(2)))
-                elif "mAttachedWindow" in line:
-                    ret = p2.search(line)
-                    window["mAttachedWindow"] = Window(
-                        self,
-                        0,
-                        ret.group(1),
-                        ret.group(2)
-                        if ret.group(2) and len(ret.group(2)) > 5
-                        else ret.group(3),
-                    )
-                else:
-                    items = line.split(" ")
-                    for item in items:
-                        if "=" not in item:
-                            continue
-                        pos = item.find("=")
-                        key = item[:pos]
-                        val = item[pos + 1 :]
-                        if key in ["package", "w", "h"]:
-                            window[key] = val
             else:
-                pass
-
-        return windows
+                attached_window = Window(self, 0, hashcode, title)
+        window = Window(
+            self,
+            fields["id"],
+            fields["hashcode"],
+            fields["title"],
+            package=fields.get("package"),
+            x=fields.get("x"),
+            y=fields.get("y"),
+            w=fields.get("w", 0),
+            h=fields.get("h", 0),
+            attached_window=attached_window,
+            pid=fields.get("pid"),
+        )
+        built[key] = window
+        return window
 
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""流式读取shell输出的测试
+
+    python -m unittest discover tests
+"""
+
+import threading
+import unittest
+
+from manager import SHELL_OUTPUT_END_MARK, BaseManager
+from manager.dumpsys import DumpsysQuery
+
+
+class FakeADBPopen(object):
+    """与qt4a.androiddriver.adbclient.ADBPopen接口相同的假进程
+
+    没有kill、wait，stdout没有close，readline在没有数据时会一直等待而不会返回空
+    """
+
+    class Pipe(object):
+        def __init__(self, data):
+            self._lines = data.splitlines(True)
+            self._condition = threading.Condition()
+
+        def readline(self):
+            with self._condition:
+                if not self._lines:
+                    # 真实的管道会一直等待，这里直接失败以免测试卡住
+                    raise AssertionError("readline blocked after end of output")
+                return self._lines.pop(0)
+
+        def read(self):
+            result = b"".join(self._lines)
+            self._lines = []
+            return result
+
+    def __init__(self, data):
+        self._stdout = self.Pipe(data)
+        self.terminated = False
+
+    @property
+    def stdout(self):
+        return self._stdout
+
+    def poll(self):
+        return None  # 接收线程在连接关闭前一直存活
+
+    def terminate(self):
+        self.terminated = True
+
+
+class FakeADB(object):
+    def __init__(self, outputs, sdk_version=30):
+        self._outputs = outputs  # {命令行中的关键字: 输出}
+        self._sdk_version = sdk_version
+        self.processes = []
+
+    def get_sdk_version(self):
+        return self._sdk_version
+
+    def run_shell_cmd(self, cmdline, sync=True):
+        for key, output in self._outputs:
+            if key in cmdline:
+                break
+        else:
+            output = ""
+        data = ("%s\n%s\n" % (output, SHELL_OUTPUT_END_MARK)).encode("utf8")
+        proc = FakeADBPopen(data)
+        self.processes.append(proc)
+        return proc
+
+
+class FakeDevice(object):
+    def __init__(self, adb):
+        self._device_id = "fake"
+        self.adb = adb
+
+
+class ShellOutputTest(unittest.TestCase):
+    def test_read_to_end_mark(self):
+        adb = FakeADB([("ls", "a\r\n\r\nb")])
+        manager = BaseManager(FakeDevice(adb))
+        self.assertEqual(list(manager._iter_shell_output("ls")), ["a", "b"])
+
+    def test_stop_early(self):
+        adb = FakeADB([("ls", "a\nb\nc")])
+        manager = BaseManager(FakeDevice(adb))
+        lines = manager._iter_shell_output("ls")
+        self.assertEqual(next(lines), "a")
+        lines.close()  # 剩余的输出由接收线程读完，不需要结束进程
+        self.assertFalse(adb.processes[0].terminated)
+
+    def test_sync_output(self):
+        class SyncADB(object):
+            def run_shell_cmd(self, cmdline, sync=True):
+                return "a\r\nb\r\n%s\r\n" % SHELL_OUTPUT_END_MARK
+
+        manager = BaseManager(FakeDevice(SyncADB()))
+        self.assertEqual(list(manager._iter_shell_output("ls")), ["a", "b"])
+
+    def test_iter_activities_fallback(self):
+        header = "ACTIVITY MANAGER ACTIVITIES (dumpsys activity activities)"
+        adb = FakeADB(
+            [
+                ("-p com.tencent.mm", "Unknown argument: -p"),
+                ("activities com.tencent.mm", header + "\n  * Hist #0"),
+            ]
+        )
+        query = DumpsysQuery(FakeDevice(adb))
+        lines = list(query.iter_activities("com.tencent.mm"))
+        self.assertEqual(lines, [header, "  * Hist #0"])
+        self.assertEqual(len(adb.processes), 2)
+
+        # 找到需要的数据后提前停止
+        lines = query.iter_activities("com.tencent.mm")
+        self.assertEqual(next(lines), header)
+        lines.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
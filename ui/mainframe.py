@@ -16,6 +16,7 @@
 import io
 import os
 import sys
+import tempfile
 import threading
 import time
 
@@ -23,17 +24,34 @@ import wx
 
 from PIL import Image
 from qt4a.androiddriver.adb import ADB
+from qt4a.androiddriver.androiddriver import AndroidDriver
 from qt4a.androiddriver.devicedriver import DeviceDriver
 from qt4a.androiddriver.util import ControlExpiredError
 
 from manager.controlmanager import EnumWebViewType, ControlManager, WebView
+from manager.controltree import ControlGridIndex
 from manager.devicemanager import DeviceManager
+from manager.displaymanager import DisplayManager
+from manager.driverpool import DriverPool
+from manager.snapshotfile import SnapshotFile, SnapshotFileError
 from manager.windowmanager import WindowManager
 from utils import run_in_thread
+from utils.adbstats import AdbStats, AdbStatsProxy, adb_stats_env
 from utils.logger import Log
-from utils.workthread import WorkThread
+from utils.tracing import Tracer
+from utils.replay import (
+    ReplayPlayer,
+    ReplaySession,
+    SessionRecorder,
+    record_env,
+    replay_env,
+    replay_latency_env,
+)
+from utils.workthread import CoalescingWorkThread, WorkThread
 
 default_size = [1360, 800]
+inspect_interval = 1.0 / 30  # 探测控件时处理鼠标移动的最小间隔
+snapshot_wildcard = "快照文件 (*.uisnap)|*.uisnap|所有文件 (*.*)|*.*"
 
 try:
     from version import version_info
@@ -49,7 +67,7 @@ def run_in_main_thread(func):
     """主线程运行"""
 
     def wrap_func(*args, **kwargs):
-        wx.CallAfter(func, *args, **kwargs)
+        wx.CallAfter(Tracer.bind(func), *args, **kwargs)
 
     return wrap_func
 
@@ -62,16 +80,40 @@ class MainFrame(wx.Frame):
         self._init_ctrls(parent)
         self._enable_inspect = False
         self._tree_list = []
+        self._control_index = None  # 按坐标查找控件的索引，控件树变化后置为None
+        # {hashcode: (控件树序号, 树形控件节点)}，节点未创建时为None
+        self._control_items = {}
+        self._loading_subtrees = {}  # 正在获取子节点的控件，{hashcode: [callback]}
+        self._refresh_pending = False  # 定时刷新的任务是否尚未完成
+        self._weex_requests = {}  # 待获取名称的Weex节点，{process_name: [hashcode]}
         self._select_device = None
         self._device_host = None
         self._scale_rate = 1  # 截图缩放比例
         self._mouse_move_enabled = False
+        self._last_mouse_pos = None
+        self._inspect_seq = 0  # 鼠标事件序号，用于丢弃过期的探测结果
+        self._inspect_webview = None  # 探测线程缓存的WebView，(key, WebView)
         self._image_path = None
-        self._device_manager = DeviceManager()
-        self._device_manager.register_callback(
-            self.on_device_inserted, self.on_device_removed
-        )
+        self._control_manager = None  # 离线查看快照时为None
+        self._display_manager = None
+        self._snapshot_file = None  # 当前打开的快照文件
+        self._snapshot_image_path = None  # 快照中截图的临时文件，退出时删除
+        self._recorder = None  # 设置了录制环境变量时录制设备调用
+        self._adb_stats = None  # 当前设备会话的adb调用统计
+        self._replay_player = None  # 设置了回放环境变量时使用录制的会话代替设备
+        replay_path = os.environ.get(replay_env)
+        if replay_path:
+            session = ReplaySession.load(replay_path)
+            latency_scale = float(os.environ.get(replay_latency_env) or 0)
+            self._replay_player = ReplayPlayer(session, latency_scale)
+            wx.CallAfter(self.on_device_inserted, session.device_id)
+        else:
+            self._device_manager = DeviceManager()
+            self._device_manager.register_callback(
+                self.on_device_inserted, self.on_device_removed
+            )
         self._work_thread = WorkThread()
+        self._inspect_thread = CoalescingWorkThread(inspect_interval)
         self.Bind(wx.EVT_SIZE, self.on_resize)
 
     def _get_window_size(self):
@@ -106,6 +148,7 @@ class MainFrame(wx.Frame):
         # 将状态栏分割为3个区域,比例为1:2:3
         self.statusbar.SetFieldsCount(3)
         self.statusbar.SetStatusWidths([-3, -2, -1])
+        self._init_menu_bar()
 
         self.panel = wx.Panel(
             self, size=(self._window_size[0] - 20, self._window_size[1] - 70)
@@ -151,6 +194,24 @@ class MainFrame(wx.Frame):
         # self.screen_panel.SetBackgroundColour(wx.BLUE)
         self._init_screen_panel(self.screen_panel)
 
+    def _init_menu_bar(self):
+        menu_bar = wx.MenuBar()
+        file_menu = wx.Menu()
+        item = file_menu.Append(wx.ID_OPEN, "打开快照...\tCtrl+O")
+        self.Bind(wx.EVT_MENU, self.on_open_snapshot_menu_click, item)
+        self.menu_save_snapshot = file_menu.Append(wx.ID_SAVE, "保存快照...\tCtrl+S")
+        self.menu_save_snapshot.Enable(False)
+        self.Bind(
+            wx.EVT_MENU, self.on_save_snapshot_menu_click, self.menu_save_snapshot
+        )
+        file_menu.AppendSeparator()
+        item = file_menu.Append(wx.ID_ANY, "导出耗时跟踪...")
+        self.Bind(wx.EVT_MENU, self.on_export_trace_menu_click, item)
+        item = file_menu.Append(wx.ID_ANY, "导出adb调用统计...")
+        self.Bind(wx.EVT_MENU, self.on_export_adb_stats_menu_click, item)
+        menu_bar.Append(file_menu, "文件")
+        self.SetMenuBar(menu_bar)
+
     def _init_device_panel(self, panel):
         self.btn_inspect = wx.Button(
             panel, label="+", name="btn_inspect", pos=(5, 5), size=wx.Size(20, 20)
@@ -216,6 +277,12 @@ class MainFrame(wx.Frame):
         )
         self.tc_refresh_interval.SetValue("1")
         wx.StaticText(panel, label="秒", pos=(710, 52), size=wx.DefaultSize)
+        self.cb_lazy_capture = wx.CheckBox(
+            panel, label="按需加载控件", pos=(750, 52), size=wx.DefaultSize
+        )
+        self.cb_lazy_capture.SetToolTip(
+            wx.ToolTip("只获取前几层控件，展开节点或探测时再获取子节点")
+        )
 
         self.refresh_timer = wx.Timer(self)
         self.Bind(
@@ -279,6 +346,12 @@ class MainFrame(wx.Frame):
         import atexit
 
         atexit._exithandlers = []  # 禁止退出时弹出错误框
+        self._save_recording()
+        self._dump_adb_stats()
+        if self._control_manager is not None:
+            self._control_manager.close()
+        if self._snapshot_image_path and os.path.isfile(self._snapshot_image_path):
+            os.remove(self._snapshot_image_path)
         event.Skip()
 
     def on_resize(self, event):
@@ -365,7 +438,10 @@ class MainFrame(wx.Frame):
             device_id = self._select_device
             if self._device_host:
                 device_id = self._device_host + ":" + device_id
-            self._device = DeviceDriver(ADB.open_device(device_id))
+            if self._control_manager is not None:
+                self._control_manager.close()  # 释放之前设备的测试桩及后台任务
+            self._snapshot_file = None
+            self._device = self._open_device(device_id)
             self.statusbar.SetStatusText("当前设备：%s" % self._select_device, 0)
             for tree in self._tree_list:
                 # 先删除之前创建的控件树
@@ -373,11 +449,16 @@ class MainFrame(wx.Frame):
                 tree["tree"].DeleteAllItems()
                 tree["tree"].Destroy()
             self._tree_list = []
+            self._control_index = None
+            self._control_items = {}
+            self._inspect_webview = None
             self._tree_idx = 0
             self.image.Hide()
             self.cb_activity.SetValue("")
             self._window_manager = WindowManager.get_instance(self._device)
             self._control_manager = ControlManager.get_instance(self._device)
+            self._display_manager = DisplayManager.get_instance(self._device)
+            run_in_thread(self._control_manager.prewarm_driver)()
             wx.CallLater(
                 1000, lambda: self.on_getcontrol_btn_click(None)
             )  # 自动获取控件树
@@ -385,6 +466,61 @@ class MainFrame(wx.Frame):
         self.btn_refresh.Enable(True)
         self.btn_getcontrol.Enable(True)
 
+    def _open_device(self, device_id):
+        """创建设备实例，录制或回放时返回对应的代理对象
+
+        设备的adb对象会被替换为统计调用耗时的代理对象
+        """
+        self._dump_adb_stats()
+        self._adb_stats = AdbStats(device_id)
+        if self._replay_player is not None:
+            device = self._replay_player.device
+            adb = device.adb
+            if isinstance(adb, AdbStatsProxy):
+                adb = adb.wrapped_object
+            device.adb = AdbStatsProxy(adb, self._adb_stats)
+            driver_pool = DriverPool.get_instance(device)
+            driver_pool.set_driver_factory(self._replay_player.create_driver)
+            return device
+        self._save_recording()
+        device = DeviceDriver(
+            AdbStatsProxy(ADB.open_device(device_id), self._adb_stats)
+        )
+        if os.environ.get(record_env):
+            self._recorder = SessionRecorder(device)
+            driver_pool = DriverPool.get_instance(device)
+            driver_pool.set_driver_factory(
+                self._recorder.wrap_driver_factory(AndroidDriver.create)
+            )
+            device = self._recorder.device
+        return device
+
+    def _save_recording(self):
+        """保存录制的会话"""
+        if self._recorder is None:
+            return
+        try:
+            self._recorder.session.save(os.environ[record_env])
+        except Exception:
+            Log.ex("MainFrame", "save recording failed")
+        self._recorder = None
+
+    def _dump_adb_stats(self):
+        """输出当前设备会话的adb调用统计，设置了环境变量时同时保存到文件"""
+        if self._adb_stats is None or not self._adb_stats.commands:
+            self._adb_stats = None
+            return
+        Log.i("MainFrame", "adb stats:\n%s" % self._adb_stats.format_report())
+        path = os.environ.get(adb_stats_env)
+        if path:
+            root, ext = os.path.splitext(path)
+            device_id = self._adb_stats.device_id.replace(":", "_")
+            try:
+                self._adb_stats.save("%s_%s%s" % (root, device_id, ext))
+            except EnvironmentError:
+                Log.ex("MainFrame", "save adb stats failed")
+        self._adb_stats = None
+
     def on_getcontrol_btn_click(self, event):
         """点击获取控件按钮"""
         self.btn_getcontrol.Enable(False)
@@ -403,17 +539,16 @@ class MainFrame(wx.Frame):
             )
             result = dlg.ShowModal()
             if result == wx.ID_YES:
-                self.on_refresh_btn_click(None)
+                self.on_refresh_btn_click(None, True)
             dlg.Destroy()
 
         self.statusbar.SetStatusText("正在获取控件树……", 0)
+        self._control_manager.lazy_capture = self.cb_lazy_capture.IsChecked()
 
         def _update_control_tree():
             time0 = time.time()
             try:
-                controls_dict = (
-                    self._control_manager.get_control_tree()
-                )  # self.cb_activity.GetValue().strip(), index
+                controls_dict, deltas = self._control_manager.get_control_tree_delta()
                 if not controls_dict:
                     return
             except RuntimeError as e:
@@ -441,17 +576,40 @@ class MainFrame(wx.Frame):
             for key in controls_dict:
                 msg += "\n%s: %d" % (key, len(controls_dict[key]) - 1)
             Log.i("MainFrame", "get control tree cost %s S%s" % (used_time, msg))
-            self._show_control_tree(controls_dict)
+            self._show_control_tree(controls_dict, deltas)
 
-        run_in_thread(_update_control_tree)()
+        def _get_controls():
+            with Tracer.span("get_controls", device=self._select_device):
+                t = threading.Thread(
+                    target=Tracer.bind(self._refresh_device_screenshot)
+                )
+                t.setDaemon(True)
+                t.start()
+                _update_control_tree()
 
-        t = threading.Thread(target=self._refresh_device_screenshot)
-        t.setDaemon(True)
-        t.start()
+        run_in_thread(_get_controls)()
 
     @run_in_main_thread
-    def _show_control_tree(self, controls_dict):
-        """显示控件树"""
+    def _show_control_tree(self, controls_dict, deltas=None):
+        """显示控件树
+
+        :param deltas: 相对当前显示的控件树的增量，为None时全量重建
+        :type  deltas: dict
+        """
+        root_span = Tracer.current_span()
+        with Tracer.span("show_control_tree"):
+            self.__show_control_tree(controls_dict, deltas)
+        if root_span is not None:
+            self.statusbar.SetStatusText(Tracer.summarize(root_span), 1)
+
+    def __show_control_tree(self, controls_dict, deltas):
+        if deltas is not None and self._apply_control_tree_deltas(
+            controls_dict, deltas
+        ):
+            self._mouse_move_enabled = True
+            self.btn_inspect.Enable(True)
+            self.btn_getcontrol.Enable(True)
+            return
         self.show_controls(controls_dict)
 
         self._mouse_move_enabled = True
@@ -459,19 +617,179 @@ class MainFrame(wx.Frame):
         self.tree.SelectItem(self.root)
         self.tree.SetFocus()
         self.btn_getcontrol.Enable(True)
+        self.menu_save_snapshot.Enable(True)
+
+    def on_open_snapshot_menu_click(self, event):
+        """打开快照文件，无需连接设备"""
+        dlg = wx.FileDialog(
+            self,
+            "打开快照",
+            wildcard=snapshot_wildcard,
+            style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST,
+        )
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        path = dlg.GetPath()
+        dlg.Destroy()
+        try:
+            with wx.BusyCursor():
+                snapshot = SnapshotFile.load(path)
+        except (SnapshotFileError, EnvironmentError, ValueError) as e:
+            Log.ex("MainFrame", "load snapshot %s failed" % path)
+            dlg = wx.MessageDialog(
+                self, "%s" % e, "打开快照失败", style=wx.OK | wx.ICON_ERROR
+            )
+            dlg.ShowModal()
+            dlg.Destroy()
+            return
+        self._show_snapshot(snapshot)
+        self.statusbar.SetStatusText("已打开快照：%s" % path, 0)
+
+    def _show_snapshot(self, snapshot):
+        """显示快照文件中的窗口、控件树及截图"""
+        if self.cb_auto_refresh.IsChecked():
+            self.cb_auto_refresh.SetValue(False)
+            self.on_auto_fresh_checked(None)
+        if self._control_manager is not None:
+            self._control_manager.close()
+        self._control_manager = None
+        self._display_manager = None
+        self._select_device = None  # 重新选择设备时恢复在线模式
+        self._snapshot_file = snapshot
+        self._enable_inspect = False
+        self.cb_device.SetValue("")
+        self.btn_refresh.Enable(False)
+        self.btn_getcontrol.Enable(False)
 
-    def on_refresh_btn_click(self, event):
-        """刷新按钮点击回调"""
+        self.cb_activity.Clear()
+        for window in snapshot.windows:
+            idx = self.cb_activity.Append(window["title"])
+            if window["hashcode"] == snapshot.current_window:
+                self.cb_activity.SetSelection(idx)
+        self.show_controls(snapshot.controls_dict)
+        self._mouse_move_enabled = True
+        self.btn_inspect.Enable(True)
+        self.tree.SelectItem(self.root)
+        self.menu_save_snapshot.Enable(True)
+
+        if snapshot.screenshot:
+            if self._snapshot_image_path is None:
+                self._snapshot_image_path = os.path.join(
+                    tempfile.gettempdir(), "AndroidUISpy_snapshot_%d.png" % os.getpid()
+                )
+            with open(self._snapshot_image_path, "wb") as fp:
+                fp.write(snapshot.screenshot)
+            self._set_image(self._snapshot_image_path)
+        else:
+            self.image.Hide()
+            self.mask_panel.Hide()
+
+    def on_export_trace_menu_click(self, event):
+        """导出各阶段耗时，可在chrome://tracing中查看"""
+        dlg = wx.FileDialog(
+            self,
+            "导出耗时跟踪",
+            wildcard="Chrome Trace (*.json)|*.json",
+            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT,
+        )
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        path = dlg.GetPath()
+        dlg.Destroy()
+        try:
+            count = Tracer.export_chrome_trace(path)
+        except EnvironmentError:
+            Log.ex("MainFrame", "export trace to %s failed" % path)
+            return
+        self.statusbar.SetStatusText("已导出%d条耗时记录：%s" % (count, path), 0)
+
+    def on_export_adb_stats_menu_click(self, event):
+        """导出当前设备会话的adb调用统计，扩展名为.json时导出为JSON格式"""
+        if self._adb_stats is None:
+            dlg = wx.MessageDialog(
+                self, "请先选择设备", "提示", style=wx.OK | wx.ICON_INFORMATION
+            )
+            dlg.ShowModal()
+            dlg.Destroy()
+            return
+        dlg = wx.FileDialog(
+            self,
+            "导出adb调用统计",
+            wildcard="文本文件 (*.txt)|*.txt|JSON (*.json)|*.json",
+            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT,
+        )
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        path = dlg.GetPath()
+        dlg.Destroy()
+        try:
+            self._adb_stats.save(path)
+        except EnvironmentError:
+            Log.ex("MainFrame", "export adb stats to %s failed" % path)
+            return
+        self.statusbar.SetStatusText("已导出adb调用统计：%s" % path, 0)
+
+    def on_save_snapshot_menu_click(self, event):
+        """将当前显示的控件树、窗口列表及截图保存为快照文件"""
+        dlg = wx.FileDialog(
+            self,
+            "保存快照",
+            wildcard=snapshot_wildcard,
+            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT,
+        )
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        path = dlg.GetPath()
+        dlg.Destroy()
+        try:
+            with wx.BusyCursor():
+                if self._control_manager is None:
+                    snapshot = self._snapshot_file
+                else:
+                    controls_dict = {}
+                    for tree_item in self._tree_list:
+                        items = controls_dict.setdefault(
+                            tree_item["window_title"], [tree_item["process_name"]]
+                        )
+                        items.append(tree_item["tree"].GetItemData(tree_item["root"]))
+                    snapshot = SnapshotFile.create(
+                        self._device,
+                        controls_dict,
+                        self._image_path,
+                        self._select_device,
+                        self._control_manager.tree_snapshot,
+                    )
+                snapshot.save(path)
+        except Exception as e:
+            Log.ex("MainFrame", "save snapshot %s failed" % path)
+            dlg = wx.MessageDialog(
+                self, "%s" % e, "保存快照失败", style=wx.OK | wx.ICON_ERROR
+            )
+            dlg.ShowModal()
+            dlg.Destroy()
+            return
+        self.statusbar.SetStatusText("快照已保存：%s" % path, 0)
+
+    def on_refresh_btn_click(self, event, force=False):
+        """刷新按钮点击回调
+
+        :param force: 是否强制刷新，否则界面未变化时使用缓存的窗口列表
+        :type  force: bool
+        """
         self.statusbar.SetStatusText("正在获取窗口列表……", 0)
         time0 = time.time()
-        self.show_windows()
+        self.show_windows(force)
         used_time = time.time() - time0
         self.statusbar.SetStatusText("获取窗口列表完成，耗时：%s S" % used_time, 0)
 
-    def show_windows(self):
+    def show_windows(self, force=False):
         """显示Window列表"""
         self.cb_activity.Clear()
-        self._control_manager.update()
+        self._control_manager.get_snapshot(force)
         current_window = self._window_manager.get_current_window()
 
         if current_window is None:
@@ -536,16 +854,21 @@ class MainFrame(wx.Frame):
             point = event.Point
         else:
             point = event.GetPosition()
+        if self._control_manager is None:
+            event.Skip()  # 离线快照不支持需要设备的操作
+            return
         item, _ = self.tree.HitTest(point)
         self.tree.PopupMenu(TreeNodePopupMenu(self, item), point)
         event.Skip()
 
     def _draw_mask(self, control):
         """绘制高亮区域"""
+        self._draw_rect_mask(self.tree.GetItemData(control)["Rect"])
+
+    def _draw_rect_mask(self, rect):
+        """绘制控件区域的高亮框"""
         if not self._scale_rate:
             return
-        item_data = self.tree.GetItemData(control)
-        rect = item_data["Rect"]
         p1 = rect["Left"] * self._scale_rate, rect["Top"] * self._scale_rate
         p2 = (rect["Left"] + rect["Width"]) * self._scale_rate, (
             rect["Top"] + rect["Height"]
@@ -605,29 +928,340 @@ class MainFrame(wx.Frame):
             _id = _id[3:]
         return _id
 
-    def _add_child(self, process_name, tree, parent, child, is_weex_node=False):
-        """添加树形控件节点"""
+    def _add_child(
+        self,
+        process_name,
+        tree,
+        item_dict,
+        parent,
+        child,
+        is_weex_node=False,
+        index=None,
+    ):
+        """添加树形控件节点，子节点在展开时再创建
+
+        :param item_dict: 控件Hashcode到树形控件节点的索引
+        :type  item_dict: dict
+        :param index:     插入的位置，为None时添加到最后
+        :type  index:     int
+        """
+        node_name = self._get_node_name(process_name, child, is_weex_node)
+        if index is None:
+            node = tree.AppendItem(parent, node_name, data=child)
+        else:
+            node = tree.InsertItem(parent, index, node_name, data=child)
+        item_dict[child["Hashcode"]] = node
+        if child["Children"] or (
+            self._control_manager is not None
+            and self._control_manager.is_partial_control(child["Hashcode"])
+        ):
+            tree.SetItemHasChildren(node, True)  # 展开时再创建或获取子节点
+        return node
+
+    def _populate_tree_item(self, tree_item, item, node=None):
+        """创建节点的子节点，已创建时不重复创建
+
+        :param node: 节点的控件数据，为None时使用树形控件节点的数据
+        :type  node: ControlNode
+        """
+        tree = tree_item["tree"]
+        if tree.GetChildrenCount(item, False):
+            return
+        if node is None:
+            node = tree.GetItemData(item)
+        if not node["Children"]:
+            return
+        is_weex_node = self._is_weex_parent(tree, item)
+        for child in node["Children"]:
+            child_item = self._add_child(
+                tree_item["process_name"],
+                tree,
+                tree_item["item_dict"],
+                item,
+                child,
+                is_weex_node,
+            )
+            self._set_control_item(tree_item, child["Hashcode"], child_item)
+
+    def _set_control_item(self, tree_item, hashcode, item):
+        """更新全局索引中控件对应的树形控件节点，hashcode重复时使用靠前的控件树中的节点"""
+        entry = self._control_items.get(hashcode)
+        if entry is None or entry[0] >= tree_item["index"]:
+            self._control_items[hashcode] = (tree_item["index"], item)
+
+    def _update_control_items(self):
+        """重建所有控件树的hashcode到(控件树序号, 树形控件节点)的索引
+
+        控件树重建、应用增量及按需加载子节点后调用，hashcode重复时使用靠前的控件树中的节点
+        """
+        control_items = {}
+        for index in range(len(self._tree_list) - 1, -1, -1):
+            tree_item = self._tree_list[index]
+            root = tree_item["tree"].GetItemData(tree_item["root"])
+            entry = (index, None)
+            control_items.update(
+                dict.fromkeys(tree_item["store"].get_hashcodes(root.index), entry)
+            )
+            control_items.update(
+                (hashcode, (index, item))
+                for hashcode, item in tree_item["item_dict"].items()
+            )
+        self._control_items = control_items
+
+    def _populate_children(self, item):
+        """创建当前控件树中节点的子节点"""
+        self._populate_tree_item(self._tree_list[self._tree_idx], item)
+
+    def _get_tree_item(self, tree_item, index):
+        """获取控件对应的树形控件节点，未创建时只创建其祖先节点的子节点
+
+        :param index: 控件在tree_item["store"]中的下标
+        :type  index: int
+        :return: 树形控件节点，不存在时返回None
+        """
+        store = tree_item["store"]
+        item_dict = tree_item["item_dict"]
+        path = []
+        item = None
+        while index >= 0:
+            item = item_dict.get(store.get_hashcode(index))
+            if item is not None:
+                break
+            path.append(index)
+            index = store.get_parent(index)
+        if item is None:
+            return None
+        for index in reversed(path):
+            self._populate_tree_item(tree_item, item)
+            item = item_dict.get(store.get_hashcode(index))
+            if item is None:
+                return None
+        return item
+
+    def _get_node_name(self, process_name, child, is_weex_node=False):
+        """获取节点显示的名称
+
+        Weex节点的名称未缓存时先显示占位名称，在后台获取后再更新
+        """
         node_name = self._handle_control_id(child["Id"])
-        if is_weex_node:
+        if is_weex_node and self._control_manager is not None:
             if not child["Type"].startswith("android.") and not child[
                 "Type"
             ].startswith("com.android."):
-                driver = self._control_manager._get_driver(process_name)
-                try:
-                    node_name = driver.get_object_field_value(
-                        child["Hashcode"], "mTest"
-                    )
-                except Exception as e:
-                    Log.ex("MainFrame", "get field mTest failed")
-                else:
-                    if not node_name:
-                        node_name = "None"
-        elif child["Type"].endswith(".WeexView"):
-            is_weex_node = True
-        node = tree.AppendItem(parent, node_name, data=child)
-        for subchild in child["Children"]:
-            self._add_child(process_name, tree, node, subchild, is_weex_node)
+                hashcode = child["Hashcode"]
+                weex_name = self._control_manager.get_cached_weex_node_name(
+                    process_name, hashcode
+                )
+                if weex_name is not None:
+                    return weex_name
+                if not self._weex_requests:
+                    wx.CallAfter(self._request_weex_node_names)
+                self._weex_requests.setdefault(process_name, []).append(hashcode)
+                node_name += " ..."
+        return node_name
+
+    def _request_weex_node_names(self):
+        """提交本轮事件中新增的Weex节点，在后台获取名称"""
+        requests = self._weex_requests
+        self._weex_requests = {}
+        if self._control_manager is None:
+            return
+        for process_name, hashcodes in requests.items():
+            self._control_manager.resolve_weex_node_names(
+                process_name, hashcodes, self._on_weex_node_names_resolved
+            )
+
+    @run_in_main_thread
+    def _on_weex_node_names_resolved(self, process_name, names):
+        """更新已获取名称的Weex节点，获取失败的节点显示控件ID"""
+        for tree_item in self._tree_list:
+            if tree_item["process_name"] != process_name:
+                continue
+            tree = tree_item["tree"]
+            for hashcode, name in names.items():
+                item = tree_item["item_dict"].get(hashcode)
+                if item is None:
+                    continue
+                if name is None:
+                    name = self._handle_control_id(tree.GetItemData(item)["Id"])
+                tree.SetItemText(item, name)
+
+    def _is_weex_parent(self, tree, item):
+        """节点的子节点是否是Weex节点，即节点自身或其祖先节点是WeexView"""
+        while item.IsOk():
+            if tree.GetItemData(item)["Type"].endswith(".WeexView"):
+                return True
+            item = tree.GetItemParent(item)
+        return False
+
+    def _delete_tree_item(self, tree, item_dict, item, children_only=False):
+        """删除树形控件节点及其在索引中的子孙节点"""
+        stack = []
+        child, cookie = tree.GetFirstChild(item)
+        while child.IsOk():
+            stack.append(child)
+            child = tree.GetNextSibling(child)
+        while stack:
+            child = stack.pop()
+            item_dict.pop(tree.GetItemData(child)["Hashcode"], None)
+            sub_item, cookie = tree.GetFirstChild(child)
+            while sub_item.IsOk():
+                stack.append(sub_item)
+                sub_item = tree.GetNextSibling(sub_item)
+        if children_only:
+            tree.DeleteChildren(item)
+        else:
+            item_dict.pop(tree.GetItemData(item)["Hashcode"], None)
+            tree.Delete(item)
+
+    def _load_subtree(self, tree_item, item, callback=None):
+        """在工作线程中获取按需加载的节点的子节点，完成后在主线程中加入树形控件
+
+        :param callback: 获取完成后在主线程中调用，参数为是否有新增子节点
+        :type  callback: function
+        :return: 节点是否需要获取子节点，为False时不会调用callback
+        """
+        item_data = tree_item["tree"].GetItemData(item)
+        if (
+            item_data["Children"]
+            or self._control_manager is None
+            or not self._control_manager.is_partial_control(item_data["Hashcode"])
+        ):
+            return False
+        hashcode = item_data["Hashcode"]
+        callbacks = self._loading_subtrees.get(hashcode)
+        if callbacks is None:
+            callbacks = self._loading_subtrees[hashcode] = []
+            self.statusbar.SetStatusText("正在获取子节点……", 0)
+            self._work_thread.post_task(
+                self._fetch_subtree, self._control_manager, tree_item, item, hashcode
+            )
+        if callback is not None:
+            callbacks.append(callback)
+        return True
+
+    def _fetch_subtree(self, control_manager, tree_item, item, hashcode):
+        """在工作线程中获取子节点"""
+        try:
+            children = control_manager.fetch_control_subtree(hashcode)
+        except Exception:
+            Log.ex("MainFrame", "get subtree of %X failed" % hashcode)
+            children = None
+        self._on_subtree_fetched(control_manager, tree_item, item, hashcode, children)
+
+    @run_in_main_thread
+    def _on_subtree_fetched(self, control_manager, tree_item, item, hashcode, children):
+        """将获取到的子节点加入树形控件，控件树已重建时丢弃"""
+        callbacks = self._loading_subtrees.pop(hashcode, [])
+        self.statusbar.SetStatusText("", 0)
+        if control_manager is not self._control_manager or not any(
+            it is tree_item for it in self._tree_list
+        ):
+            return
+        if tree_item["item_dict"].get(hashcode) != item:
+            return  # 节点已被删除
+        node = control_manager.apply_control_subtree(hashcode, children)
+        loaded = node is not None and len(node["Children"]) > 0
+        if loaded:
+            self._control_index = None
+            self._populate_tree_item(tree_item, item, node)
+            self._update_control_items()
+            tree_item["tree"].Expand(item)
+        elif children is not None:
+            tree_item["tree"].SetItemHasChildren(item, False)
+        for callback in callbacks:
+            callback(loaded)
+
+    def on_tree_item_expanding(self, event):
+        """展开节点时获取按需加载的子节点"""
+        tree = event.GetEventObject()
+        for tree_item in self._tree_list:
+            if tree_item["tree"] is tree:
+                if not self._load_subtree(tree_item, event.GetItem()):
+                    self._populate_tree_item(tree_item, event.GetItem())
+                break
+        event.Skip()
 
+    def _apply_control_tree_delta(self, tree_item, delta):
+        """在已有的树形控件上应用增量"""
+        tree = tree_item["tree"]
+        item_dict = tree_item["item_dict"]
+        process_name = tree_item["process_name"]
+        # 尚未创建的节点展开时会从最新的控件树中创建，只需更新已创建的节点
+        for hashcode in delta.removed:
+            item = item_dict.get(hashcode)
+            if item is not None:
+                self._delete_tree_item(tree, item_dict, item)
+        for node in delta.reordered:
+            item = item_dict.get(node["Hashcode"])
+            if item is None:
+                continue
+            expanded = tree.IsExpanded(item)
+            self._delete_tree_item(tree, item_dict, item, True)
+            tree.SetItemData(item, node)
+            tree.SetItemHasChildren(item, bool(node["Children"]))
+            if expanded:
+                self._populate_tree_item(tree_item, item, node)
+        for parent_hashcode, index, node in delta.added:
+            parent = item_dict.get(parent_hashcode)
+            if parent is None:
+                continue
+            if not tree.GetChildrenCount(parent, False):
+                tree.SetItemHasChildren(parent, True)
+                continue
+            is_weex_node = self._is_weex_parent(tree, parent)
+            self._add_child(
+                process_name, tree, item_dict, parent, node, is_weex_node, index
+            )
+        for node in delta.changed:
+            item = item_dict.get(node["Hashcode"])
+            if item is None:
+                continue
+            tree.SetItemData(item, node)
+            if not self._is_weex_parent(tree, tree.GetItemParent(item)):
+                tree.SetItemText(item, self._get_node_name(process_name, node))
+
+    @Tracer.trace("apply_delta")
+    def _apply_control_tree_deltas(self, controls_dict, deltas):
+        """在已有的控件树上应用增量，控件树与增量不对应时返回False"""
+        tree_keys = [(it["window_title"], it["tree_index"]) for it in self._tree_list]
+        delta_keys = []
+        for key in deltas:
+            delta_keys.extend((key, i) for i in range(len(deltas[key])))
+        if not tree_keys or tree_keys != delta_keys:
+            return False
+        self._control_index = None
+        self._inspect_webview = None  # 控件树变化后测试桩可能已被重新创建
+        for tree_item in self._tree_list:
+            delta = deltas[tree_item["window_title"]][tree_item["tree_index"]]
+            tree_root = controls_dict[tree_item["window_title"]][
+                tree_item["tree_index"] + 1
+            ]
+            tree_item["store"] = tree_root.store
+            tree_item["tree"].SetItemData(tree_item["root"], tree_root)
+            if not delta.is_empty():
+                tree_item["tree"].Freeze()
+                try:
+                    self._apply_control_tree_delta(tree_item, delta)
+                except KeyError:
+                    Log.ex("MainFrame", "apply control tree delta failed")
+                    return False  # 与显示的控件树不一致时全量重建
+                finally:
+                    tree_item["tree"].Thaw()
+            self._refresh_item_data(tree_item)
+        self._update_control_items()
+        return True
+
+    def _refresh_item_data(self, tree_item):
+        """将已创建节点的数据指向最新的控件树，未变化的节点仍引用之前抓取的数据"""
+        tree = tree_item["tree"]
+        store = tree_item["store"]
+        for hashcode, item in tree_item["item_dict"].items():
+            index = store.find(hashcode)
+            if index >= 0:
+                tree.SetItemData(item, store.get_node(index))
+
+    @Tracer.trace("build_tree_ctrl")
     def _build_control_trees(self, controls_dict):
         """构建控件树"""
         for tree in self._tree_list:
@@ -637,6 +1271,8 @@ class MainFrame(wx.Frame):
             tree["tree"].Destroy()
 
         self._tree_list = []
+        self._control_index = None
+        self._inspect_webview = None  # 控件树变化后测试桩可能已被重新创建
         index = -1
         for idx, key in enumerate(controls_dict.keys()):
             if index < 0:
@@ -653,23 +1289,31 @@ class MainFrame(wx.Frame):
                 root = tree.AddRoot(
                     self._handle_control_id(tree_root["Id"]), data=tree_root
                 )
-                for child in tree_root["Children"]:
-                    self._add_child(process_name, tree, root, child)
+                item_dict = {tree_root["Hashcode"]: root}
+                if tree_root["Children"]:
+                    tree.SetItemHasChildren(root, True)  # 展开时再创建子节点
                 tree.Bind(wx.EVT_TREE_SEL_CHANGED, self.on_tree_node_click)
+                tree.Bind(wx.EVT_TREE_ITEM_EXPANDING, self.on_tree_item_expanding)
                 # tree.Bind(wx.EVT_MOUSE_EVENTS, self.on_tree_mouse_event)
                 tree.Bind(wx.EVT_RIGHT_DOWN, self.on_tree_node_right_click)
 
                 # tree.Bind(wx.EVT_TREE_ITEM_RIGHT_CLICK, self.on_tree_node_right_click)
 
                 item = {
+                    "index": len(self._tree_list),
                     "process_name": process_name,
                     "window_title": key,
                     "tree": tree,
                     "root": root,
+                    "tree_index": i - 1,
+                    "item_dict": item_dict,
+                    "store": tree_root.store,
                 }
                 self._tree_list.append(item)
+        self._update_control_items()
         self.switch_control_tree(index)
 
+    @Tracer.trace("screenshot")
     def _take_screen_shot(self, tmp_path, path, use_cmd=True):
         """屏幕截图"""
         if use_cmd:
@@ -696,6 +1340,12 @@ class MainFrame(wx.Frame):
 
         if not os.path.exists(path):
             Log.w("Screenshot", "file not exist")
+        else:
+            try:
+                with Image.open(path) as image:
+                    self._display_manager.check_screen_size(*image.size)
+            except:
+                Log.ex("Screenshot", "check screen size failed")
 
         # image = Image.open(path)
         # image = image.rotate(90, expand=True)
@@ -712,15 +1362,23 @@ class MainFrame(wx.Frame):
         img_width, img_height = image.size
         panel_width, panel_height = self.screen_panel.Size
         print(panel_width, panel_height, img_width, img_height)
+        screen_width = img_width  # 控件坐标所在的屏幕宽度
+        if self._display_manager is not None:
+            geometry = self._display_manager.geometry
+            if geometry is not None:
+                screen_width = geometry.size[0]
+        elif self._snapshot_file is not None and self._snapshot_file.screen_size:
+            screen_width = self._snapshot_file.screen_size[0]
         if panel_width < img_width or panel_height < img_height:
             x_radio = panel_width / img_width
             y_radio = panel_height / img_height
-            self._scale_rate = min(x_radio, y_radio)
-            img_width = int(self._scale_rate * img_width)
-            img_height = int(self._scale_rate * img_height)
+            scale_rate = min(x_radio, y_radio)
+            img_width = int(scale_rate * img_width)
+            img_height = int(scale_rate * img_height)
             self.image.SetSize((img_width, img_height))
             self.mask_panel.SetSize((img_width, img_height))
             image = image.resize((img_width, img_height), Image.LANCZOS)
+        self._scale_rate = img_width / screen_width
 
         x = (panel_width - img_width) // 2
         y = (panel_height - img_height) // 2
@@ -790,14 +1448,16 @@ class MainFrame(wx.Frame):
         if not self._mouse_move_enabled:
             return
 
-        if not hasattr(self, "_last_mouse_pos"):
-            self._last_mouse_pos = x, y
-        else:
+        is_click = event.EventType == wx.EVT_LEFT_UP.typeId
+        if not is_click:
             if (
-                abs(x - self._last_mouse_pos[0]) <= 5
+                self._last_mouse_pos is not None
+                and abs(x - self._last_mouse_pos[0]) <= 5
                 and abs(y - self._last_mouse_pos[1]) <= 5
             ):
                 return
+            self._last_mouse_pos = x, y
+        self._inspect_seq += 1
 
         web_inspect_enabled = (
             hasattr(self, "_current_webview") and self._current_webview is not None
@@ -816,75 +1476,94 @@ class MainFrame(wx.Frame):
                 and y > rect["Top"]
                 and y < rect["Top"] + rect["Height"]
             ):
-                try:
-                    webview = WebView(
-                        self._control_manager.get_driver(self.cb_activity.GetValue()),
-                        item_data["Hashcode"],
-                    )
-                except ControlExpiredError:
-                    # 页面已关闭
-                    self._close_remote_web_debug()
-                    return
-                except RuntimeError as e:
-                    Log.ex("onmouseover error")
-                    self._close_remote_web_debug()
-                    return
-
-                if event.EventType == wx.EVT_LEFT_UP.typeId:
-                    # 点击事件
-                    if self._chrome:
-                        # 在Native层点击
-                        Log.i("WebViewDebugging", "click %d %d" % (x, y))
-                        webview._driver.click(item_data["Hashcode"], x, y)
-                    else:
-                        script = (
-                            r"""if(qt4a_web_inspect._inspect_mode){qt4a_web_inspect.fire_mouse_event('click', (%s)/window.devicePixelRatio, (%s)/window.devicePixelRatio)};"""
-                            % (x - rect["Left"], y - rect["Top"])
-                        )
-                        webview.eval_script([], script)
-                    self._chrome.bring_to_front()
-                else:
-                    if not self._chrome:
-                        script = (
-                            r"""if(qt4a_web_inspect._inspect_mode){qt4a_web_inspect.fire_mouse_event('mouseover', (%s)/window.devicePixelRatio, (%s)/window.devicePixelRatio)};"""
-                            % (x - rect["Left"], y - rect["Top"])
-                        )  #
-                        webview.eval_script([], script)
+                # 设备调用在探测线程中执行，未执行的移动事件只保留最新的
+                self._inspect_thread.post_task(
+                    None if is_click else "webview",
+                    self._inspect_web_control,
+                    self.cb_activity.GetValue(),
+                    item_data["Hashcode"],
+                    rect,
+                    x,
+                    y,
+                    is_click,
+                )
                 return
 
         if not self._enable_inspect:
             return
 
-        result = []
-        for i in range(len(self._tree_list)):
-            tree = self._tree_list[i]["tree"]
-            root = self._tree_list[i]["root"]
-            controls = self._get_current_control(tree, root, x, y)
-            if len(controls) > 0:
-                min_area = 0xFFFFFFFF
-                min_item = None
-                for item in controls:
-                    item_data = self.tree.GetItemData(item)
-                    area = item_data["Rect"]["Width"] * item_data["Rect"]["Height"]
-                    if area < min_area:
-                        min_area = area
-                        min_item = item
-                if min_item:
-                    result.append({"index": i, "item": min_item, "area": min_area})
-
-        if len(result) == 0:
+        self._inspect_thread.post_task(
+            None if is_click else "control",
+            self._inspect_control,
+            self._inspect_seq,
+            self._get_control_index(),
+            x,
+            y,
+            is_click,
+        )
+
+    def _inspect_web_control(self, window_title, hashcode, rect, x, y, is_click):
+        """在探测线程中将鼠标事件发送到WebView"""
+        try:
+            key = window_title, hashcode
+            if self._inspect_webview is None or self._inspect_webview[0] != key:
+                # 缓存WebView，避免每次鼠标移动都获取控件类型
+                webview = WebView(
+                    self._control_manager.get_driver(window_title), hashcode
+                )
+                self._inspect_webview = key, webview
+            webview = self._inspect_webview[1]
+            if is_click:
+                # 点击事件
+                if self._chrome:
+                    # 在Native层点击
+                    Log.i("WebViewDebugging", "click %d %d" % (x, y))
+                    webview._driver.click(hashcode, x, y)
+                else:
+                    script = (
+                        r"""if(qt4a_web_inspect._inspect_mode){qt4a_web_inspect.fire_mouse_event('click', (%s)/window.devicePixelRatio, (%s)/window.devicePixelRatio)};"""
+                        % (x - rect["Left"], y - rect["Top"])
+                    )
+                    webview.eval_script([], script)
+                run_in_main_thread(lambda: self._chrome.bring_to_front())()
+            elif not self._chrome:
+                script = (
+                    r"""if(qt4a_web_inspect._inspect_mode){qt4a_web_inspect.fire_mouse_event('mouseover', (%s)/window.devicePixelRatio, (%s)/window.devicePixelRatio)};"""
+                    % (x - rect["Left"], y - rect["Top"])
+                )
+                webview.eval_script([], script)
+        except ControlExpiredError:
+            # 页面已关闭
+            self._inspect_webview = None
+            run_in_main_thread(lambda: self._close_remote_web_debug())()
+        except RuntimeError:
+            Log.ex("onmouseover error")
+            self._inspect_webview = None
+            run_in_main_thread(lambda: self._close_remote_web_debug())()
+        except Exception:
+            self._inspect_webview = None  # 下次重新获取测试桩
+            raise
+
+    def _inspect_control(self, seq, control_index, x, y, is_click):
+        """在探测线程中查找坐标所在的控件，只将最新的结果交给主线程显示"""
+        if not is_click and seq != self._inspect_seq:
+            return  # 已有新的鼠标事件
+        result = control_index.hit_test(x, y)
+        if result is None:
             print("find control failed")
             return
+        self._show_inspect_result(
+            seq, control_index, result[0], result[1], x, y, is_click
+        )
 
-        # 控件树之间比较
-        min_area = 0xFFFFFFFF
-        min_item = None
-        index = None
-        for item in result:
-            if item["area"] < min_area:
-                min_area = item["area"]
-                min_item = item["item"]
-                index = item["index"]
+    @run_in_main_thread
+    def _show_inspect_result(self, seq, control_index, index, control, x, y, is_click):
+        """高亮探测到的控件，点击时在控件树中选中该控件"""
+        if control_index is not self._control_index or not self._enable_inspect:
+            return  # 控件树已变化或已结束探测
+        if not is_click and seq != self._inspect_seq:
+            return
+        tree_item = self._tree_list[index]
 
         if index != self._tree_idx:
             # 需要切换控件树
@@ -895,56 +1574,113 @@ class MainFrame(wx.Frame):
             self.tc_process_name.SetValue(self._tree_list[index]["process_name"])
             self._tree_idx = index
 
-        self._draw_mask(min_item)
+        self._draw_rect_mask(tree_item["store"].get_node(control)["Rect"])
 
-        if event.EventType == wx.EVT_LEFT_UP.typeId:
+        if is_click:
             # 点击事件
-            self._expand_tree(min_item)
-            self.tree.SelectItem(min_item)
-            self.tree.SetFocus()
+            min_item = self._get_tree_item(tree_item, control)
+            if min_item is None:
+                return
+            self._select_inspected_item(tree_item, min_item, x, y)
             self._enable_inspect = False
             self.btn_inspect.Enable(True)
             # self.cb_show_hex.SetValue(False)
 
-    def _get_current_control(self, tree, parent, x, y):
-        """获取坐标（x，y）所在的控件"""
-        item_data = tree.GetItemData(parent)
-        if item_data is None:
-            return []
+    def _select_inspected_item(self, tree_item, item, x, y):
+        """选中探测到的控件，子节点未获取时获取后继续在子节点中查找"""
 
-        rect = item_data["Rect"]
-        if x < rect["Left"] or x >= rect["Left"] + rect["Width"]:
-            return []
-        if y < rect["Top"] or y >= rect["Top"] + rect["Height"]:
-            return []
-        if not item_data["Visible"]:
-            return []
+        def on_loaded(loaded):
+            if loaded:
+                child, _ = self._get_smallest_control(
+                    self._get_current_control(tree_item, item, x, y)
+                )
+                if child is not None and child != item:
+                    self._select_inspected_item(tree_item, child, x, y)
+                    return
+            self._select_tree_item(tree_item, item)
 
-        if tree.GetChildrenCount(parent) == 0:
-            return [parent]
+        if not self._load_subtree(tree_item, item, on_loaded):
+            self._select_tree_item(tree_item, item)
 
-        result = []
-        item, cookie = tree.GetFirstChild(parent)
-        while item:
-            result.extend(self._get_current_control(tree, item, x, y))
-            if sys.platform == "win32":
-                item, cookie = tree.GetNextChild(item, cookie)
-            else:
-                item = tree.GetNextSibling(item)
+    def _select_tree_item(self, tree_item, item):
+        """展开并选中节点，控件树已切换时不再选中"""
+        if self._tree_list[self._tree_idx] is not tree_item:
+            return
+        self._expand_tree(item)
+        self.tree.SelectItem(item)
+        self.tree.SetFocus()
 
-        if len(result) == 0:
-            return [parent]
+    def _get_window_z_orders(self):
+        """获取窗口标题对应的层级，窗口列表中越靠前的窗口越靠上，值越小"""
+        if self._snapshot_file is not None:
+            titles = [it["title"] for it in self._snapshot_file.windows]
+        elif self._control_manager is not None:
+            titles = [it.title for it in self._window_manager.get_window_list()]
         else:
-            return result
+            titles = []
+        result = {}
+        for i, title in enumerate(titles):
+            result.setdefault(title, i)
+        return result
+
+    def _get_control_index(self):
+        """获取所有控件树的网格索引，控件树变化后重新构建"""
+        if self._control_index is None:
+            with Tracer.span("build_control_index"):
+                screen_size = None
+                if self._display_manager is not None:
+                    geometry = self._display_manager.geometry
+                    if geometry is not None:
+                        screen_size = geometry.size
+                elif self._snapshot_file is not None:
+                    screen_size = self._snapshot_file.screen_size
+                z_orders = self._get_window_z_orders()
+                control_index = ControlGridIndex(screen_size)
+                for tree_item in self._tree_list:
+                    tree_root = tree_item["tree"].GetItemData(tree_item["root"])
+                    control_index.add_tree(
+                        tree_item["store"],
+                        tree_root.index,
+                        z_orders.get(tree_item["window_title"], len(z_orders)),
+                    )
+            self._control_index = control_index
+        return self._control_index
+
+    def _get_smallest_control(self, controls):
+        """获取面积最小的控件及其面积"""
+        min_area = 0xFFFFFFFF
+        min_item = None
+        for item in controls:
+            item_data = self.tree.GetItemData(item)
+            area = item_data["Rect"]["Width"] * item_data["Rect"]["Height"]
+            if area < min_area:
+                min_area = area
+                min_item = item
+        return min_item, min_area
+
+    def _get_current_control(self, tree_item, parent, x, y):
+        """获取坐标（x，y）所在的控件"""
+        item_data = tree_item["tree"].GetItemData(parent)
+        if item_data is None:
+            return []
+        store = tree_item["store"]
+        index = store.find(item_data["Hashcode"])
+        if index < 0:
+            return []
+        result = []
+        for index in store.hit_test(x, y, index):
+            item = self._get_tree_item(tree_item, index)
+            if item is not None:
+                result.append(item)
+        return result
 
     def _expand_tree(self, item):
-        """展开树形控件节点"""
+        """展开树形控件节点，只创建需要显示的子节点"""
         if item != self.root:
             parent = self.tree.GetItemParent(item)
             self._expand_tree(parent)
-            self.tree.Expand(item)
-        else:
-            self.tree.Expand(self.root)
+        self._populate_children(item)
+        self.tree.Expand(item)
 
     def on_local_device_selected(self, event):
         """选择本地设备"""
@@ -978,7 +1714,7 @@ class MainFrame(wx.Frame):
     def on_auto_fresh_checked(self, event):
         """选择了自动刷新"""
         if self.cb_auto_refresh.IsChecked():
-            if not self._device:
+            if self._control_manager is None:
                 dlg = wx.MessageDialog(
                     self, "尚未选择设备", "错误", style=wx.OK | wx.ICON_ERROR
                 )
@@ -1006,11 +1742,45 @@ class MainFrame(wx.Frame):
 
     def on_refresh_timer(self, event):
         """ """
-        self._work_thread.post_task(self._refresh_device_screenshot, False)
+        if self._refresh_pending:
+            return  # 上一次刷新未完成，避免耗时超过刷新间隔时任务不断堆积
+        self._refresh_pending = True
+        self._work_thread.post_task(self._refresh_on_timer, bool(self._tree_list))
+
+    def _refresh_on_timer(self, refresh_controls):
+        """定时刷新截图及控件树"""
+        try:
+            self._refresh_device_screenshot(False)
+            if refresh_controls:
+                self._refresh_control_tree()
+        finally:
+            self._refresh_pending = False
+
+    def _refresh_control_tree(self):
+        """增量刷新已显示的控件树"""
+        with Tracer.span("refresh_controls", device=self._select_device):
+            try:
+                controls_dict, deltas = self._control_manager.get_control_tree_delta()
+            except Exception:
+                Log.ex("MainFrame", "refresh control tree failed")
+                return
+            if controls_dict:
+                self._update_control_tree_in_place(controls_dict, deltas)
+
+    @run_in_main_thread
+    def _update_control_tree_in_place(self, controls_dict, deltas):
+        """应用增量，不对应时全量重建并保持当前选择的窗口"""
+        if deltas is not None and self._apply_control_tree_deltas(
+            controls_dict, deltas
+        ):
+            return
+        tree_idx = self._tree_idx
+        self.show_controls(controls_dict)
+        self.switch_control_tree(tree_idx)
 
     def on_node_text_changed(self, event):
         """ """
-        self.btn_set_text.Enable(True)
+        self.btn_set_text.Enable(self._control_manager is not None)
 
     def on_set_text_btn_click(self, event):
         """ """
@@ -1019,6 +1789,7 @@ class MainFrame(wx.Frame):
         text = self.tc_text.GetValue()
         self._control_manager.set_control_text(window_title, hashcode, text)
         self.statusbar.SetStatusText("设置控件文本成功", 0)
+        self._work_thread.post_task(self._refresh_control_tree)
         time.sleep(0.5)
         t = threading.Thread(target=self._refresh_device_screenshot, args=(True,))
         t.setDaemon(True)
@@ -1026,57 +1797,65 @@ class MainFrame(wx.Frame):
 
     def find_webview_control(self, parent):
         """查找WebView节点"""
-        item_data = self.tree.GetItemData(parent)
+        tree_item = self._tree_list[self._tree_idx]
+        store = tree_item["store"]
         result = []
-        if not item_data["Visible"]:
-            return []
-        if item_data["Rect"]["Width"] == 0 or item_data["Rect"]["Height"] == 0:
-            return []
-        if (
-            not item_data["Type"].startswith("android.widget.")
-            and item_data["Type"]
-            != "com.android.internal.policy.impl.PhoneWindow$DecorView"
-            and item_data["Type"] != "android.view.View"
-        ):
-            if WebView.is_webview(
-                self._control_manager,
-                self.cb_activity.GetValue(),
-                item_data["Hashcode"],
+        stack = [store.find(self.tree.GetItemData(parent)["Hashcode"])]
+        while stack:
+            index = stack.pop()
+            if index < 0 or not store.is_visible(index):
+                continue
+            _, _, width, height = store.get_rect(index)
+            if width == 0 or height == 0:
+                continue
+            control_type = store.get_string(index, "Type") or ""
+            if (
+                not control_type.startswith("android.widget.")
+                and control_type
+                != "com.android.internal.policy.impl.PhoneWindow$DecorView"
+                and control_type != "android.view.View"
             ):
-                self._current_webview = parent
-                result.append(parent)
-                return result
-
-        item, cookie = self.tree.GetFirstChild(parent)
-        while item:
-            result.extend(self.find_webview_control(item))
-            if sys.platform == "win32":
-                item, cookie = self.tree.GetNextChild(item, cookie)
-            else:
-                item = self.tree.GetNextSibling(item)
+                hashcode = store.get_hashcode(index)
+                if WebView.is_webview(
+                    self._control_manager,
+                    self.cb_activity.GetValue(),
+                    hashcode,
+                ):
+                    item = self._get_tree_item(tree_item, index)
+                    if item is not None:
+                        self._current_webview = item
+                        result.append(item)
+                    continue
+            stack.extend(reversed(list(store.iter_children(index))))
         return result
 
-    def _get_control_by_hashcode(self, parent, hashcode):
-        """根据hashcode找到控件"""
-        item_data = self.tree.GetItemData(parent)
-        if item_data["Hashcode"] == hashcode:
-            return parent
-        item, cookie = self.tree.GetFirstChild(parent)
-        while item:
-            ret = self._get_control_by_hashcode(item, hashcode)
-            if ret:
-                return ret
-            if sys.platform == "win32":
-                item, cookie = self.tree.GetNextChild(item, cookie)
-            else:
-                item = self.tree.GetNextSibling(item)
-        return None
+    def _get_control_by_hashcode(self, hashcode):
+        """根据hashcode找到控件，优先在当前控件树中查找，节点未创建时创建其祖先节点的子节点
+
+        :return: (控件树序号, 树形控件节点)，不存在时返回(None, None)
+        """
+        if self._tree_list:
+            item = self._tree_list[self._tree_idx]["item_dict"].get(hashcode)
+            if item is not None:
+                return self._tree_idx, item
+        entry = self._control_items.get(hashcode)
+        if entry is None:
+            return None, None
+        index, item = entry
+        if item is None:
+            tree_item = self._tree_list[index]
+            item = self._get_tree_item(tree_item, tree_item["store"].find(hashcode))
+            if item is None:
+                return None, None
+        return index, item
 
     def _focus_control_by_hashcode(self, hashcode):
-        """将焦点放到hashcode指定的控件上"""
-        control = self._get_control_by_hashcode(self.root, hashcode)
-        if not control:
+        """将焦点放到hashcode指定的控件上，控件在其它控件树中时切换控件树"""
+        index, control = self._get_control_by_hashcode(hashcode)
+        if control is None:
             raise RuntimeError("查找控件失败：%s" % hashcode)
+        if index != self._tree_idx:
+            self.switch_control_tree(index)
         self._draw_mask(control)
         self._expand_tree(control)
         self.tree.SelectItem(control)
@@ -1415,6 +2194,7 @@ class TreeNodePopupMenu(wx.Menu):
             ret, qpath = self._gen_qpath_by_attrs(control, window_title, ctrl)
             if ret:
                 return ctrl_type, ctrl_path, qpath
+            self._parent._populate_children(ctrl)
             item, cookie = self._parent.tree.GetFirstChild(ctrl)
             while item:
                 ret, qpath = self._gen_qpath_by_attrs(control, window_title, item)
@@ -1449,7 +2229,7 @@ class TreeNodePopupMenu(wx.Menu):
             return None
             # Log.i('GetQPath', '寻找最近公共祖先')
             # hashcode_list = self._parent._control_manager.get_control(window_title, None, qpath)
-            # controls = [self._parent._get_control_by_hashcode(self._parent.root, hashcode) for hashcode in hashcode_list]
+            # controls = [self._parent._get_control_by_hashcode(hashcode)[1] for hashcode in hashcode_list]
             # ancestor = self._get_nearest_co_ancestor(controls)
             # ancestor_qpath = self._gen_qpath(ancestor)  # 获取祖先节点的QPath
             # print ancestor_qpath
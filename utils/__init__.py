@@ -19,6 +19,7 @@
 import os, sys
 import threading
 from .logger import Log
+from .tracing import Tracer
 
 
 def get_driver_root_path():
@@ -46,7 +47,7 @@ def run_in_thread(func):
             Log.ex(func.__name__, "Invoke method failed")
 
     def wrap_func(*args):
-        t = threading.Thread(target=safe_func, args=args)
+        t = threading.Thread(target=Tracer.bind(safe_func), args=args)
         t.setDaemon(True)
         t.start()
 
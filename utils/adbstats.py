@@ -0,0 +1,386 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+
+"""adb调用统计
+
+记录每次adb调用的命令类别、耗时、传输的字节数及调用位置，按会话生成耗时分布及排行，
+用于判断哪些命令需要合并或缓存
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from utils.logger import Log
+from utils.tracing import Tracer
+
+adb_stats_env = "ANDROIDUISPY_ADB_STATS"  # 退出时保存统计报告的文件路径
+
+# 需要区分子命令的shell命令
+_subcommand_shell_cmds = ("am", "cmd", "dumpsys", "pm", "service", "settings", "wm")
+_root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CommandStats(object):
+    """一类命令的统计数据"""
+
+    # 耗时分布的区间上限，单位为毫秒
+    bucket_bounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    __slots__ = (
+        "_name",
+        "_count",
+        "_errors",
+        "_total",
+        "_max",
+        "_bytes",
+        "_buckets",
+        "_callers",
+    )
+
+    def __init__(self, name):
+        self._name = name
+        self._count = 0
+        self._errors = 0
+        self._total = 0
+        self._max = 0
+        self._bytes = 0
+        self._buckets = [0] * (len(self.bucket_bounds) + 1)
+        self._callers = {}  # {caller: count}
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def errors(self):
+        return self._errors
+
+    @property
+    def total(self):
+        """总耗时，单位为秒"""
+        return self._total
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    @property
+    def callers(self):
+        return self._callers
+
+    def add(self, latency, size, caller, error=False):
+        self._count += 1
+        if error:
+            self._errors += 1
+        self._total += latency
+        self._max = max(self._max, latency)
+        self._bytes += size
+        latency_ms = latency * 1000
+        for index, bound in enumerate(self.bucket_bounds):
+            if latency_ms <= bound:
+                break
+        else:
+            index = len(self.bucket_bounds)
+        self._buckets[index] += 1
+        self._callers[caller] = self._callers.get(caller, 0) + 1
+
+    def get_percentile(self, percent):
+        """根据耗时分布估算百分位耗时，返回所在区间的上限（不超过最大耗时），单位为毫秒"""
+        threshold = self._count * percent / 100.0
+        count = 0
+        for index, it in enumerate(self._buckets):
+            count += it
+            if count >= threshold and it:
+                if index < len(self.bucket_bounds):
+                    return min(self.bucket_bounds[index], self._max * 1000)
+                break
+        return self._max * 1000
+
+    def get_top_callers(self, count=3):
+        return sorted(self._callers.items(), key=lambda it: it[1], reverse=True)[:count]
+
+    def to_dict(self):
+        return {
+            "name": self._name,
+            "count": self._count,
+            "errors": self._errors,
+            "total_ms": self._total * 1000,
+            "max_ms": self._max * 1000,
+            "bytes": self._bytes,
+            "buckets": dict(
+                zip(
+                    ["<=%dms" % it for it in self.bucket_bounds]
+                    + [">%dms" % self.bucket_bounds[-1]],
+                    self._buckets,
+                )
+            ),
+            "callers": self._callers,
+        }
+
+
+class AdbStats(object):
+    """一个设备会话中的adb调用统计"""
+
+    def __init__(self, device_id):
+        self._device_id = device_id
+        self._start_time = time.time()
+        self._commands = {}  # {command_class: CommandStats}
+        self._actions = {}  # {action: [调用数, 耗时, set(root_span_id)]}
+        self._lock = threading.Lock()
+
+    @property
+    def device_id(self):
+        return self._device_id
+
+    @property
+    def commands(self):
+        return self._commands
+
+    @staticmethod
+    def _get_shell_command_name(cmdline):
+        """获取单条shell命令的名称，管道命令只取第一个命令"""
+        items = cmdline.split("|")[0].replace("'", " ").replace('"', " ").split()
+        if items[:2] == ["su", "-c"]:
+            items = items[2:]
+        if not items:
+            return None
+        name = items[0].split("/")[-1]
+        if name in _subcommand_shell_cmds:
+            for it in items[1:]:
+                if not it.startswith("-"):
+                    return "%s %s" % (name, it)
+        return name
+
+    @staticmethod
+    def get_command_class(method, args):
+        """获取命令类别
+
+        shell命令使用命令名，部分命令包含子命令，如：shell:dumpsys window；
+        合并执行的多条命令使用+连接，忽略其中用于分隔输出的echo
+        """
+        if method != "run_shell_cmd" or not args:
+            return method
+        cmdline = args[0]
+        if isinstance(cmdline, (list, tuple)):
+            cmdline = " ".join(cmdline)
+        names = []
+        for it in re.split(r";|&&|\|\|", cmdline):
+            name = AdbStats._get_shell_command_name(it)
+            if name is not None and name not in names:
+                names.append(name)
+        if len(names) > 1 and "echo" in names:
+            names.remove("echo")
+        if not names:
+            return "shell"
+        return "shell:%s" % "+".join(names)
+
+    @staticmethod
+    def get_caller():
+        """获取本项目中发起调用的位置，如：manager/snapshot.py:_fetch_dumpsys"""
+        frame = sys._getframe(2)
+        while frame is not None:
+            path = frame.f_code.co_filename
+            if path.startswith(_root_dir) and not path.endswith("adbstats.py"):
+                path = os.path.relpath(path, _root_dir).replace(os.sep, "/")
+                return "%s:%s" % (path, frame.f_code.co_name)
+            frame = frame.f_back
+        return "unknown"
+
+    @staticmethod
+    def _get_action():
+        """当前的用户操作，即最外层的Span"""
+        span = Tracer.current_span()
+        if span is None:
+            return None
+        return span.root
+
+    def add(self, method, args, latency, size, caller, error=False):
+        command_class = self.get_command_class(method, args)
+        action = self._get_action()
+        with self._lock:
+            stats = self._commands.get(command_class)
+            if stats is None:
+                stats = self._commands[command_class] = CommandStats(command_class)
+            stats.add(latency, size, caller, error)
+            if action is not None:
+                item = self._actions.setdefault(action.name, [0, 0, set()])
+                item[0] += 1
+                item[1] += latency
+                item[2].add(action.id)
+
+    def get_top_commands(self, count=10):
+        """按总耗时排序的命令类别"""
+        with self._lock:
+            items = list(self._commands.values())
+        items.sort(key=lambda it: it.total, reverse=True)
+        return items[:count]
+
+    def format_report(self, count=10):
+        """生成文本格式的统计报告"""
+        top_commands = self.get_top_commands(count)
+        with self._lock:
+            commands = list(self._commands.values())
+            actions = [
+                (name, it[0], it[1], len(it[2])) for name, it in self._actions.items()
+            ]
+        lines = [
+            "device: %s, duration: %ds, calls: %d, total: %.0fms, bytes: %d"
+            % (
+                self._device_id,
+                time.time() - self._start_time,
+                sum(it.count for it in commands),
+                sum(it.total for it in commands) * 1000,
+                sum(it.bytes for it in commands),
+            ),
+            "",
+            "%-40s %6s %6s %10s %8s %8s %8s %10s  %s"
+            % (
+                "command",
+                "count",
+                "errors",
+                "total(ms)",
+                "p50(ms)",
+                "p90(ms)",
+                "max(ms)",
+                "bytes",
+                "top callers",
+            ),
+        ]
+        for it in top_commands:
+            lines.append(
+                "%-40s %6d %6d %10.0f %8.0f %8.0f %8.0f %10d  %s"
+                % (
+                    it.name,
+                    it.count,
+                    it.errors,
+                    it.total * 1000,
+                    it.get_percentile(50),
+                    it.get_percentile(90),
+                    it.max * 1000,
+                    it.bytes,
+                    ", ".join("%s(%d)" % caller for caller in it.get_top_callers()),
+                )
+            )
+        if actions:
+            actions.sort(key=lambda it: it[2], reverse=True)
+            lines.append("")
+            lines.append(
+                "%-40s %6s %10s %10s" % ("action", "times", "calls/time", "ms/time")
+            )
+            for name, calls, latency, times in actions:
+                lines.append(
+                    "%-40s %6d %10.1f %10.0f"
+                    % (name, times, calls / times, latency * 1000 / times)
+                )
+        return "\n".join(lines)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "device_id": self._device_id,
+                "start_time": self._start_time,
+                "duration": time.time() - self._start_time,
+                "commands": [it.to_dict() for it in self._commands.values()],
+                "actions": dict(
+                    (
+                        name,
+                        {"times": len(it[2]), "calls": it[0], "total_ms": it[1] * 1000},
+                    )
+                    for name, it in self._actions.items()
+                ),
+            }
+
+    def save(self, path):
+        """保存统计报告，扩展名为.json时保存为JSON格式，否则保存为文本"""
+        if path.endswith(".json"):
+            content = json.dumps(self.to_dict(), indent=2)
+        else:
+            content = self.format_report(sys.maxsize)
+        with open(path, "w") as fp:
+            fp.write(content)
+        Log.i("AdbStats", "save adb stats of %s to %s" % (self._device_id, path))
+
+
+class AdbStatsProxy(object):
+    """转发对adb对象的调用并记录统计数据
+
+    异步执行的shell命令只统计启动耗时，不统计输出的字节数
+    """
+
+    def __init__(self, adb, stats):
+        self._adb = adb
+        self._stats = stats
+
+    @property
+    def wrapped_object(self):
+        return self._adb
+
+    @property
+    def stats(self):
+        return self._stats
+
+    @staticmethod
+    def _get_size(method, args, result):
+        if isinstance(result, (bytes, str)):
+            return len(result)
+        if method in ("pull_file", "push_file"):
+            path = args[1] if method == "pull_file" else args[0]
+            if os.path.isfile(path):
+                return os.path.getsize(path)
+        return 0
+
+    def __getattr__(self, attr):
+        value = getattr(self._adb, attr)
+        if not callable(value):
+            return value
+
+        def wrap_func(*args, **kwargs):
+            caller = self._stats.get_caller()
+            time0 = time.time()
+            try:
+                result = value(*args, **kwargs)
+            except Exception:
+                self._stats.add(attr, args, time.time() - time0, 0, caller, True)
+                raise
+            latency = time.time() - time0
+            try:
+                size = self._get_size(attr, args, result)
+            except (IndexError, TypeError, EnvironmentError):
+                size = 0
+            self._stats.add(attr, args, latency, size, caller)
+            return result
+
+        return wrap_func
+
+
+if __name__ == "__main__":
+    pass
@@ -27,3 +27,9 @@ class WebViewDebuggingNotEnabledError(RuntimeError):
     """WebView调试未开启"""
 
     pass
+
+
+class CaptureTimeoutError(RuntimeError):
+    """抓取控件树超时"""
+
+    pass
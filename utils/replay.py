@@ -0,0 +1,360 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""设备调用的录制与回放
+
+录制时记录adb命令、测试桩调用及拉取的文件，连同返回值和耗时保存到会话文件中；
+回放时使用会话文件中的结果代替真实设备，用于在没有设备的环境中测试及评估性能
+"""
+
+import base64
+import builtins
+import copy
+import json
+import os
+import threading
+import time
+
+from qt4a.androiddriver import util as driver_util
+
+from utils.logger import Log
+
+record_env = "ANDROIDUISPY_RECORD"  # 录制的会话文件路径
+replay_env = "ANDROIDUISPY_REPLAY"  # 回放的会话文件路径
+replay_latency_env = "ANDROIDUISPY_REPLAY_LATENCY"  # 回放时的耗时倍数
+
+
+class EnumRecordTarget(object):
+    """被录制的对象"""
+
+    Device = "device"
+    ADB = "adb"
+    Driver = "driver"
+
+
+class ReplayError(RuntimeError):
+    """会话文件中没有可回放的结果"""
+
+    pass
+
+
+class ReplaySession(object):
+    """一次录制的全部调用"""
+
+    version = 2  # 2：文件方法的本地路径不再参与匹配
+    # 会写入文件的方法及文件路径参数的位置，录制时保存文件内容
+    file_methods = {"pull_file": 1, "take_screen_shot": 0}
+
+    def __init__(self, device_id=None, records=None):
+        self._device_id = device_id
+        self._records = records or []
+        self._lock = threading.Lock()
+
+    @property
+    def device_id(self):
+        return self._device_id
+
+    @property
+    def records(self):
+        return self._records
+
+    @staticmethod
+    def make_key(target, name, method, args, kwargs):
+        """生成用于匹配调用的键，参数无法序列化时使用repr
+
+        文件方法的本地路径与运行时的当前目录有关，与异步执行的sync参数一样不参与匹配
+        """
+        index = ReplaySession.file_methods.get(method)
+        if index is not None and len(args) > index:
+            args = list(args)
+            args[index] = "<file>"
+        return json.dumps(
+            [target, name, method, list(args), kwargs], sort_keys=True, default=repr
+        )
+
+    def add_record(
+        self,
+        target,
+        name,
+        method,
+        args,
+        kwargs,
+        result=None,
+        error=None,
+        latency=0,
+        file_data=None,
+    ):
+        """添加一次调用
+
+        :param target:    调用的对象类型，EnumRecordTarget
+        :type  target:    string
+        :param name:      对象名称，测试桩为进程名
+        :type  name:      string
+        :param error:     调用抛出的异常
+        :type  error:     Exception
+        :param latency:   调用耗时，单位为秒
+        :type  latency:   float
+        :param file_data: 调用写入的文件内容
+        :type  file_data: bytes
+        """
+        record = {
+            "key": self.make_key(target, name, method, args, kwargs),
+            "latency": latency,
+        }
+        if error is not None:
+            record["error"] = [error.__class__.__name__, "%s" % error]
+        else:
+            try:
+                # 立即序列化，避免调用方之后修改返回值
+                record["result"] = json.loads(json.dumps(result))
+            except (TypeError, ValueError):
+                record["repr"] = repr(result)  # 如socket等无法回放的对象
+        if file_data is not None:
+            record["file"] = base64.b64encode(file_data).decode("ascii")
+        with self._lock:
+            self._records.append(record)
+
+    def save(self, path):
+        """保存到会话文件"""
+        with self._lock:
+            data = {
+                "version": self.version,
+                "device_id": self._device_id,
+                "records": list(self._records),
+            }
+        with open(path, "w") as fp:
+            json.dump(data, fp)
+        Log.i("ReplaySession", "save %d records to %s" % (len(data["records"]), path))
+
+    @staticmethod
+    def load(path):
+        """从会话文件加载"""
+        with open(path) as fp:
+            data = json.load(fp)
+        if data.get("version", 0) > ReplaySession.version:
+            raise ReplayError("不支持的会话文件版本：%s" % data["version"])
+        if data.get("version", 0) < 2:
+            for record in data["records"]:
+                record["key"] = ReplaySession.make_key(*json.loads(record["key"]))
+        return ReplaySession(data["device_id"], data["records"])
+
+
+class RecordingProxy(object):
+    """转发并记录对真实对象的调用"""
+
+    def __init__(self, obj, session, target, name=None):
+        self._obj = obj
+        self._session = session
+        self._target = target
+        self._name = name
+        self._adb = None
+
+    @property
+    def wrapped_object(self):
+        """被录制的真实对象"""
+        return self._obj
+
+    def __getattr__(self, attr):
+        value = getattr(self._obj, attr)
+        if attr == "adb" and self._target == EnumRecordTarget.Device:
+            if self._adb is None or self._adb.wrapped_object is not value:
+                self._adb = RecordingProxy(value, self._session, EnumRecordTarget.ADB)
+            return self._adb
+        if not callable(value):
+            return value  # 如_device_id等属性
+
+        def wrap_func(*args, **kwargs):
+            if attr == "run_shell_cmd" and kwargs.get("sync") is False:
+                # 异步执行的命令改为一次读取全部输出，调用方会按同步结果处理
+                kwargs = dict(kwargs)
+                kwargs.pop("sync")
+            time0 = time.time()
+            try:
+                result = value(*args, **kwargs)
+            except Exception as e:
+                self._session.add_record(
+                    self._target,
+                    self._name,
+                    attr,
+                    args,
+                    kwargs,
+                    error=e,
+                    latency=time.time() - time0,
+                )
+                raise
+            latency = time.time() - time0
+            file_data = None
+            index = self._session.file_methods.get(attr)
+            if index is not None and len(args) > index and os.path.isfile(args[index]):
+                with open(args[index], "rb") as fp:
+                    file_data = fp.read()
+            self._session.add_record(
+                self._target,
+                self._name,
+                attr,
+                args,
+                kwargs,
+                result,
+                latency=latency,
+                file_data=file_data,
+            )
+            return result
+
+        return wrap_func
+
+
+class SessionRecorder(object):
+    """录制设备及测试桩的调用"""
+
+    def __init__(self, device):
+        self._session = ReplaySession(device._device_id)
+        self._device = RecordingProxy(device, self._session, EnumRecordTarget.Device)
+
+    @property
+    def session(self):
+        return self._session
+
+    @property
+    def device(self):
+        """用于代替真实设备的录制对象"""
+        return self._device
+
+    def wrap_driver_factory(self, factory):
+        """包装DriverPool的测试桩创建方法，创建耗时记录为create调用"""
+
+        def create_driver(process_name, device):
+            device = getattr(device, "wrapped_object", device)
+            time0 = time.time()
+            driver = factory(process_name, device)
+            self._session.add_record(
+                EnumRecordTarget.Driver,
+                process_name,
+                "create",
+                (),
+                {},
+                latency=time.time() - time0,
+            )
+            return RecordingProxy(
+                driver, self._session, EnumRecordTarget.Driver, process_name
+            )
+
+        return create_driver
+
+
+class ReplayProxy(object):
+    """将调用转为从会话中查找结果"""
+
+    def __init__(self, player, target, name=None):
+        self._player = player
+        self._target = target
+        self._name = name
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+
+        def wrap_func(*args, **kwargs):
+            return self._player.replay(self._target, self._name, attr, args, kwargs)
+
+        return wrap_func
+
+
+class ReplayDevice(ReplayProxy):
+    """代替DeviceDriver的回放对象"""
+
+    def __init__(self, player, device_id):
+        super(ReplayDevice, self).__init__(player, EnumRecordTarget.Device)
+        self._device_id = device_id
+        self.adb = ReplayProxy(player, EnumRecordTarget.ADB)
+
+
+class ReplayPlayer(object):
+    """回放会话中的调用
+
+    同一调用录制了多次时按录制顺序依次返回，用完后重复返回最后一次的结果
+    """
+
+    def __init__(self, session, latency_scale=0):
+        """
+
+        :param latency_scale: 回放时按录制耗时的倍数等待，为0时不等待
+        :type  latency_scale: float
+        """
+        self._session = session
+        self._latency_scale = latency_scale
+        self._records = {}  # {key: [record, ...]}
+        for record in session.records:
+            self._records.setdefault(record["key"], []).append(record)
+        self._cursors = {}  # {key: index}
+        self._lock = threading.Lock()
+        self._device = ReplayDevice(self, session.device_id)
+
+    @property
+    def device(self):
+        """用于代替DeviceDriver的回放对象"""
+        return self._device
+
+    def create_driver(self, process_name, device):
+        """创建回放的测试桩，可作为DriverPool的测试桩创建方法"""
+        key = ReplaySession.make_key(
+            EnumRecordTarget.Driver, process_name, "create", (), {}
+        )
+        if key in self._records:
+            self._get_record(key)  # 等待录制时的创建耗时
+        return ReplayProxy(self, EnumRecordTarget.Driver, process_name)
+
+    def _get_record(self, key):
+        records = self._records.get(key)
+        if not records:
+            raise ReplayError("会话中没有该调用：%s" % key)
+        with self._lock:
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = index + 1
+        record = records[min(index, len(records) - 1)]
+        if self._latency_scale:
+            time.sleep(record["latency"] * self._latency_scale)
+        return record
+
+    def replay(self, target, name, method, args, kwargs):
+        """返回录制的结果，录制时抛出异常的调用会抛出同类型的异常"""
+        if method == "run_shell_cmd" and kwargs.get("sync") is False:
+            kwargs = dict(kwargs)
+            kwargs.pop("sync")
+        record = self._get_record(
+            ReplaySession.make_key(target, name, method, args, kwargs)
+        )
+        if "file" in record:
+            index = ReplaySession.file_methods[method]
+            with open(args[index], "wb") as fp:
+                fp.write(base64.b64decode(record["file"]))
+        if "error" in record:
+            error_type, message = record["error"]
+            raise _get_error_type(error_type)(message)
+        if "repr" in record:
+            raise ReplayError("%s的返回值无法回放：%s" % (method, record["repr"]))
+        return copy.deepcopy(record["result"])  # 调用方可能会修改返回值
+
+
+def _get_error_type(name):
+    """根据名称获取异常类，未知的异常使用RuntimeError"""
+    for module in (builtins, driver_util):
+        error_type = getattr(module, name, None)
+        if isinstance(error_type, type) and issubclass(error_type, Exception):
+            return error_type
+    return RuntimeError
+
+
+if __name__ == "__main__":
+    pass
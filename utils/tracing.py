@@ -0,0 +1,348 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""耗时跟踪
+
+使用嵌套的Span记录各阶段的耗时，子Span继承父Span的标签（如设备、进程），
+可以导出为Chrome trace-event格式，在chrome://tracing中查看
+"""
+
+import collections
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+
+class Span(object):
+    """一个阶段的耗时记录"""
+
+    __slots__ = (
+        "_id",
+        "_name",
+        "_parent",
+        "_root",
+        "_finished",
+        "_tags",
+        "_start",
+        "_end",
+        "_thread_id",
+        "_thread_name",
+    )
+
+    def __init__(self, span_id, name, parent=None, tags=None):
+        self._id = span_id
+        self._name = name
+        self._parent = parent
+        self._root = parent.root if parent is not None else self
+        self._finished = None  # 根Span上记录的已结束的子孙Span，最多保留max_spans个
+        if parent is None:
+            self._finished = collections.deque(maxlen=Tracer.max_spans)
+        self._tags = dict(parent.tags) if parent is not None else {}
+        if tags:
+            self._tags.update(tags)
+        self._start = time.time()
+        self._end = None
+        thread = threading.current_thread()
+        self._thread_id = thread.ident
+        self._thread_name = thread.name
+
+    def __str__(self):
+        return "<Span %s %.1fms %s>" % (self._name, self.duration * 1000, self._tags)
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @property
+    def root(self):
+        """最外层的Span，即所属的用户操作"""
+        return self._root
+
+    @property
+    def tags(self):
+        return self._tags
+
+    @property
+    def start(self):
+        return self._start
+
+    @property
+    def end(self):
+        return self._end
+
+    @property
+    def duration(self):
+        """耗时，未结束时为到当前的耗时"""
+        return (self._end or time.time()) - self._start
+
+    @property
+    def thread_id(self):
+        return self._thread_id
+
+    @property
+    def thread_name(self):
+        return self._thread_name
+
+    def set_tag(self, key, value):
+        self._tags[key] = value
+
+    def finish(self):
+        self._end = time.time()
+
+
+class _SpanContext(object):
+    """with语句中使用的Span，退出时结束并记录"""
+
+    __slots__ = ("_name", "_tags", "_span")
+
+    def __init__(self, name, tags):
+        self._name = name
+        self._tags = tags
+        self._span = None
+
+    def __enter__(self):
+        self._span = Tracer.start_span(self._name, **self._tags)
+        return self._span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._span.set_tag("error", exc_type.__name__)
+        Tracer.finish_span(self._span)
+        return False
+
+
+class _NullContext(object):
+    """关闭跟踪时使用的空实现"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_context = _NullContext()
+
+
+class Tracer(object):
+    """耗时跟踪，每个线程维护当前的Span栈
+
+    跨线程执行的任务需要使用bind包装，使其中的Span成为提交任务时所在Span的子Span
+    """
+
+    enabled = True
+    max_spans = 20000  # 最多保留的已结束Span数，超过时丢弃最早的记录
+    spans = collections.deque(maxlen=max_spans)
+    _local = threading.local()
+    _ids = itertools.count(1)
+
+    @staticmethod
+    def set_max_spans(max_spans):
+        """修改最多保留的已结束Span数
+
+        spans的maxlen在创建时确定，直接修改max_spans不会生效
+        """
+        Tracer.max_spans = max_spans
+        Tracer.spans = collections.deque(Tracer.spans, maxlen=max_spans)
+
+    @staticmethod
+    def _get_stack():
+        stack = getattr(Tracer._local, "stack", None)
+        if stack is None:
+            stack = Tracer._local.stack = []
+        return stack
+
+    @staticmethod
+    def current_span():
+        """当前线程正在执行的Span"""
+        stack = Tracer._get_stack()
+        return stack[-1] if stack else None
+
+    @staticmethod
+    def start_span(name, **tags):
+        """开始一个Span，需要调用finish_span结束"""
+        span = Span(next(Tracer._ids), name, Tracer.current_span(), tags)
+        Tracer._get_stack().append(span)
+        return span
+
+    @staticmethod
+    def finish_span(span):
+        span.finish()
+        stack = Tracer._get_stack()
+        if span in stack:
+            del stack[stack.index(span) :]
+        if span.root is not span:
+            span.root._finished.append(span)
+        Tracer.spans.append(span)
+
+    @staticmethod
+    def span(name, **tags):
+        """返回记录一个阶段的上下文管理器
+
+        :param name: 阶段名称
+        :type  name: string
+        :param tags: 标签，如device、process
+        :type  tags: dict
+        """
+        if not Tracer.enabled:
+            return _null_context
+        return _SpanContext(name, tags)
+
+    @staticmethod
+    def trace(name=None):
+        """记录函数耗时的装饰器"""
+
+        def decorator(func):
+            span_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrap_func(*args, **kwargs):
+                with Tracer.span(span_name):
+                    return func(*args, **kwargs)
+
+            return wrap_func
+
+        return decorator
+
+    @staticmethod
+    def bind(func):
+        """包装在其它线程中执行的函数，使其继承当前的Span"""
+        parent = Tracer.current_span()
+        if parent is None or not Tracer.enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrap_func(*args, **kwargs):
+            stack = Tracer._get_stack()
+            saved = list(stack)
+            stack[:] = [parent]
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stack[:] = saved
+
+        return wrap_func
+
+    @staticmethod
+    def get_descendants(span):
+        """已结束的所有子孙Span，按开始时间排序
+
+        只遍历同一个根Span下的Span，不受全局保留的Span数量影响，
+        但长时间运行的根Span只保留最近结束的max_spans个子孙Span
+        """
+        if span is span.root:
+            result = list(span._finished)
+            result.sort(key=lambda it: it.start)
+            return result
+        result = []
+        for it in list(span.root._finished):
+            parent = it.parent
+            while parent is not None and parent is not span:
+                parent = parent.parent
+            if parent is span:
+                result.append(it)
+        result.sort(key=lambda it: it.start)
+        return result
+
+    @staticmethod
+    def summarize(span, max_items=4):
+        """生成用于状态栏显示的摘要，列出耗时最长的几个最底层阶段
+
+        同一线程中的同名阶段（如多次获取Weex字段）累加，不同线程中并发执行的同名阶段取最大值
+        """
+        descendants = Tracer.get_descendants(span)
+        parents = set(id(it.parent) for it in descendants)
+        durations = {}  # {name: {thread_id: duration}}
+        for it in descendants:
+            if id(it) in parents:
+                continue
+            thread_durations = durations.setdefault(it.name, {})
+            thread_durations[it.thread_id] = (
+                thread_durations.get(it.thread_id, 0) + it.duration
+            )
+        items = sorted(
+            ((name, max(it.values())) for name, it in durations.items()),
+            key=lambda it: it[1],
+            reverse=True,
+        )
+        result = "%s %dms" % (span.name, span.duration * 1000)
+        if items:
+            result += ": " + ", ".join(
+                "%s %dms" % (name, duration * 1000)
+                for name, duration in items[:max_items]
+            )
+        return result
+
+    @staticmethod
+    def export_chrome_trace(path, spans=None):
+        """导出为Chrome trace-event格式
+
+        :param path:  导出的文件路径
+        :type  path:  string
+        :param spans: 要导出的Span，为None时导出全部已结束的Span
+        :type  spans: list
+        """
+        if spans is None:
+            spans = list(Tracer.spans)
+        pid = os.getpid()
+        events = []
+        thread_names = {}
+        for span in spans:
+            thread_names[span.thread_id] = span.thread_name
+            args = dict((key, "%s" % value) for key, value in span.tags.items())
+            if span.parent is not None:
+                args["parent"] = span.parent.name
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.tags.get("device") or "AndroidUISpy",
+                    "ph": "X",
+                    "ts": int(span.start * 1000000),
+                    "dur": int(span.duration * 1000000),
+                    "pid": pid,
+                    "tid": span.thread_id,
+                    "args": args,
+                }
+            )
+        for thread_id, thread_name in thread_names.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": thread_id,
+                    "args": {"name": thread_name},
+                }
+            )
+        with open(path, "w") as fp:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+        return len(spans)
+
+
+if __name__ == "__main__":
+    pass
@@ -16,13 +16,18 @@
 """工作线程
 """
 
+import collections
+import concurrent.futures
+import itertools
 import time
 import threading
 
 try:
-    from Queue import Queue
+    from Queue import Empty, Queue
 except ImportError:
-    from queue import Queue
+    from queue import Empty, Queue
+
+from utils.tracing import Tracer
 
 
 class Task(object):
@@ -63,5 +68,117 @@ class WorkThread(object):
 
     def post_task(self, func, *args, **kwargs):
         """发送任务"""
-        task = Task(func, *args, **kwargs)
+        task = Task(Tracer.bind(func), *args, **kwargs)
         self._task_queue.put(task)
+
+
+class DaemonThreadPool(object):
+    """使用守护线程的线程池，提交任务返回concurrent.futures.Future
+
+    concurrent.futures.ThreadPoolExecutor的线程会在进程退出时被等待，设备调用卡住时会导致无法退出
+    """
+
+    def __init__(self, max_workers, name="DaemonThreadPool"):
+        self._max_workers = max_workers
+        self._name = name
+        self._threads = []
+        self._task_queue = Queue()
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def _work_thread(self):
+        while True:
+            item = self._task_queue.get()
+            if item is None:
+                self._task_queue.put(None)  # 通知其它线程退出
+                return
+            future, task = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = task.run()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def submit(self, func, *args, **kwargs):
+        """提交任务，线程数未达到max_workers时创建新线程"""
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("%s is shutdown" % self._name)
+            self._task_queue.put((future, Task(func, *args, **kwargs)))
+            if len(self._threads) < self._max_workers:
+                thread = threading.Thread(
+                    target=self._work_thread,
+                    name="%s_%d" % (self._name, len(self._threads)),
+                )
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        return future
+
+    def shutdown(self):
+        """取消尚未执行的任务，不等待正在执行的任务"""
+        with self._lock:
+            self._shutdown = True
+        while True:
+            try:
+                item = self._task_queue.get_nowait()
+            except Empty:
+                break
+            if item is not None:
+                item[0].cancel()
+        self._task_queue.put(None)
+
+
+class CoalescingWorkThread(object):
+    """合并任务的工作线程
+
+    使用相同key提交的任务在执行前会被最新提交的任务替换，相邻任务的执行间隔不小于interval，
+    用于处理鼠标移动等只关心最新状态的高频事件；key为None的任务（如点击）不会被替换
+    """
+
+    def __init__(self, interval=0):
+        """
+
+        :param interval: 相邻任务的最小执行间隔，单位为秒
+        :type  interval: float
+        """
+        self._interval = interval
+        self._next_time = 0
+        self._tasks = collections.OrderedDict()  # {key: Task}，按提交顺序执行
+        self._task_ids = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._work_thread)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _work_thread(self):
+        while True:
+            delay = self._next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)  # 等待期间提交的任务会替换尚未执行的同key任务
+            with self._condition:
+                while not self._tasks:
+                    self._condition.wait()
+                _, task = self._tasks.popitem(last=False)
+            self._next_time = time.time() + self._interval
+            try:
+                task.run()
+            except:
+                import traceback
+
+                traceback.print_exc()
+
+    def post_task(self, key, func, *args, **kwargs):
+        """发送任务，替换尚未执行的相同key的任务"""
+        task = Task(Tracer.bind(func), *args, **kwargs)
+        with self._condition:
+            if key is None:
+                key = (None, next(self._task_ids))
+            else:
+                self._tasks.pop(key, None)  # 替换的任务排在之前提交的任务之后
+            self._tasks[key] = task
+            self._condition.notify()